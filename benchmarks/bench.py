@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+"""Benchmarks of scikick's own overhead on synthetic projects
+
+Projects of --sizes pages are generated in a temporary directory with the
+dependency shape --shapes and the pages spread over directories --depth
+levels deep. The pages are "executed" by a no-op executor that writes
+their md, html and benchmark files (so neither R nor Jupyter is needed)
+and the project is up to date when the steps are timed.
+
+Usage:
+    python benchmarks/bench.py [--sizes 10,100] [--shapes chain,diamond]
+        [--depth 2] [--repeat 3] [--output results.json]
+    python benchmarks/bench.py --compare old.json new.json
+
+Results are written as JSON ({"meta": ..., "results": [...]}) so that
+runs on different commits can be compared with --compare.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+default_sizes = [10, 100, 1000, 10000]
+shapes = ["chain", "fanout", "diamond", "independent"]
+# pages in each directory of the generated projects
+pages_per_dir = 20
+# subdirectories of each directory
+branching = 4
+# pages between the source and the sink of a diamond
+diamond_width = 8
+
+### Synthetic projects
+
+def page_dir(i, depth):
+    """Directory of the i-th page, depth levels deep"""
+    leaf = i // pages_per_dir
+    parts = list()
+    for level in range(depth - 1):
+        parts.append(f"d{leaf % branching}")
+        leaf //= branching
+    parts.append(f"top{leaf}")
+    return "/".join(reversed(parts))
+
+def page_deps(i, shape):
+    """Indices of the pages the i-th page depends on"""
+    if shape == "chain":
+        return [i - 1] if i > 0 else []
+    if shape == "fanout":
+        return [0] if i > 0 else []
+    if shape == "diamond":
+        # source, diamond_width pages, sink (the source of the next diamond)
+        block, pos = divmod(i, diamond_width + 1)
+        source = block * (diamond_width + 1)
+        if pos == 0:
+            # sink of the previous diamond
+            return list(range(source - diamond_width, source)) if block > 0 else []
+        return [source]
+    return []
+
+def generate_project(path, size, shape, depth):
+    """Write scikick.yml and the pages of a synthetic project"""
+    pages = [f"{page_dir(i, depth)}/page{i}.Rmd" for i in range(size)]
+    lines = ["reportdir: report", "analysis: !!omap"]
+    for i, page in enumerate(pages):
+        deps = [pages[dep] for dep in page_deps(i, shape)]
+        if i == 0:
+            deps.append("data/input.csv")
+        lines.append(f"- {page}:")
+        lines += [f"  - {dep}" for dep in deps]
+    os.makedirs(os.path.join(path, "data"))
+    with open(os.path.join(path, "data", "input.csv"), "w") as data:
+        data.write("x\n1\n")
+    for page in pages:
+        os.makedirs(os.path.join(path, os.path.dirname(page)), exist_ok=True)
+        with open(os.path.join(path, page), "w") as rmd:
+            rmd.write(f"# {page}\n\n```{{r}}\n1\n```\n")
+    with open(os.path.join(path, "scikick.yml"), "w") as yml:
+        yml.write("\n".join(lines) + "\n")
+    return pages
+
+def noop_execute(path):
+    """Write the outputs of every page of the project in path as sk run
+    would (without executing the pages), so that it is up to date
+    """
+    from scikick.config import ScikickConfig
+    from scikick.workflow.site_rules.render_site_yamlgen import write_site_files
+    with chdir(path):
+        # writes the version info to scikick.yml before the steps are timed
+        skconf = ScikickConfig()
+        write_site_files(skconf)
+        outputs = list()
+        for exe, md, html, _, out_base, _, _, _ in skconf.exe_core_outputs:
+            benchmark = os.path.join(skconf.report_dir, "benchmark", out_base)
+            for output, text in [(md, f"# {exe}\n"), (benchmark, ""),
+                (html, f"<html><body>{exe}</body></html>\n")]:
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+                with open(output, "w") as output_file:
+                    output_file.write(text)
+                outputs.append(output)
+        # outputs are newer than the scripts and site files
+        now = time.time()
+        for output in outputs:
+            offset = 2 if output.endswith(".html") else 1
+            os.utime(output, (now + offset, now + offset))
+
+@contextlib.contextmanager
+def chdir(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+### Steps
+
+def step_config_load(path):
+    """ScikickConfig from scikick.yml (without the project model cache)"""
+    from scikick.config import ScikickConfig
+    shutil.rmtree(os.path.join(path, "report", "sk_cache"), ignore_errors=True)
+    return lambda: ScikickConfig()
+
+def step_config_load_cached(path):
+    """ScikickConfig from the project model cache"""
+    from scikick.config import ScikickConfig
+    ScikickConfig(readonly=True).save_model()
+    return lambda: ScikickConfig(readonly=True)
+
+def step_inferred_inputs(path):
+    from scikick.config import ScikickConfig
+    skconf = ScikickConfig(readonly=True)
+    return lambda: skconf.inferred_inputs
+
+def step_site_files(path):
+    """_site.yml (and project map input) generation"""
+    from scikick.config import ScikickConfig
+    from scikick.workflow.site_rules.render_site_yamlgen import site_files
+    skconf = ScikickConfig(readonly=True)
+    return lambda: site_files(skconf)
+
+def step_make_dag(path):
+    """graphviz source of the full project map (without layout)"""
+    from scikick.config import ScikickConfig
+    from scikick.graph import make_dag
+    skconf = ScikickConfig(readonly=True)
+    return lambda: make_dag(skconf).source
+
+def step_snakefile_parse(path):
+    """snakemake parsing scikick's Snakefile (listing the rules)"""
+    from scikick.config import ScikickConfig
+    from scikick.snakemake import SnakemakeMonitor, snakemake_inprocess
+    skconf = ScikickConfig(readonly=True)
+    def parse():
+        with open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull):
+            snakemake_inprocess(skconf, SnakemakeMonitor(quiet=True),
+                workdir=path, listrules=True)
+    return parse
+
+def command(cmd):
+    def run():
+        subprocess.run(cmd, shell=True, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL, check=True)
+    return run
+
+def step_sk_status(path):
+    return command("sk status")
+
+def step_sk_run_dryrun(path):
+    return command("sk run --dryrun")
+
+def step_sk_mv(path):
+    """sk mv of the first top level directory (on a copy of the project)"""
+    return command("sk mv top0 moved")
+
+# name: (function preparing the timed callable, does it modify the project)
+steps = {
+    "config_load": (step_config_load, False),
+    "config_load_cached": (step_config_load_cached, False),
+    "inferred_inputs": (step_inferred_inputs, False),
+    "site_files": (step_site_files, False),
+    "make_dag": (step_make_dag, False),
+    "snakefile_parse": (step_snakefile_parse, False),
+    "sk_status": (step_sk_status, False),
+    "sk_run_dryrun": (step_sk_run_dryrun, False),
+    "sk_mv": (step_sk_mv, True),
+}
+
+def time_step(project, name, repeat):
+    """Seconds taken by each of repeat runs of the step"""
+    prepare, modifies = steps[name]
+    times = list()
+    for _ in range(repeat):
+        path = project
+        if modifies:
+            path = tempfile.mkdtemp(prefix="sk_bench_")
+            shutil.rmtree(path)
+            shutil.copytree(project, path, symlinks=True)
+        try:
+            with chdir(path):
+                run = prepare(path)
+                start = time.perf_counter()
+                run()
+                times.append(time.perf_counter() - start)
+        finally:
+            if modifies:
+                shutil.rmtree(path, ignore_errors=True)
+    return times
+
+### Results
+
+def git_commit():
+    bench_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=bench_dir,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    return out.stdout.decode().strip() if out.returncode == 0 else None
+
+def run_benchmarks(sizes, bench_shapes, depth, repeat, names):
+    import scikick
+    results = list()
+    for size in sizes:
+        for shape in bench_shapes:
+            with tempfile.TemporaryDirectory(prefix="sk_bench_") as project:
+                generate_project(project, size, shape, depth)
+                noop_execute(project)
+                for name in names:
+                    times = time_step(project, name, repeat)
+                    results.append({"step": name, "pages": size,
+                        "shape": shape, "depth": depth,
+                        "seconds": min(times), "times": times})
+                    print(f"{name:>20} {size:>6} {shape:>12} {min(times):10.4f}s",
+                        file=sys.stderr)
+    meta = {"scikick": scikick.__version__, "commit": git_commit(),
+        "python": platform.python_version(), "platform": platform.platform(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeat": repeat}
+    return {"meta": meta, "results": results}
+
+def compare(old_file, new_file):
+    """Print the ratio of the new to the old time of each benchmark"""
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    key = lambda r: (r["step"], r["pages"], r["shape"], r["depth"])
+    old_times = {key(r): r["seconds"] for r in old["results"]}
+    print(f"{'step':>20} {'pages':>6} {'shape':>12} {'old':>10} {'new':>10} {'ratio':>7}")
+    for r in new["results"]:
+        if key(r) not in old_times:
+            continue
+        before = old_times[key(r)]
+        ratio = r["seconds"] / before if before > 0 else float("inf")
+        print(f"{r['step']:>20} {r['pages']:>6} {r['shape']:>12} " + \
+            f"{before:10.4f} {r['seconds']:10.4f} {ratio:7.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scikick's overhead on synthetic projects")
+    parser.add_argument("--sizes", default=",".join(map(str, default_sizes)),
+        help="Comma separated numbers of pages (default %(default)s)")
+    parser.add_argument("--shapes", default=",".join(shapes),
+        help=f"Comma separated dependency shapes of {shapes} (default all)")
+    parser.add_argument("--depth", type=int, default=2,
+        help="Directory depth of the pages (default %(default)s)")
+    parser.add_argument("--steps", default=",".join(steps.keys()),
+        help="Comma separated steps to time (default all)")
+    parser.add_argument("--repeat", type=int, default=3,
+        help="Runs of each step, the fastest is reported (default %(default)s)")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+        help="Compare two result files instead of running benchmarks")
+    args = parser.parse_args()
+    if args.compare is not None:
+        compare(*args.compare)
+        return
+    bench_shapes = args.shapes.split(",")
+    names = args.steps.split(",")
+    for shape in bench_shapes:
+        if shape not in shapes:
+            parser.error(f"unknown shape {shape}")
+    for name in names:
+        if name not in steps:
+            parser.error(f"unknown step {name}")
+    if args.depth < 1:
+        parser.error("--depth must be at least 1")
+    results = run_benchmarks([int(size) for size in args.sizes.split(",")],
+        bench_shapes, args.depth, args.repeat, names)
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,19 @@
-"""Import version to be accessible after scikick imports"""
+"""Import version to be accessible after scikick imports
+
+Other attributes are imported on first access so that `import scikick`
+(e.g. by sk add) does not import snakemake
+"""
 from scikick.version import __version__
-from scikick.utils import skdir
-from scikick.config import ScikickConfig
-from scikick.snakemake import run_snakemake
-from scikick.utils import check_requirements
+
+_lazy_attrs = {
+    "skdir": "scikick.utils",
+    "check_requirements": "scikick.requirements",
+    "ScikickConfig": "scikick.config",
+    "run_snakemake": "scikick.snakemake",
+}
+
+def __getattr__(name):
+    if name not in _lazy_attrs:
+        raise AttributeError(f"module 'scikick' has no attribute '{name}'")
+    import importlib
+    return getattr(importlib.import_module(_lazy_attrs[name]), name)
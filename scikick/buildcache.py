@@ -0,0 +1,205 @@
+"""Content-addressed cache of page outputs (snakefile_args: build_cache)
+
+The md, .knitmeta.RDS and figure directory of a page are stored under a
+key hashing everything the page execution depends on: the script, its
+dependencies (including the mds of upstream scripts) and the snakefile_args
+that affect execution. The sk_exe_* jobs restore the outputs instead of
+executing the script if the key is found. The cache directory can be
+shared (e.g. on NFS) by checkouts of the same project and is limited in
+size (snakefile_args: build_cache_mb) by evicting the least recently used
+entries.
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+from scikick.utils import warn
+from scikick.config import ScikickConfig
+from scikick.fingerprints import FingerprintStore
+
+# snakefile_args that do not change the outputs of a page
+ignored_args = ["benchmark", "jobs", "mem_mb", "r_workers", "kernels",
+    "resources", "build_cache", "build_cache_mb"]
+# scikick's code executing the pages
+key_version = 1
+
+def page_outputs(skconf, out_base):
+    """Files and directories written by executing the page"""
+    md = skconf.get_info(out_base, "md")
+    base = os.path.splitext(os.path.basename(md))[0]
+    return [md, md[:-3] + ".knitmeta.RDS", skconf.get_info(out_base, "figdir"),
+        # jupyter nbconvert
+        os.path.join(os.path.dirname(md), base + "_files")]
+
+def tree_files(path):
+    """Files under path (or path if it is a file)"""
+    if not os.path.isdir(path):
+        return [path]
+    files = list()
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        files += [os.path.join(root, name) for name in sorted(names)]
+    return files
+
+class BuildCache:
+    """Page outputs stored in cache_dir/<key[:2]>/<key>/
+    with meta.json (its mtime marks the last use) and the outputs in files/
+    """
+    def __init__(self, cache_dir, max_mb):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb) * 1024 * 1024
+
+    def entry(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    @staticmethod
+    def key(skconf, out_base):
+        """Hash of everything the outputs of the page depend on"""
+        fingerprints = FingerprintStore(skconf.report_dir)
+        key = hashlib.sha256()
+        key.update(f"{key_version}\n{out_base}\n".encode())
+        key.update(skconf.get_info(out_base, "ext").encode())
+        for dep in skconf.inferred_inputs[out_base]:
+            key.update(f"\n{dep}\n".encode())
+            for path in tree_files(dep):
+                key.update(f"{os.path.relpath(path, dep)} ".encode())
+                key.update(str(fingerprints.digest(path)).encode())
+        snakefile_args = skconf.config.get("snakefile_args") or dict()
+        env = {arg: str(value) for arg, value in snakefile_args.items() \
+            if arg not in ignored_args}
+        key.update(json.dumps(env, sort_keys=True).encode())
+        conda = skconf.snakefile_arg("conda")
+        if conda != "" and os.path.isfile(conda):
+            key.update(str(fingerprints.digest(conda)).encode())
+        return key.hexdigest()
+
+    def restore(self, skconf, out_base):
+        """Restore the outputs of the page
+        Returns False if they are not in the cache
+        """
+        entry = self.entry(self.key(skconf, out_base))
+        meta = os.path.join(entry, "meta.json")
+        files = os.path.join(entry, "files")
+        if not os.path.isfile(meta) or not os.path.isdir(files):
+            return False
+        md = skconf.get_info(out_base, "md")
+        outdir = os.path.dirname(md)
+        for src in tree_files(files):
+            dest = os.path.join(outdir, os.path.relpath(src, files))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if os.path.lexists(dest):
+                os.remove(dest)
+            # the md is copied since it may be edited in place (sk mv)
+            if dest == md:
+                shutil.copyfile(src, dest)
+                continue
+            try:
+                os.link(src, dest)
+            except OSError:
+                shutil.copyfile(src, dest)
+        # least recently used entries are evicted first
+        os.utime(meta, None)
+        return True
+
+    def store(self, skconf, out_base):
+        """Store the outputs of the executed page"""
+        entry = self.entry(self.key(skconf, out_base))
+        if os.path.isdir(entry):
+            return
+        md = skconf.get_info(out_base, "md")
+        outdir = os.path.dirname(md)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp_entry = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix="tmp_")
+        size = 0
+        try:
+            for output in page_outputs(skconf, out_base):
+                if not os.path.exists(output):
+                    continue
+                for src in tree_files(output):
+                    dest = os.path.join(tmp_entry, "files", \
+                        os.path.relpath(src, outdir))
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    shutil.copyfile(src, dest)
+                    size += os.path.getsize(dest)
+            with open(os.path.join(tmp_entry, "meta.json"), "w") as meta:
+                json.dump({"out_base": out_base, "size": size}, meta)
+            # another job may have stored the same outputs meanwhile
+            os.rename(tmp_entry, entry)
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries over the size limit"""
+        entries = list()
+        for subdir in os.scandir(self.cache_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.startswith("tmp_"):
+                    continue
+                meta = os.path.join(entry.path, "meta.json")
+                try:
+                    with open(meta) as meta_file:
+                        size = json.load(meta_file)["size"]
+                    entries.append((os.path.getmtime(meta), size, entry.path))
+                except (OSError, ValueError, KeyError):
+                    continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+def build_cache(skconf):
+    """The BuildCache configured in scikick.yml (None if not used)"""
+    cache_dir = skconf.snakefile_arg("build_cache")
+    if cache_dir == "":
+        return None
+    return BuildCache(cache_dir, skconf.snakefile_arg("build_cache_mb"))
+
+def unshare_outputs(skconf, out_base):
+    """Remove restored outputs that are hardlinks to the cache before
+    the page is executed (they would be overwritten in place)
+    """
+    for output in page_outputs(skconf, out_base):
+        if not os.path.exists(output):
+            continue
+        for path in tree_files(output):
+            if os.stat(path).st_nlink > 1:
+                os.remove(path)
+
+def main(argv):
+    """python -m scikick.buildcache restore <out_base> <log>
+    python -m scikick.buildcache store <out_base>
+    restore returns False if the page must be executed
+    """
+    task, out_base = argv[0], argv[1]
+    skconf = ScikickConfig(readonly=True)
+    cache = build_cache(skconf)
+    if cache is None:
+        return False
+    if task == "store":
+        try:
+            cache.store(skconf, out_base)
+        except OSError as e:
+            warn(f"sk: Warning: Could not store {out_base} in the build cache: {e}")
+        return True
+    try:
+        if cache.restore(skconf, out_base):
+            md = skconf.get_info(out_base, "md")
+            with open(argv[2], "w") as log:
+                log.write(f"sk: {md} restored from {cache.cache_dir}\n")
+            print(f"sk: Restored {md} from the build cache")
+            return True
+    except OSError as e:
+        warn(f"sk: Warning: Could not restore {out_base} from the build cache: {e}")
+    unshare_outputs(skconf, out_base)
+    return False
+
+if __name__ == "__main__":
+    sys.exit(0 if main(sys.argv[1:]) else 1)
@@ -1,8 +1,22 @@
 """General scikick.yml modifier functions"""
 import os
 import re
+import json
+import hashlib
+import tempfile
+import scikick
 from scikick.utils import reterr, warn, get_sk_exe_dir
 from scikick.yaml import yaml_in, yaml_dump, rm_commdir, get_indexes, supported_extensions
+from scikick.yaml import reterr_no_pages
+from scikick.layout import get_tabs
+
+# ScikickConfig loaded by sk when snakemake runs in the same process,
+# the Snakefile uses it instead of reading scikick.yml again
+workflow_config = None
+
+def system_index_exe():
+    """ Path to the system template used as the homepage """
+    return os.path.join(get_sk_exe_dir(), "workflow", "notebook_rules", 'index.Rmd')
 
 # This should be simplified or split
 class ScikickConfig:
@@ -10,14 +24,168 @@ class ScikickConfig:
     A class for storing and manipulating the configuration
     """
 
+    # labels matching exe_core_outputs indices
+    core_output_labels = ['exe', 'md', 'html', 'base', 'out_base',
+        'ext', 'figdir', 'post_md']
+    # labels which can be used to look up a row of exe_core_outputs
+    core_output_keys = ['exe', 'md', 'html', 'base', 'out_base',
+        'figdir', 'post_md']
+
     def read(self, need_pages=False):
         """Read scikick.yml, eventually to replace yaml_in()"""
-        self.config = yaml_in(self.filename, need_pages)
+        self.config = yaml_in(self.filename, need_pages, self.readonly)
 
-    def __init__(self, filename="scikick.yml",need_pages=False):
+    def __init__(self, filename="scikick.yml",need_pages=False,readonly=False):
+        """
+        filename -- path to scikick.yml
+        need_pages -- logical, whether to error if analysis is empty
+        readonly -- logical, for commands that will not write scikick.yml.
+            The compiled project model in reportdir (see load_model()) is
+            used if valid, otherwise scikick.yml is read with the fast safe
+            loader. self.config is then not round-trip safe for yaml_dump.
+            Nothing is written, the model is saved by sk run (save_model())
+        """
         self.filename = filename
+        self.readonly = readonly
+        self._paths = None
+        self._graph = None
+        self.model_loaded = readonly and self.load_model(need_pages)
+        if self.model_loaded:
+            return
         self.read(need_pages=need_pages)
 
+    ### Compiled project model cache
+    # Everything derived from scikick.yml (the config itself, the I/O path
+    # table, the site layout) is stored as JSON under reportdir and reused
+    # for as long as scikick.yml and the scikick install are unchanged.
+    model_version = 1
+
+    def model_key(self, ymltext):
+        """Hash identifying the scikick.yml content and scikick install"""
+        key = hashlib.sha1(ymltext)
+        key.update(scikick.__version__.encode())
+        key.update(get_sk_exe_dir().encode())
+        key.update(str(self.model_version).encode())
+        return key.hexdigest()
+
+    @staticmethod
+    def model_path(report_dir):
+        """Location of the compiled project model"""
+        return os.path.join(report_dir, "sk_cache", "project_model.json")
+
+    def load_model(self, need_pages=False):
+        """Load the compiled project model if it matches scikick.yml
+        Returns True on success and False if scikick.yml must be parsed
+        """
+        try:
+            with open(self.filename, "rb") as ymlfile:
+                ymltext = ymlfile.read()
+        except OSError:
+            return False
+        # reportdir is needed to find the model, read it without parsing
+        report_dir = re.search(r"^reportdir:[ \t]*['\"]?([^'\"#\n]*?)['\"]?[ \t]*(#.*)?$",
+                ymltext.decode("utf-8", "replace"), re.MULTILINE)
+        if report_dir is None or report_dir.group(1) == "":
+            return False
+        report_dir = os.path.normpath(report_dir.group(1))
+        try:
+            with open(self.model_path(report_dir), "r") as model_file:
+                model = json.load(model_file)
+        except (OSError, ValueError):
+            return False
+        if model.get("key") != self.model_key(ymltext) or \
+            model["config"].get("reportdir") is None or \
+            os.path.normpath(model["config"]["reportdir"]) != report_dir:
+            return False
+        if need_pages and len(model["config"]["analysis"]) == 0:
+            reterr_no_pages()
+        self.config = model["config"]
+        paths = model["paths"]
+        paths["index"] = self._build_index(paths["rows"])
+        self._paths = paths
+        return True
+
+    def save_model(self):
+        """Compile and write the project model for load_model()"""
+        if self.config.get("reportdir") in [None, ""]:
+            return
+        try:
+            with open(self.filename, "rb") as ymlfile:
+                ymltext = ymlfile.read()
+        except OSError:
+            return
+        # Fill all cached fields
+        self.tabs
+        self.get_site_yaml_files()
+        paths = {k: v for k, v in self.paths.items() if k != "index"}
+        model = {"key": self.model_key(ymltext), "config": self.config,
+            "paths": paths}
+        model_file = self.model_path(self.report_dir)
+        # Write atomically, snakemake jobs may read the model concurrently
+        try:
+            os.makedirs(os.path.dirname(model_file), exist_ok=True)
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(model_file))
+            with os.fdopen(tmp_fd, "w") as tmp_file:
+                json.dump(model, tmp_file)
+            os.replace(tmp_path, model_file)
+        except (OSError, TypeError, ValueError) as e:
+            warn(f"sk: Warning: Could not write {model_file}: {e}")
+
+    @property
+    def config(self):
+        """The scikick.yml contents"""
+        return self._config
+
+    @config.setter
+    def config(self, value):
+        self._config = value
+        self.invalidate()
+
+    def invalidate(self):
+        """Drop the cached path table and project graph
+        Must be called after self.config is modified in place
+        (e.g. reordering of 'analysis' by sk layout)
+        """
+        self._paths = None
+        self._graph = None
+
+    @property
+    def paths(self):
+        """Cached I/O path table built from self.config
+        Returns a dict with:
+        exes -- list of analysis keys
+        index_exes -- list of user defined index exes
+        rows -- exe_core_outputs rows
+        index -- {path: row} for each of the core_output_keys paths
+        tabs, site_yaml_files -- filled in once requested
+        """
+        if self._paths is None:
+            exes = list(self.analysis.keys())
+            index_exes = get_indexes(self.config)
+            rows = self._build_core_outputs(exes, index_exes)
+            self._paths = {"exes": exes, "index_exes": index_exes,
+                    "rows": rows, "index": self._build_index(rows)}
+        return self._paths
+
+    def _build_index(self, rows):
+        """ {path: row} lookup for exe_core_outputs rows """
+        index = dict()
+        key_idxs = [self.core_output_labels.index(k) for k in
+                self.core_output_keys]
+        for row in rows:
+            for i in key_idxs:
+                # first match wins, as with the previous linear scan
+                index.setdefault(row[i], row)
+        return index
+
+    @property
+    def tabs(self):
+        """ Cached get_tabs() output """
+        paths = self.paths
+        if "tabs" not in paths:
+            paths["tabs"] = get_tabs(self)
+        return {k: list(v) for k, v in paths["tabs"].items()}
+
     @property
     def analysis(self):
         """Get 'analysis:' dict from scikick.yml"""
@@ -50,12 +218,24 @@ class ScikickConfig:
 
     def snakefile_arg(self, arg, set_default=False):
         """ Get a valid snakefile_arg option """
-        if arg not in ["singularity", "conda", "benchmark", "threads"]:
+        if arg not in ["singularity", "conda", "benchmark", "threads",
+            "jobs", "mem_mb", "r_workers", "kernels", "build_cache",
+            "build_cache_mb", "navbar", "early_cutoff"]:
             value = None
         else:
             # Use default values that snakemake will accept
-            if arg is "threads":
+            if arg in ["threads", "jobs"]:
                 value = int(1)
+            elif arg in ["r_workers", "kernels", "early_cutoff"]:
+                # a new process for every page
+                value = int(0)
+            elif arg == "mem_mb":
+                # no memory limit
+                value = None
+            elif arg == "build_cache_mb":
+                value = int(10000)
+            elif arg == "navbar":
+                value = "embedded"
             else:
                 value = ""
             # Get the real value if it exists
@@ -63,24 +243,48 @@ class ScikickConfig:
             if "snakefile_args" in yml.keys():
                 if arg in yml["snakefile_args"]:
                     # Get full conda path (scikick.yml value is relative to project root)
-                    if arg == "conda":
+                    if arg in ["conda", "build_cache"]:
                         value = os.path.abspath(yml["snakefile_args"][arg])
                     else:
                         value = yml["snakefile_args"][arg]
         return value
 
+    # Per-page resources that can be set in snakefile_args: resources:
+    page_resource_names = ["threads", "mem_mb"]
+
+    @property
+    def page_resources(self):
+        """Get the 'snakefile_args: resources:' dict {exe: {resource: value}}"""
+        snakefile_args = self.config.get("snakefile_args")
+        if snakefile_args is None or snakefile_args.get("resources") is None:
+            return dict()
+        return snakefile_args["resources"]
+
+    def page_resource(self, value, resource):
+        """ Get the resource (threads or mem_mb) used to execute a page
+        value -- a path to lookup (as in get_info())
+        resource -- one of page_resource_names
+        """
+        exe = self.get_info(value, "exe")
+        page_resources = self.page_resources.get(exe)
+        if page_resources is not None and resource in page_resources:
+            return int(page_resources[resource])
+        if resource == "threads":
+            return int(self.snakefile_arg("threads"))
+        # mem_mb is not reserved unless specified for the page
+        return 0
+
     @property
     def exes(self):
         """ Get all user defined exes (i.e. excluding system index)
         """
-        return list(self.analysis.keys())
+        return list(self.paths["exes"])
 
     @property
     def index_exes(self):
         """ Get all user defined index exes
         """
-        ret = get_indexes(self.config)
-        return ret
+        return list(self.paths["index_exes"])
 
     @property
     def index_exe(self):
@@ -89,7 +293,7 @@ class ScikickConfig:
         if len(self.index_exes) == 1:
             return self.index_exes[0]
         else:
-            return os.path.join(get_sk_exe_dir(), "workflow", "notebook_rules", 'index.Rmd')
+            return system_index_exe()
 
     @property
     def homepage(self):
@@ -105,50 +309,97 @@ class ScikickConfig:
         3. deps that are not exe depend on the file itself
         """
         deps = {}
-        for exe in self.exes:
+        exes = set(self.paths["exes"])
+        exeable_exts = set(x.lower() for x in supported_extensions)
+        for exe in self.paths["exes"]:
             out_base = self.get_info(exe,"out_base")
             deps[out_base] = [exe] # script itself is an input file
             if isinstance(self.analysis[exe], list):
                 for dep in self.analysis[exe]:
                     depext = os.path.splitext(dep)[-1]
-                    depisexeable = depext.lower() in [x.lower() for x in supported_extensions]
-                    depisexe = dep in self.exes
+                    depisexeable = depext.lower() in exeable_exts
+                    depisexe = dep in exes
                     if depisexeable and depisexe:
                         deps[out_base].append(self.get_info(dep,"md"))
                     elif not depisexeable and depisexe:
                         warn("sk: Unsupported executable found in scikick.yml")
                     else:
                         deps[out_base].append(dep)
-        if self.index_exe not in self.exes:
+        if self.index_exe not in exes:
             deps['index'] = [self.index_exe]
         return deps
 
+    @property
+    def project_graph(self):
+        """Forward and reverse adjacency of the files in 'analysis'
+        (graph.ProjectIndex, built once and shared by sk status, sk run
+        and the project map)
+        """
+        if self._graph is None:
+            from scikick.graph import ProjectIndex
+            self._graph = ProjectIndex(self)
+        return self._graph
+
     def get_site_yaml_files(self):
         """
         Determine all required _site.yml files for the generate_site
         workflow.
         """
-        dirs = set([os.path.dirname(self.get_info(a,"md")) for a in self.exes])
-        ret=[os.path.normpath(os.path.join(dir, "_site.yml")) for dir in dirs]
-        index_site_yaml = os.path.normpath(os.path.join(self.report_dir, "out_md", "_site.yml"))
-        if index_site_yaml not in ret:
-            ret.append(index_site_yaml)
-        return ret
+        paths = self.paths
+        if "site_yaml_files" not in paths:
+            dirs = set([os.path.dirname(self.get_info(a,"md")) for a in self.exes])
+            ret=[os.path.normpath(os.path.join(dir, "_site.yml")) for dir in dirs]
+            index_site_yaml = os.path.normpath(os.path.join(self.report_dir, "out_md", "_site.yml"))
+            if index_site_yaml not in ret:
+                ret.append(index_site_yaml)
+            paths["site_yaml_files"] = ret
+        return list(paths["site_yaml_files"])
+
+    @property
+    def project_map_file(self):
+        """File with the pages and dependencies drawn in the project map
+        (written with the _site.yml files when it changes)
+        """
+        return os.path.normpath(os.path.join(self.report_dir, "out_md", "_project_map.json"))
+
+    @property
+    def external_navbar(self):
+        """Is the navbar loaded by pages from navbar_file (snakefile_args:
+        navbar: external) instead of rendered into every page
+        """
+        return self.snakefile_arg("navbar") == "external"
+
+    @property
+    def navbar_file(self):
+        """Script with the navbar menus shared by all pages (external navbar)"""
+        return os.path.normpath(os.path.join(self.report_dir, "out_html", "site_navbar.js"))
+
+    def site_yaml_file(self, out_base):
+        """The _site.yml used to render the page of out_base"""
+        md = self.get_info(out_base, "md")
+        return os.path.normpath(os.path.join(os.path.dirname(md), "_site.yml"))
 
     # Creating universal translation between exe=>md=>html
     @property
     def exe_core_outputs(self):
         """
-        For each exe, return a list of exe, md, html, base, out_base, ext, post_md
+        For each exe, return a list of exe, md, html, base, out_base, ext,
+        figdir, post_md
+        """
+        return [list(row) for row in self.paths["rows"]]
+
+    def _build_core_outputs(self, exes, index_exes):
+        """
         This function is meant to contain all of the logic of expected I/O
         Every string in the result should be unique
+        exes -- analysis keys
+        index_exes -- user defined index exes
         """
-
         ret = []
-        for exe in self.exes:
+        for exe in exes:
             base = os.path.splitext(exe)[0]
             ext = os.path.splitext(exe)[-1]
-            if len(self.index_exes) == 1 and exe in self.index_exes:
+            if len(index_exes) == 1 and exe in index_exes:
                 md = os.path.normpath(f"{self.report_dir}/out_md/index.md")
                 html = os.path.normpath(f"{self.report_dir}/out_html/index.html")
                 out_base = 'index'
@@ -161,8 +412,8 @@ class ScikickConfig:
             figdir = os.path.join(os.path.dirname(md),'figure',os.path.basename(base))
             ret.append([exe,md,html,base,out_base,ext,figdir,post_md])
         # If using the system index, add it as well
-        if len(self.index_exes)==0:
-            exe = self.index_exe
+        if len(index_exes)==0:
+            exe = system_index_exe()
             base = os.path.splitext(exe)[0]
             ext = os.path.splitext(exe)[-1]
             md = os.path.normpath(f"{self.report_dir}/out_md/index.md")
@@ -177,10 +428,10 @@ class ScikickConfig:
     # Accessing various workflow properties
     @property
     def out_bases(self):
-        return [element[4] for element in self.exe_core_outputs]
+        return [element[4] for element in self.paths["rows"]]
     @property
     def bases(self):
-        return [element[3] for element in self.exe_core_outputs]
+        return [element[3] for element in self.paths["rows"]]
 
     def get_info(self,value,element='all'):
         """
@@ -189,15 +440,160 @@ class ScikickConfig:
         value -- a path to lookup
         element -- which path to return
         """
-        # labels matching exe_core_output indicies
-        labs = ['exe', 'md', 'html', 'base', 'out_base',
-        'ext','next','prev',"figdir","post_md"]
-        for blob in self.exe_core_outputs:
-            if os.path.normpath(value) in blob:
-                if element == 'all':
-                    return blob
-                else:
-                    return blob[labs.index(element)]
+        blob = self.paths["index"].get(os.path.normpath(value))
+        if blob is None:
+            return None
+        if element == 'all':
+            return list(blob)
+        return blob[self.core_output_labels.index(element)]
+
+class ConfigTransaction:
+    """
+    Batch of edits to scikick.yml applied in memory and written once
+
+    Usage:
+        with ConfigTransaction() as txn:
+            txn.rename({"a.Rmd": "b.Rmd", ...})
+            txn.add_dep("b.Rmd", "data.csv")
+    The edits are committed when the block exits without an exception.
+    """
+
+    def __init__(self, skconfig=None, need_pages=False):
+        """
+        skconfig -- round-trip ScikickConfig to modify (optional)
+        need_pages -- logical, whether to error if analysis is empty
+        """
+        if skconfig is None:
+            skconfig = ScikickConfig(need_pages=need_pages)
+        if skconfig.readonly:
+            reterr("sk: Error: scikick.yml was read in read-only mode and can not be modified")
+        self.skconfig = skconfig
+        self._dependents = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        return False
+
+    @property
+    def config(self):
+        """The scikick.yml contents being modified"""
+        return self.skconfig.config
+
+    @property
+    def analysis(self):
+        """The 'analysis' dict being modified"""
+        return self.skconfig.config["analysis"]
+
+    @property
+    def dependents(self):
+        """Reverse index of 'analysis' {dep: [exes depending on dep]}"""
+        if self._dependents is None:
+            self._dependents = dict()
+            for exe, deps in self.analysis.items():
+                if deps is not None:
+                    for dep in deps:
+                        self._dependents.setdefault(dep, []).append(exe)
+        return self._dependents
+
+    def add_page(self, fname):
+        """Add fname to 'analysis' near pages in the same directory"""
+        analysis = self.analysis
+        if len(analysis.keys()) > 0:
+            commpath = os.path.commonpath(list(analysis.keys()))
+        else:
+            commpath = ""
+        tab_name = os.path.dirname(rm_commdir(fname, commpath))
+        all_tabs = list(map(lambda f:
+            os.path.dirname(rm_commdir(f, commpath)),
+            analysis.keys()))
+        tab_matches = list(filter(lambda i:
+            all_tabs[i] == tab_name, range(len(all_tabs))))
+        if (tab_name != "") and (len(tab_matches) != 0):
+            analysis.insert(tab_matches[-1] + 1, fname, [])
+        else:
+            analysis[fname] = None
+
+    def add_dep(self, fname, dep):
+        """Add dep to the dependencies of fname"""
+        dependents = self.dependents
+        if self.analysis[fname] is None:
+            self.analysis[fname] = []
+        self.analysis[fname].append(dep)
+        dependents.setdefault(dep, []).append(fname)
+
+    @property
+    def page_resources(self):
+        """The 'snakefile_args: resources:' dict being modified (if any)"""
+        return self.skconfig.page_resources
+
+    def rm_page(self, fname):
+        """Remove the fname entry from 'analysis'"""
+        dependents = self.dependents
+        deps = self.analysis[fname]
+        del self.analysis[fname]
+        self.page_resources.pop(fname, None)
+        if deps is not None:
+            for dep in deps:
+                dependents[dep].remove(fname)
+
+    def rm_dep(self, fname, dep):
+        """Remove dep from the dependencies of fname
+        Returns False if dep is not a dependency of fname
+        """
+        dependents = self.dependents
+        deps = self.analysis[fname]
+        if deps is None or dep not in deps:
+            return False
+        deps.remove(dep)
+        dependents[dep].remove(fname)
+        if len(deps) == 0:
+            self.analysis[fname] = None
+        return True
+
+    def rename(self, renames):
+        """Rename files in both 'analysis' keys and dependencies
+        in a single pass
+        renames -- dict {old name: new name}
+        Returns the set of old names that were found in scikick.yml
+        """
+        analysis = self.analysis
+        found = set()
+        # dependencies, visiting only the exes that depend on a renamed file
+        for name_a, name_b in renames.items():
+            for exe in self.dependents.get(name_a, []):
+                deps = analysis[exe]
+                deps[deps.index(name_a)] = name_b
+                found.add(name_a)
+        # keys, in place: from the first renamed key on, each key is moved
+        # to the end (renamed) to keep their order, with its comments
+        keys = list(analysis.keys())
+        first = next((i for i, k in enumerate(keys) if k in renames), None)
+        if first is not None:
+            comments = analysis.ca.items if hasattr(analysis, "ca") else dict()
+            for k in keys[first:]:
+                new_k = renames.get(k, k)
+                value = analysis[k]
+                del analysis[k]
+                analysis[new_k] = value
+                if new_k != k:
+                    found.add(k)
+                    if k in comments:
+                        comments[new_k] = comments.pop(k)
+        # page resources follow their page
+        page_resources = self.page_resources
+        for k in [k for k in page_resources.keys() if k in renames]:
+            page_resources[renames[k]] = page_resources.pop(k)
+        self._dependents = None
+        return found
+
+    def commit(self):
+        """Write all edits to scikick.yml"""
+        self.skconfig.invalidate()
+        yaml_dump(self.config, self.skconfig.filename)
 
 ### Snakefile arguments
 
@@ -213,4 +609,24 @@ def write_snakefile_arg(arg, val):
     warn(f"sk: Argument {arg} set to {yml['snakefile_args'][arg]}")
     yaml_dump(yml)
 
+def write_page_resource(exe, resource, val):
+    """Set a resource used to execute exe in scikick.yml
+    exe -- page in scikick.yml
+    resource -- name of the resource (threads or mem_mb)
+    val -- value of the resource
+    """
+    yml = yaml_in()
+    if exe not in yml["analysis"].keys():
+        reterr(f"sk: Error: {exe} not found in scikick.yml")
+    if yml.get("snakefile_args") is None:
+        yml["snakefile_args"] = dict()
+    if yml["snakefile_args"].get("resources") is None:
+        yml["snakefile_args"]["resources"] = dict()
+    resources = yml["snakefile_args"]["resources"]
+    if resources.get(exe) is None:
+        resources[exe] = dict()
+    resources[exe][resource] = val
+    warn(f"sk: Resource {resource} of {exe} set to {val}")
+    yaml_dump(yml)
+
 
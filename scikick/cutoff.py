@@ -0,0 +1,206 @@
+"""Early cutoff of pages whose outputs did not change (snakefile_args:
+early_cutoff)
+
+snakemake runs every job downstream of an executed page, even if the page
+produced the same markdown and figures again. With early cutoff:
+- the outputs of an executed page are compared with the previous ones,
+  ignoring the volatile content of the footer (execution times, git log and
+  scikick.yml). If they are the same, the previous md is put back so that
+  its content is unchanged for the pages using it
+- jobs whose inputs all have the content recorded in the fingerprints of
+  the last sk run (see fingerprints.py) keep their outputs instead of
+  executing the page or rendering the html again
+Pages that pass results to other pages through files should list those
+files as dependencies, otherwise only the md of the page is compared.
+"""
+import os
+import re
+import sys
+import shutil
+import hashlib
+from scikick.utils import warn
+from scikick.config import ScikickConfig
+from scikick.fingerprints import FingerprintStore
+from scikick.buildcache import page_outputs, tree_files
+
+# Footer content (footer.Rmd) that changes with every execution
+volatile_patterns = [re.compile(pattern, re.MULTILINE | re.DOTALL) for pattern in [
+    r"^Computation Started: `[^`\n]*`$\n?",
+    r"^Finished in `[^`\n]*`$\n?",
+    r"^\*\*Git Log\*\*.*?^---$\n?",
+    r"^\*\*Scikick Configuration\*\*.*?^---$\n?"]]
+
+def normalized_md(text):
+    """md without the volatile content of the footer"""
+    for pattern in volatile_patterns:
+        text = pattern.sub("", text)
+    return text
+
+def page_digest(skconf, out_base, md=None):
+    """Hash of the outputs of the page (None if the md is missing)
+    md -- md file to use instead of the md of the page
+    """
+    if md is None:
+        md = skconf.get_info(out_base, "md")
+    if not os.path.isfile(md):
+        return None
+    digest = hashlib.sha256()
+    with open(md, "r", errors="surrogateescape") as md_file:
+        digest.update(normalized_md(md_file.read()).encode(errors="surrogateescape"))
+    outdir = os.path.dirname(skconf.get_info(out_base, "md"))
+    for output in page_outputs(skconf, out_base)[1:]:
+        if not os.path.exists(output):
+            continue
+        for path in tree_files(output):
+            digest.update(f"\n{os.path.relpath(path, outdir)}\n".encode())
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+def state_dir(skconf, out_base):
+    """Directory with the previous md and digest of the page during sk run"""
+    key = hashlib.sha1(out_base.encode()).hexdigest()
+    return os.path.join(skconf.report_dir, "sk_cache", "cutoff", key)
+
+def snapshot(skconf, out_bases=None):
+    """Forget pages kept by the last sk run and link the current mds into
+    the state of each page (before sk run, snakemake removes the md before
+    the page executes)
+    out_bases -- pages that may execute (default all)
+    """
+    shutil.rmtree(os.path.join(skconf.report_dir, "sk_cache", "cutoff"),
+        ignore_errors=True)
+    if not int(skconf.snakefile_arg("early_cutoff")):
+        return
+    if out_bases is None:
+        out_bases = skconf.out_bases
+    for out_base in out_bases:
+        state = state_dir(skconf, out_base)
+        for element in ["md", "html"]:
+            path = skconf.get_info(out_base, element)
+            if not os.path.isfile(path):
+                continue
+            os.makedirs(state, exist_ok=True)
+            link(path, os.path.join(state, f"previous.{element}"))
+
+def link(src, dest):
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+def inputs_unchanged(skconf, output, previous, inputs):
+    """Were the inputs the same when output was made, according to the
+    fingerprints of the last sk run
+    previous -- the content of output before sk run
+    """
+    store = FingerprintStore(skconf.report_dir)
+    record = store.outputs.get(output)
+    if record is None or record["sha256"] != store.digest(previous):
+        return False
+    if set(record["inputs"].keys()) != set(inputs):
+        return False
+    return all(store.digest(path) is not None and \
+        record["inputs"][path] == store.digest(path) for path in inputs)
+
+def keep(skconf, out_base):
+    """Mark the outputs of the page as kept in this sk run"""
+    state = state_dir(skconf, out_base)
+    os.makedirs(state, exist_ok=True)
+    open(os.path.join(state, "kept"), "w").close()
+
+def restore(previous, output):
+    """Put the output back from before sk run (snakemake removed it)"""
+    if os.path.lexists(output):
+        os.remove(output)
+    link(previous, output)
+    # newer than the inputs updated in this run
+    os.utime(output, None)
+
+def skip_exe(skconf, out_base):
+    """Keep the md if the inputs of the page are unchanged
+    Returns False if the page must be executed
+    """
+    md = skconf.get_info(out_base, "md")
+    previous = os.path.join(state_dir(skconf, out_base), "previous.md")
+    if not inputs_unchanged(skconf, md, previous, skconf.inferred_inputs[out_base]):
+        return False
+    restore(previous, md)
+    keep(skconf, out_base)
+    print(f"sk: {md} is up to date (early cutoff)")
+    return True
+
+def before_exe(skconf, out_base):
+    """Save the digest of the previous outputs before the page executes"""
+    state = state_dir(skconf, out_base)
+    previous_md = os.path.join(state, "previous.md")
+    md = skconf.get_info(out_base, "md")
+    if os.path.isfile(md):
+        # the md may be written in place
+        os.makedirs(state, exist_ok=True)
+        if os.path.lexists(previous_md):
+            os.remove(previous_md)
+        shutil.copyfile(md, previous_md)
+    digest = page_digest(skconf, out_base, previous_md)
+    if digest is None:
+        return
+    with open(os.path.join(state, "digest"), "w") as digest_file:
+        digest_file.write(digest)
+
+def after_exe(skconf, out_base):
+    """Put the previous md back if the outputs of the page did not change"""
+    state = state_dir(skconf, out_base)
+    try:
+        with open(os.path.join(state, "digest"), "r") as digest_file:
+            previous = digest_file.read()
+    except OSError:
+        return
+    if page_digest(skconf, out_base) == previous:
+        md = skconf.get_info(out_base, "md")
+        restore(os.path.join(state, "previous.md"), md)
+        keep(skconf, out_base)
+        print(f"sk: {md} is unchanged (early cutoff)")
+    os.remove(os.path.join(state, "digest"))
+
+def skip_html(skconf, out_base):
+    """Keep the html if the page was kept and the other inputs of the
+    html are unchanged
+    Returns False if the html must be rendered
+    """
+    from scikick.workflow.site_rules.render_site_yamlgen import postprocess_inputs
+    state = state_dir(skconf, out_base)
+    if not os.path.isfile(os.path.join(state, "kept")):
+        return False
+    html = skconf.get_info(out_base, "html")
+    previous = os.path.join(state, "previous.html")
+    inputs = [skconf.site_yaml_file(out_base), skconf.get_info(out_base, "md")] + \
+        postprocess_inputs(skconf)
+    if not inputs_unchanged(skconf, html, previous, inputs):
+        return False
+    restore(previous, html)
+    print(f"sk: {html} is up to date (early cutoff)")
+    return True
+
+def main(argv):
+    """python -m scikick.cutoff <skip_exe|before_exe|after_exe|skip_html> <out_base>
+    skip_exe and skip_html return False if the job must run
+    """
+    task, out_base = argv[0], argv[1]
+    skconf = ScikickConfig(readonly=True)
+    try:
+        if task == "skip_exe":
+            return skip_exe(skconf, out_base)
+        if task == "skip_html":
+            return skip_html(skconf, out_base)
+        if task == "before_exe":
+            before_exe(skconf, out_base)
+        elif task == "after_exe":
+            after_exe(skconf, out_base)
+    except OSError as e:
+        warn(f"sk: Warning: Early cutoff failed for {out_base}: {e}")
+        return task not in ["skip_exe", "skip_html"]
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main(sys.argv[1:]) else 1)
@@ -0,0 +1,173 @@
+"""Content fingerprints of the files the report was built from
+
+After each sk run, the sha256 of every output and of the inputs it was made
+from is stored under reportdir. An input whose mtime is newer than an
+output (e.g. after git checkout, cp -r or a CI cache restore) is only
+considered changed if its content differs from the recorded one.
+Files are only re-hashed if their size, mtime or inode changed.
+"""
+import os
+import json
+import hashlib
+import tempfile
+from scikick.utils import warn
+from scikick.status import MtimeCache, workflow_jobs, needrun_jobs
+
+class FingerprintStore:
+    """Recorded content hashes
+    files -- {path: [size, mtime_ns, inode, sha256]} (stat cache)
+    outputs -- {output: {"sha256": sha256, "inputs": {path: sha256}}}
+    """
+    version = 1
+
+    def __init__(self, report_dir):
+        self.path = os.path.join(report_dir, "sk_cache", "fingerprints.json")
+        self.files = dict()
+        self.outputs = dict()
+        self.modified = False
+        try:
+            with open(self.path, "r") as store_file:
+                store = json.load(store_file)
+            if store.get("version") == self.version:
+                self.files = store["files"]
+                self.outputs = store["outputs"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def digest(self, path):
+        """sha256 of the file at path (None if it is missing or a directory)"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if os.path.isdir(path):
+            return None
+        stat = [st.st_size, st.st_mtime_ns, st.st_ino]
+        entry = self.files.get(path)
+        if entry is not None and entry[:3] == stat:
+            return entry[3]
+        checksum = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                checksum.update(block)
+        self.files[path] = stat + [checksum.hexdigest()]
+        self.modified = True
+        return checksum.hexdigest()
+
+    def unchanged(self, path, job):
+        """Do the outputs of job have the content they had when they were
+        made from the current content of path
+        job -- StatusJob
+        """
+        if len(job.outputs) == 0:
+            return False
+        for output in job.outputs:
+            record = self.outputs.get(output)
+            if record is None or path not in record["inputs"]:
+                return False
+            if record["inputs"][path] != self.digest(path) or \
+                record["sha256"] != self.digest(output):
+                return False
+        return True
+
+    def record(self, job):
+        """Record the outputs of job as made from its current inputs"""
+        inputs = dict()
+        for path in source_inputs(job):
+            checksum = self.digest(path)
+            if checksum is not None:
+                inputs[path] = checksum
+        for output in job.outputs:
+            self.outputs[output] = {"sha256": self.digest(output),
+                "inputs": inputs}
+        self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+        store = {"version": self.version, "files": self.files,
+            "outputs": self.outputs}
+        # Write atomically as with the project model
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+            with os.fdopen(tmp_fd, "w") as tmp_file:
+                json.dump(store, tmp_file)
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            warn(f"sk: Warning: Could not write {self.path}: {e}")
+        self.modified = False
+
+def source_inputs(job):
+    """Inputs of job, with temporary files replaced by the inputs they
+    are made from (e.g. an html is recorded as made from the md)
+    """
+    inputs = list(job.inputs)
+    for producer, paths in job.dependencies.items():
+        if producer.temp:
+            inputs = [path for path in inputs if path not in paths] + \
+                source_inputs(producer)
+    return inputs
+
+def record_fingerprints(skconf, scope=None):
+    """Record the fingerprints of all up to date jobs (after sk run)
+    scope -- status.RunScope, only its jobs are recorded (default all)
+    """
+    mtime = MtimeCache()
+    order = workflow_jobs(skconf, mtime, scope)
+    needrun = needrun_jobs(order, mtime)
+    store = FingerprintStore(skconf.report_dir)
+    for job in order:
+        if job in needrun or len(job.outputs) == 0 or \
+            any(mtime(output) is None for output in job.outputs):
+            continue
+        store.record(job)
+    store.save()
+
+def apply_fingerprints(order, mtime, store, touch=False):
+    """Move the mtimes of outputs forward to the newest of their inputs if
+    all inputs newer than them have unchanged content, so that they are
+    up to date for snakemake
+    order -- jobs from status.workflow_jobs()
+    mtime -- status.MtimeCache, updated with the new mtimes
+    store -- FingerprintStore
+    touch -- bool, set the new mtimes on the files (otherwise only mtime
+        is updated)
+    """
+    for job in order[:-1]:
+        if any(mtime(output) is None for output in job.outputs):
+            continue
+        outputs = list(job.outputs)
+        if job.benchmark is not None and mtime(job.benchmark) is not None:
+            outputs.append(job.benchmark)
+        oldest = min(mtime(output) for output in outputs)
+        newer = [path for path in source_inputs(job) \
+            if mtime(path) is not None and mtime(path) > oldest]
+        if len(newer) == 0 or \
+            not all(store.unchanged(path, job) for path in newer):
+            continue
+        newest = max(newer, key=mtime)
+        for output in outputs:
+            if mtime(output) >= mtime(newest):
+                continue
+            if touch:
+                checksum = store.digest(output)
+                newest_ns = os.stat(newest).st_mtime_ns
+                os.utime(output, ns=(newest_ns, newest_ns))
+                # content is the same
+                if checksum is not None:
+                    st = os.stat(output)
+                    store.files[output] = [st.st_size, st.st_mtime_ns,
+                        st.st_ino, checksum]
+                    store.modified = True
+            mtime.mtimes[output] = mtime(newest)
+
+def restore_unchanged(skconf, scope=None):
+    """Make outputs of unchanged inputs up to date (before sk run)
+    scope -- status.RunScope, only its jobs are checked (default all)
+    """
+    mtime = MtimeCache()
+    order = workflow_jobs(skconf, mtime, scope)
+    store = FingerprintStore(skconf.report_dir)
+    apply_fingerprints(order, mtime, store, touch=True)
+    store.save()
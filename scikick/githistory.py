@@ -0,0 +1,173 @@
+"""Index of the git history shown in the page footers and the homepage
+
+sk run walks the history once (when HEAD or the remote changed) and writes
+reportdir/sk_cache/git_history/ with the commits of the project, the latest
+commits of each script (one file per script) and the remote url.
+footer.Rmd and index.Rmd read their own file (under
+os.environ[history_env_var]) instead of walking the history with git2r
+for every page, and render_site_yamlgen.py reads the remote url from it.
+"""
+import os
+import re
+import json
+import shutil
+import tempfile
+import subprocess
+from scikick.utils import warn
+
+# Environment variable with the path of the index while sk run executes
+history_env_var = "SK_GIT_HISTORY"
+# Commits shown in the footer of a page
+path_max_commits = 20
+
+class GitHistory:
+    """Commits of the repository of the project
+    head -- sha of HEAD (None outside of a git repository)
+    remote -- url of the first remote (None if there is none)
+    commits -- [[sha (8 characters), author, date, summary]] newest first
+    paths -- {path (relative to the project): latest commits of the path}
+    (load() only reads the paths, not their commits)
+    """
+    version = 2
+
+    def __init__(self, head=None, remote=None, commits=None, paths=None):
+        self.head = head
+        self.remote = remote
+        self.commits = commits if commits is not None else list()
+        self.paths = paths if paths is not None else dict()
+
+    @staticmethod
+    def path(report_dir):
+        return os.path.join(report_dir, "sk_cache", "git_history")
+
+    @classmethod
+    def commits_file(cls, report_dir, path=None):
+        """File with the commits of path (of the project if None)
+        (as found by knit_helpers.R)
+        """
+        if path is None:
+            return os.path.join(cls.path(report_dir), "project.json")
+        return os.path.join(cls.path(report_dir), "paths", path + ".json")
+
+    @classmethod
+    def load(cls, report_dir):
+        """The index written by the last sk run (None if missing)"""
+        try:
+            with open(os.path.join(cls.path(report_dir), "index.json"), \
+                "r") as index_file:
+                index = json.load(index_file)
+            if index.get("version") != cls.version:
+                return None
+            return cls(index["head"], index["remote"],
+                paths={path: None for path in index["paths"]})
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, report_dir):
+        index = {"version": self.version, "head": self.head,
+            "remote": self.remote, "paths": sorted(self.paths.keys())}
+        index_path = os.path.join(self.path(report_dir), "index.json")
+        # The index is written last, a partially written history is
+        # walked again by the next sk run
+        try:
+            if os.path.isfile(index_path):
+                os.remove(index_path)
+            shutil.rmtree(os.path.join(self.path(report_dir), "paths"), \
+                ignore_errors=True)
+            write_json(self.commits_file(report_dir), self.commits)
+            for path, commits in self.paths.items():
+                write_json(self.commits_file(report_dir, path), commits)
+            write_json(index_path, index)
+        except (OSError, TypeError, ValueError) as e:
+            warn(f"sk: Warning: Could not write {self.path(report_dir)}: {e}")
+
+def write_json(path, data):
+    """Write atomically as with the project model"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(tmp_fd, "w") as tmp_file:
+        json.dump(data, tmp_file, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+def git(*args):
+    """Output of a git command in the current directory (None on failure)"""
+    try:
+        proc = subprocess.run(["git", "-c", "core.quotepath=off"] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    return proc.stdout.decode("utf-8", errors="replace")
+
+def git_head():
+    head = git("rev-parse", "HEAD")
+    return head.strip() if head is not None else None
+
+def git_remote():
+    """Url of the first remote (as git2r::remote_url()[1])"""
+    remotes = git("remote")
+    if remotes is None or remotes.strip() == "":
+        return None
+    remote = sorted(remotes.split())[0]
+    url = git("remote", "get-url", remote)
+    return url.strip() if url is not None else None
+
+def walk_history(paths):
+    """Read the commits of the repository with a single git log
+    paths -- paths (relative to the project) to index commits for
+    Returns a GitHistory
+    """
+    history = GitHistory(git_head(), git_remote())
+    if history.head is None:
+        return history
+    # git log names files relative to the root of the repository
+    prefix = (git("rev-parse", "--show-prefix") or "").strip()
+    wanted = {prefix + path: path for path in paths}
+    log = git("log", "--name-only", "--date=iso",
+        "--format=%x1e%H%x1f%an%x1f%ad%x1f%s")
+    if log is None:
+        return history
+    for entry in log.split("\x1e")[1:]:
+        header, _, files = entry.partition("\n")
+        sha, author, date, summary = header.split("\x1f", 3)
+        commit = [sha[:8], author, date, summary]
+        history.commits.append(commit)
+        for name in files.split("\n"):
+            if name in wanted:
+                commits = history.paths.setdefault(wanted[name], list())
+                if len(commits) < path_max_commits:
+                    commits.append(commit)
+    return history
+
+def write_git_history(skconf):
+    """Update the index if HEAD, the remote or the scripts changed
+    and export its path for the pages (before sk run)
+    """
+    paths = sorted(set(skconf.exes))
+    history = GitHistory.load(skconf.report_dir)
+    if history is None or history.head != git_head() or \
+        history.remote != git_remote() or \
+        sorted(history.paths.keys()) != paths:
+        history = walk_history(paths)
+        for path in paths:
+            history.paths.setdefault(path, list())
+        history.save(skconf.report_dir)
+    os.environ[history_env_var] = os.path.abspath(GitHistory.path(skconf.report_dir))
+
+def git_repo_url(skconf):
+    """Web url of the remote of the repository (from the index of the last
+    sk run if it exists), "." if there is no remote
+    """
+    history = GitHistory.load(skconf.report_dir)
+    remote_url = history.remote if history is not None else git_remote()
+    if remote_url is None:
+        return "."
+    ssh_match = re.match("^git@.*:.*.git$", remote_url)
+    https_match = re.match("^https://.*.git$", remote_url)
+    if ssh_match is not None:
+        return re.sub("^git@(.*):(.*).git$", "https://\\1/\\2", remote_url)
+    elif https_match is not None:
+        return re.sub(".git$", "", remote_url)
+    else:
+        return "."
@@ -1,31 +1,139 @@
-from graphviz import Digraph
-import graphviz
 import os
+import re
+import hashlib
+import tempfile
+import heapq
+from collections import deque
+from scikick.utils import process_umask
 from scikick.workflow.site_rules.render_site_yamlgen import clean_name
 
-# Note this has potential to be used to link to 
+# Projects with more nodes than this are shown as a directory summary and
+# a neighbourhood map for each page instead of the full map
+full_map_max_nodes = 100
+# Steps upstream and downstream of a page shown in its neighbourhood map
+neighbourhood_hops = 2
+
+class ProjectIndex:
+    """Adjacency of the files in scikick.yml
+    (built once per ScikickConfig, see ScikickConfig.project_graph)
+    nodes -- all exes and dependencies (in scikick.yml order)
+    exes -- set of exes
+    upstream -- {node: [dependencies]}
+    downstream -- {node: [exes depending on it]}
+    position -- {node: index in nodes}
+    """
+    def __init__(self, skconfig):
+        analysis = skconfig.analysis
+        self.nodes = []
+        self.upstream = {}
+        self.downstream = {}
+        for exe in skconfig.exes:
+            self.add(exe)
+        self.exes = set(self.nodes)
+        for exe in skconfig.exes:
+            for dep in analysis[exe] or []:
+                self.add(dep)
+                self.upstream[exe].append(dep)
+                self.downstream[dep].append(exe)
+        self.position = {node: i for i, node in enumerate(self.nodes)}
+        self._order = None
+
+    @property
+    def order(self):
+        """exes in topological order (dependencies first, otherwise in
+        scikick.yml order), computed once
+        """
+        if self._order is None:
+            indegree = {exe: sum(dep in self.exes for dep in self.upstream[exe]) \
+                for exe in self.nodes if exe in self.exes}
+            ready = [(self.position[exe], exe) for exe in indegree \
+                if indegree[exe] == 0]
+            heapq.heapify(ready)
+            order = []
+            while len(ready) > 0:
+                _, exe = heapq.heappop(ready)
+                order.append(exe)
+                for other in self.downstream[exe]:
+                    indegree[other] -= 1
+                    if indegree[other] == 0:
+                        heapq.heappush(ready, (self.position[other], other))
+            # exes in a dependency cycle, in scikick.yml order
+            placed = set(order)
+            order += [exe for exe in indegree if exe not in placed]
+            self._order = order
+        return self._order
+
+    def closure(self, nodes, adjacency):
+        """nodes and everything reachable from them in adjacency
+        (each node is visited once)
+        """
+        found = set(nodes)
+        stack = list(found)
+        while len(stack) > 0:
+            for other in adjacency.get(stack.pop(), []):
+                if other not in found:
+                    found.add(other)
+                    stack.append(other)
+        return found
+
+    def upstream_of(self, nodes):
+        """nodes and all files they depend on (recursively)"""
+        return self.closure(nodes, self.upstream)
+
+    def downstream_of(self, nodes):
+        """nodes and all exes depending on them (recursively)"""
+        return self.closure(nodes, self.downstream)
+
+    def add(self, node):
+        if node not in self.upstream:
+            self.nodes.append(node)
+            self.upstream[node] = []
+            self.downstream[node] = []
+
+    def neighbourhood(self, node, hops):
+        """Nodes at most hops steps upstream or downstream of node"""
+        found = {node}
+        for adjacency in [self.upstream, self.downstream]:
+            queue = deque([(node, 0)])
+            while len(queue) > 0:
+                curr, dist = queue.popleft()
+                if dist == hops:
+                    continue
+                for other in adjacency[curr]:
+                    if other not in found:
+                        found.add(other)
+                        queue.append((other, dist + 1))
+        return found
+
+# Note this has potential to be used to link to
 # pages of the website.
 # dot -Tcmapx dag.dot -o dag.cmapx
 # dot -Tsvg dag.dot -o dag.svg
 # cat template2.html dag.cmapx > index2.html
 #https://stackoverflow.com/questions/15837283/graphviz-embedded-url
-def make_dag(skconfig,engine="dot",path_from_root="",subject=""):
-    """ Make a graphviz DAG from the workflow """
+def make_dag(skconfig,engine="dot",path_from_root="",subject="",target=None,
+    nodes=None,index=None):
+    """ Make a graphviz DAG from the workflow
+    target -- link target of exe nodes (e.g. '_top'), exe nodes are also
+        given node_id() ids so they can be highlighted by URL fragment
+    nodes -- set of files to show (default all)
+    index -- ProjectIndex (skconfig.project_graph if not given)
+    """
+    # graphviz is only imported when a project map is built
+    from graphviz import Digraph
     skdot = Digraph('skmap',engine=engine)
     skdot.attr(nodesep="0.1")
     skdot.attr(ranksep="0.3")
     skdot.attr(weight="10")
     skdot.attr(rankdir="LR")
 
-    # Get all files/nodes
-    allfiles = []
-    for exe in skconfig.exes:
-        allfiles += [exe]
-        deps = skconfig.analysis[exe]
-        if deps is not None:
-            for dep in deps:
-                if dep not in allfiles:
-                    allfiles += [dep]
+    if index is None:
+        index = skconfig.project_graph
+    # Get all files/nodes (in scikick.yml order)
+    if nodes is None:
+        allfiles = index.nodes
+    else:
+        allfiles = sorted(nodes, key=index.position.__getitem__)
 
     # Define all subgraphs
     cgraphs = {}
@@ -40,35 +148,38 @@ def make_dag(skconfig,engine="dot",path_from_root="",subject=""):
     # Define all nodes within appropriate subgraph
     for file in allfiles:
         dname = os.path.dirname(file) + '/'
-        if file in skconfig.exes:
+        if file in index.exes:
             out_base = skconfig.get_info(file,"out_base")
             # Adjust links to start from out_md/
             # i.e. path_from_root is the path from subject to out_md
             link_path = os.path.join(path_from_root,out_base)
             # Highlight current node
             node_color= '#ff967b' if out_base == subject else 'white'
+            link_attrs = {}
+            if target is not None:
+                link_attrs = {"target": target, "id": node_id(out_base)}
             # Define the exe node
             cgraphs[dname].node(file, label =
                     clean_name(os.path.basename(out_base)),
                 URL=f'{link_path}.html',fontsize='10',margin='0.05,0.05',
                 href=f'{link_path}.html',width='0.1',height='0.1',
-                shape="box",style="filled",fillcolor=node_color,fontname="arial")
+                shape="box",style="filled",fillcolor=node_color,fontname="arial",
+                **link_attrs)
         else:
             # Define non-exe node
             cgraphs[dname].node(file, label = os.path.basename(file),
                 fontsize='10',width='0.1',height='0.1',
                 shape="note",fillcolor="lightgrey",fontname="arial",
                 style="filled",dir="none")
-    
+
     # Define all edges from dependencies to exe
-    for exe in skconfig.exes:
+    for exe in allfiles:
         dname = os.path.dirname(exe) + '/'
-        if skconfig.analysis[exe] is None:
-            continue
-        deps = skconfig.analysis[exe]
-        for dep in deps:
+        for dep in index.upstream[exe]:
+            if nodes is not None and dep not in nodes:
+                continue
             dep_dname = os.path.dirname(dep) + '/'
-            if dep in skconfig.exes:
+            if dep in index.exes:
                 dir = "forward"
             else:
                 dir = "none"
@@ -84,6 +195,177 @@ def make_dag(skconfig,engine="dot",path_from_root="",subject=""):
 
     return skdot
 
+def make_summary_dag(skconfig, index, engine="dot"):
+    """ Make a graphviz DAG of the directories of the workflow
+    Edges between directories are labelled with the number of dependencies
+    between their files. Directory nodes link to their first page (relative
+    to out_html/) and have dir_id() ids
+    """
+    from graphviz import Digraph
+    skdot = Digraph('skmap',engine=engine)
+    skdot.attr(nodesep="0.1")
+    skdot.attr(ranksep="0.3")
+    skdot.attr(rankdir="LR")
+    pages = {}
+    files = {}
+    first_page = {}
+    for file in index.nodes:
+        dname = os.path.dirname(file) + '/'
+        pages.setdefault(dname, 0)
+        files.setdefault(dname, 0)
+        if file in index.exes:
+            pages[dname] += 1
+            first_page.setdefault(dname, skconfig.get_info(file, "out_base"))
+        else:
+            files[dname] += 1
+    edges = {}
+    for exe in index.nodes:
+        dname = os.path.dirname(exe) + '/'
+        for dep in index.upstream[exe]:
+            dep_dname = os.path.dirname(dep) + '/'
+            if dep_dname != dname:
+                edges[(dep_dname, dname)] = edges.get((dep_dname, dname), 0) + 1
+    for dname in pages.keys():
+        label = f"{dname}\\n{pages[dname]} pages, {files[dname]} files"
+        link_attrs = {}
+        if dname in first_page:
+            link = f"{first_page[dname]}.html"
+            link_attrs = {"URL": link, "href": link, "target": "_top"}
+        skdot.node(dname, label=label, id=dir_id(dname), shape="box",
+            style="rounded,filled", fillcolor="lightgrey", fontsize="10",
+            fontname="arial", **link_attrs)
+    for (dep_dname, dname), count in edges.items():
+        skdot.edge(dep_dname, dname, label=str(count), fontsize="8",
+            fontname="arial")
+    return skdot
+
+### Shared project map
+# The map is laid out once for each DAG (not once for each page) and written
+# to out_html/project_map.svg by sk run before snakemake starts (see
+# render_site_yamlgen.write_site_files). Pages show it in an iframe (which
+# is not inlined into self contained htmls) and highlight their own node
+# with the URL fragment.
+# Large projects share a summary of directories instead, and each page
+# shows the files within neighbourhood_hops of it.
+
+# Style of the node targeted by the URL fragment
+map_style = "<style>g.node:target polygon, g.node:target path { fill: #ff967b; }</style>"
+# The map sends its size to the page showing it (see map_iframe_script),
+# pages do not change with the map
+map_script = '<script>if (window.parent !== window) { var svg = document.documentElement; ' + \
+    'window.parent.postMessage({skProjectMap: [svg.getAttribute("width"), ' + \
+    'svg.getAttribute("height")]}, "*"); }</script>'
+map_iframe_script = '<script>window.addEventListener("message", function(e) { ' + \
+    'if (!e.data || !e.data.skProjectMap) { return; } ' + \
+    'document.querySelectorAll("iframe.sk-project-map").forEach(function(map) { ' + \
+    'if (map.contentWindow === e.source) { map.style.width = e.data.skProjectMap[0]; ' + \
+    'map.style.height = e.data.skProjectMap[1]; } }); });</script>'
+
+def node_id(out_base):
+    """SVG id of the node of out_base"""
+    return "sk_" + out_base.encode().hex()
+
+def dir_id(dname):
+    """SVG id of the node of a directory in the summary map"""
+    return "sk_dir_" + dname.encode().hex()
+
+def write_atomic(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    # mkstemp files are private, the map is published with the htmls
+    os.fchmod(tmp_fd, 0o666 & ~process_umask)
+    with os.fdopen(tmp_fd, "w") as tmp_file:
+        tmp_file.write(text)
+    os.replace(tmp_path, path)
+
+def large_project(index):
+    return len(index.nodes) > full_map_max_nodes
+
+def project_map_svg(skconfig, index=None):
+    """SVG of the shared project map, from the layout cached under
+    reportdir if the DAG did not change
+    """
+    if index is None:
+        index = skconfig.project_graph
+    # links are relative to out_html/
+    if large_project(index):
+        dg = make_summary_dag(skconfig, index)
+    else:
+        dg = make_dag(skconfig, "dot", target="_top", index=index)
+    key = hashlib.sha1((map_style + map_script + dg.source).encode()).hexdigest()
+    cache_dir = os.path.join(skconfig.report_dir, "sk_cache", "project_map")
+    cache = os.path.join(cache_dir, f"{key}.svg")
+    if os.path.isfile(cache):
+        with open(cache, "r") as svg_file:
+            return svg_file.read()
+    svg = dg.pipe(format="svg").decode('utf-8')
+    svg = re.sub(r"(<svg[^>]*>)", lambda m: m.group(1) + "\n" + map_style + "\n" + map_script,
+        svg, count=1)
+    # layouts of previous DAGs are not needed
+    if os.path.isdir(cache_dir):
+        for old in os.listdir(cache_dir):
+            if old.endswith(".svg") and old != f"{key}.svg":
+                os.remove(os.path.join(cache_dir, old))
+    write_atomic(cache, svg)
+    return svg
+
+def project_map_path(skconfig):
+    return os.path.join(skconfig.report_dir, "out_html", "project_map.svg")
+
+def write_project_map(skconfig, index=None):
+    """Write out_html/project_map.svg if it is missing or outdated
+    (before the pages are processed, they only read it)
+    Returns its path and the SVG
+    """
+    svg = project_map_svg(skconfig, index)
+    svg_path = project_map_path(skconfig)
+    current = None
+    if os.path.isfile(svg_path):
+        with open(svg_path, "r") as svg_file:
+            current = svg_file.read()
+    if current != svg:
+        write_atomic(svg_path, svg)
+    return svg_path, svg
+
+def neighbourhood_svg(skconfig, out_base, index):
+    """SVG of the files within neighbourhood_hops of the page (links are
+    relative to the page)
+    """
+    exe = skconfig.get_info(out_base, "exe")
+    html_dir = os.path.dirname(skconfig.get_info(out_base, "html"))
+    path_to_root = os.path.relpath(os.path.join(skconfig.report_dir, "out_html"),
+        html_dir)
+    nodes = index.neighbourhood(exe, neighbourhood_hops) \
+        if exe in index.exes else set()
+    dg = make_dag(skconfig, "dot", path_from_root=path_to_root,
+        subject=out_base, nodes=nodes, index=index)
+    svg = dg.pipe(format="svg").decode('utf-8')
+    # Remove doctype string
+    return '\n'.join(svg.split('\n')[3:])
+
+def project_map_html(skconfig, out_base):
+    """HTML showing the shared project map with the node of out_base
+    highlighted (with the neighbourhood of the page for large projects)
+    The map is written by write_project_map() and sized when it is viewed
+    """
+    index = skconfig.project_graph
+    svg_path = project_map_path(skconfig)
+    html_dir = os.path.dirname(skconfig.get_info(out_base, "html"))
+    src = os.path.relpath(svg_path, html_dir)
+    if large_project(index):
+        exe = skconfig.get_info(out_base, "exe")
+        src += "#" + dir_id(os.path.dirname(exe) + '/')
+    else:
+        src += "#" + node_id(out_base)
+    iframe = f'<iframe class="sk-project-map" src="{src}" ' + \
+        'style="border:none; max-width:100%;" loading="lazy"></iframe>' + \
+        map_iframe_script
+    if not large_project(index):
+        return iframe
+    return neighbourhood_svg(skconfig, out_base, index) + \
+        '\n<details><summary> Project directories </summary>\n' + \
+        iframe + '</details>'
+
 # As graph
 #import networkx as nx
 #G = nx.Graph(sk)
@@ -2,14 +2,16 @@
 """Functions used by `sk init`"""
 import os
 import shutil
-import snakemake
 import ruamel.yaml
 import scikick
-from scikick.utils import warn, check_requirements, get_sk_exe_dir
+from scikick.utils import warn, get_sk_exe_dir
+from scikick.requirements import check_requirements
 
 def add_version_info(ymli):
     """Add python package version info to scikick.yml"""
     if 'version_info' not in ymli.keys():
+        # snakemake takes long to import, only needed here
+        import snakemake
         ymli['version_info'] = { \
             "snakemake" : snakemake.__version__, \
             "ruamel.yaml" : ruamel.yaml.__version__, \
@@ -0,0 +1,197 @@
+"""Pool of warm Jupyter kernels that execute ipynb pages
+
+sk run starts the pool (snakefile_args: kernels) and sk_exe_ipynb jobs
+submit their notebook with 'python -m scikick.kernels' instead of starting
+'jupyter nbconvert --execute' and a new kernel for every page. Requires
+jupyter_client, nbclient, nbconvert and nbformat
+"""
+import os
+import sys
+import threading
+import traceback
+import contextlib
+from scikick.utils import warn
+from scikick import pool
+from scikick.pool import RequestServer
+
+# Environment variable with the address (socket path) of the running pool
+pool_env_var = "SK_KERNEL_POOL"
+
+def ipython_reset_code(cwd):
+    """Code clearing the state a notebook left in an IPython kernel"""
+    return "\n".join([
+        "get_ipython().run_line_magic('reset', '-f')",
+        "import os, sys",
+        "if 'matplotlib.pyplot' in sys.modules:",
+        "    sys.modules['matplotlib.pyplot'].close('all')",
+        f"os.chdir({cwd!r})",
+        "del os, sys"])
+
+class Kernel:
+    """A running kernel for notebooks of one kernelspec and directory"""
+    def __init__(self, kernel_name, cwd):
+        from jupyter_client.manager import start_new_kernel
+        self.key = (kernel_name, cwd)
+        self.km, self.kc = start_new_kernel(kernel_name=kernel_name, cwd=cwd)
+        self.language = self.km.kernel_spec.language
+
+    def reset(self):
+        """Clear the state left by the last notebook
+        Returns False if the kernel can not be reused
+        """
+        if not self.km.is_alive():
+            return False
+        if self.language != "python":
+            # no generic way to clear other kernels
+            self.km.restart_kernel(now=True)
+            self.kc.wait_for_ready()
+            return True
+        reply = self.kc.execute_interactive(ipython_reset_code(self.key[1]),
+            store_history=False, output_hook=lambda msg: None)
+        return reply["content"]["status"] == "ok"
+
+    def shutdown(self):
+        self.kc.stop_channels()
+        self.km.shutdown_kernel(now=True)
+
+def execute_notebook(kernel, nb, exe, outdir):
+    """Execute nb (read from exe) with kernel and write the markdown
+    and figures to outdir as 'jupyter nbconvert --to markdown' does
+    """
+    from nbclient import NotebookClient
+    from nbconvert import MarkdownExporter
+    from nbconvert.writers import FilesWriter
+    client = NotebookClient(nb, km=kernel.km, timeout=None,
+        kernel_name=kernel.key[0], resources={"metadata": {"path": kernel.key[1]}})
+    client.kc = kernel.kc
+    client.reset_execution_trackers()
+    info = kernel.kc.kernel_info(reply=True)
+    nb.metadata["language_info"] = info["content"]["language_info"]
+    for index, cell in enumerate(nb.cells):
+        client.execute_cell(cell, index)
+    name = os.path.splitext(os.path.basename(exe))[0]
+    resources = {"unique_key": name, "output_files_dir": f"{name}_files",
+        "metadata": {"name": name, "path": kernel.key[1]}}
+    body, resources = MarkdownExporter().from_notebook_node(nb, resources)
+    FilesWriter(build_directory=outdir).write(body, resources, \
+        notebook_name=name)
+
+class KernelPool(RequestServer):
+    """Kernels serving notebook executions on a unix socket
+    At most size kernels run at once, idle kernels of other kernelspecs
+    (or directories) are stopped to start new ones
+    """
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+        # least recently used first
+        self.idle = []
+        self.busy = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, key):
+        with self.cond:
+            while True:
+                for kernel in self.idle:
+                    if kernel.key == key:
+                        self.idle.remove(kernel)
+                        self.busy += 1
+                        return kernel
+                if self.busy + len(self.idle) < self.size:
+                    break
+                if len(self.idle) > 0:
+                    self.idle.pop(0).shutdown()
+                    break
+                self.cond.wait()
+            self.busy += 1
+        try:
+            return Kernel(*key)
+        except Exception:
+            self.release(None)
+            raise
+
+    def release(self, kernel):
+        with self.cond:
+            self.busy -= 1
+            if kernel is not None:
+                self.idle.append(kernel)
+            self.cond.notify()
+
+    def run(self, request):
+        import nbformat
+        exe = request["exe"]
+        with open(request["log"], "w") as log:
+            try:
+                nb = nbformat.read(exe, as_version=4)
+                kernel_name = nb.metadata.get("kernelspec", {}).get("name", "python3")
+                # nbconvert executes notebooks in their directory
+                kernel = self.acquire((kernel_name, \
+                    os.path.abspath(os.path.dirname(exe))))
+            except Exception:
+                traceback.print_exc(file=log)
+                return {"ok": False}
+            ok = True
+            try:
+                execute_notebook(kernel, nb, exe, request["outdir"])
+            except Exception:
+                traceback.print_exc(file=log)
+                ok = False
+            try:
+                reusable = kernel.reset()
+            except Exception:
+                reusable = False
+            if not reusable:
+                kernel.shutdown()
+                kernel = None
+            self.release(kernel)
+        return {"ok": ok}
+
+    def stop(self):
+        super().stop()
+        with self.cond:
+            for kernel in self.idle:
+                kernel.shutdown()
+            self.idle = []
+
+@contextlib.contextmanager
+def kernel_pool(skconf, dryrun=False):
+    """Run a KernelPool (if enabled) while snakemake executes
+    skconf -- ScikickConfig
+    The pool's address is exported in os.environ[pool_env_var]
+    """
+    size = min(int(skconf.snakefile_arg("kernels") or 0), os.cpu_count() or 1)
+    notebooks = [exe for exe in skconf.exes \
+        if os.path.splitext(exe)[1].lower() == ".ipynb"]
+    if dryrun or size <= 0 or len(notebooks) == 0:
+        yield None
+        return
+    if skconf.snakefile_arg("singularity") != "" or \
+        skconf.snakefile_arg("conda") != "":
+        warn("sk: Warning: kernels is not used with singularity or conda")
+        yield None
+        return
+    try:
+        import jupyter_client, nbclient, nbconvert, nbformat
+    except ImportError as e:
+        warn(f"sk: Warning: Jupyter kernel pool is not available ({e})")
+        yield None
+        return
+    kernels = KernelPool(min(size, len(notebooks)))
+    kernels.start()
+    os.environ[pool_env_var] = kernels.address
+    try:
+        yield kernels
+    finally:
+        os.environ.pop(pool_env_var, None)
+        kernels.stop()
+
+def submit(exe, outdir, log):
+    """Execute a notebook with the pool at os.environ[pool_env_var]
+    Returns True if the notebook was executed successfully
+    """
+    request = {"exe": exe, "outdir": outdir, "log": log}
+    response = pool.submit(os.environ[pool_env_var], request)
+    return response is not None and response["ok"]
+
+if __name__ == "__main__":
+    sys.exit(0 if submit(*sys.argv[1:4]) else 1)
@@ -78,6 +78,7 @@ def rearrange_tabs(order, skconf, tabs):
     # Ensure it is fixed
     assert new_analysis == skconf.analysis
     skconf.config['analysis'] = new_analysis
+    skconf.invalidate()
     return skconf
 
 def reordered_analysis(tabs, skconf, order):
@@ -131,6 +132,7 @@ def rearrange_submenus(submenu, order, skconf, tabs):
         if exe not in submenu_out_bases and exe not in new_analysis.keys():
             new_analysis[exe] = skconf.analysis[exe]
     skconf.config['analysis'] = new_analysis
+    skconf.invalidate()
     return skconf
 
 
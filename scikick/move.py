@@ -1,42 +1,48 @@
-"""functions for 'sk mv' subcommand"""
+"""functions for 'sk mv' subcommand
+
+sk mv first makes a MovePlan (plan_move) and then carries it out
+(execute_plan), or only prints it with --dry-run (print_plan).
+"""
 import os
-import time
+import re
 import shutil
-from re import sub, IGNORECASE
+import tempfile
+import subprocess
+from re import sub
 from scikick.utils import reterr, warn
-from scikick.layout import rm_commdir
-from scikick.yaml import yaml_in, rename
+from scikick.config import ConfigTransaction
 from scikick.yaml import supported_extensions
+from scikick.graph import node_id
 
 def sk_move_walk(src):
-    """Walks through the directory that is contained inside src
-    returns a list of files in the directory
-    and other directories inside it (recursively)
-    src -- list containing a directory name
+    """Files in src, with the files of its directories (recursively)
+    found with a single os.scandir walk
+    src -- list of files and directories
     """
-    while len(list(filter(lambda x: os.path.isdir(x), src))) > 0:
-        files = list(filter(lambda x: os.path.isfile(x), src))
-        dirs = list(filter(lambda x: os.path.isdir(x), src))
-        new_dirs = list()
-        for d in dirs:
-            walk_res = os.walk(d)
-            for w in walk_res:
-                for wd in w[1]:
-                    files.append(os.path.join(w[0], wd))
-                for wf in w[2]:
-                    new_dirs.append(os.path.join(w[0], wf))
-        files = list(set(files))
-        dirs = list(set(new_dirs))
-        src = files + dirs
-    return src
-
-def sk_move_check(src, dest):
+    files = list()
+    stack = list(reversed(src))
+    while len(stack) > 0:
+        path = stack.pop()
+        if not os.path.isdir(path):
+            if os.path.isfile(path):
+                files.append(path)
+            continue
+        with os.scandir(path) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name, reverse=True)
+        for entry in entries:
+            if entry.is_dir():
+                stack.append(entry.path)
+            elif entry.is_file():
+                files.append(entry.path)
+    return files
+
+def sk_move_check(src, dest, analysis):
     """Perform checks on src and dest
     and quit if bad arguments are given
     src -- list of files to move
-    des -- list containing the file/dir to move to
+    dest -- list containing the file/dir to move to
+    analysis -- 'analysis' dict of scikick.yml
     """
-    config = yaml_in()
     for s in src:
         if not os.path.exists(s):
             reterr(f"sk: Error: file or directory {s} doesn't exist")
@@ -48,118 +54,262 @@ def sk_move_check(src, dest):
         new_ext = os.path.splitext(dest[0])[1]
         if old_ext.lower() != new_ext.lower():
             warn("sk: Warning: changing file extension")
-        if (src[0] in config["analysis"].keys()) and \
+        if (src[0] in analysis.keys()) and \
             (new_ext.lower() not in map(str.lower, supported_extensions)):
             reterr(f"sk: Error: only extensions {', '.join(supported_extensions)} are supported ({new_ext} given)")
 
-def sk_move_prepare_src_dest(src, dest):
-    """Returns two lists of corresponding
-    files in src and dest
-    src -- list of files to move
-    des -- list containing the file/dir to move to
+def moved_name(name, targets):
+    """New name of a file if it is, or is in, a moved path (else None)
+    targets -- {moved path: new path}
+    """
+    path = name
+    while path not in ["", os.sep]:
+        if path in targets:
+            return targets[path] + name[len(path):]
+        path = os.path.dirname(path)
+    return None
+
+class MovePlan:
+    """Everything sk mv does, worked out before anything is moved
+    moves -- [(src, dest)] the arguments moved with mv (or git mv)
+    files -- {src: [files]} files moved with each directory argument
+    renames -- {old: new} files renamed in scikick.yml
+    outputs -- [(src, dest)] out_md and out_html files and directories of
+        moved pages
+    figures -- [(md or html, old tab name, new tab name)] figure paths to
+        rewrite in outputs moved to a new name
+    map_nodes -- [(html, old out_base, new out_base)] project map nodes
+        highlighted by moved htmls
+    txn -- ConfigTransaction the renames are applied to
+    """
+    def __init__(self, txn):
+        self.txn = txn
+        self.moves = list()
+        self.files = dict()
+        self.renames = dict()
+        self.outputs = list()
+        self.figures = list()
+        self.map_nodes = list()
+
+def same_depth(src, dest):
+    """Are src and dest in directories at the same depth (relative links
+    in an html stay valid when it moves)
+    """
+    depth = lambda path: len(os.path.dirname(os.path.normpath(path)).split(os.sep))
+    return depth(src) == depth(dest)
+
+def page_outputs_plan(plan, src, dest, report_dir):
+    """Add the moves of the md, knitmeta, figures and html of a page to plan"""
+    md_rootdir = os.path.join(report_dir, "out_md")
+    md_src = os.path.join(md_rootdir, os.path.splitext(src)[0] + ".md")
+    md_dest = os.path.join(md_rootdir, os.path.splitext(dest)[0] + ".md")
+    if os.path.isfile(md_src):
+        plan.outputs.append((md_src, md_dest))
+    k_src = sub(pattern=r"\.md$", repl=".knitmeta.RDS", string=md_src)
+    k_dest = sub(pattern=r"\.md$", repl=".knitmeta.RDS", string=md_dest)
+    if os.path.isfile(k_src):
+        plan.outputs.append((k_src, k_dest))
+    # the html is only kept if its links to other pages stay valid
+    html_rootdir = os.path.join(report_dir, "out_html")
+    html_src = os.path.join(html_rootdir, os.path.splitext(src)[0] + ".html")
+    html_dest = os.path.join(html_rootdir, os.path.splitext(dest)[0] + ".html")
+    moved_html = os.path.isfile(html_src) and same_depth(src, dest)
+    if moved_html:
+        plan.outputs.append((html_src, html_dest))
+        map_node_plan(plan, src, dest, report_dir)
+    # "figure" must match execute_code.R fig.path
+    tabname_src = os.path.splitext(os.path.basename(src))[0]
+    tabname_dest = os.path.splitext(os.path.basename(dest))[0]
+    md_srcfigdir = os.path.join(os.path.dirname(md_src), "figure", tabname_src)
+    md_destfigdir = os.path.join(os.path.dirname(md_dest), "figure", tabname_dest)
+    if os.path.isdir(md_srcfigdir):
+        plan.outputs.append((md_srcfigdir, md_destfigdir))
+        if tabname_src != tabname_dest and os.path.isfile(md_src):
+            plan.figures.append((md_dest, tabname_src, tabname_dest))
+    # htmls that are not self_contained link figures copied next to them
+    html_srcfigdir = os.path.join(os.path.dirname(html_src), "figure", tabname_src)
+    html_destfigdir = os.path.join(os.path.dirname(html_dest), "figure", tabname_dest)
+    if moved_html and os.path.isdir(html_srcfigdir):
+        plan.outputs.append((html_srcfigdir, html_destfigdir))
+        if tabname_src != tabname_dest:
+            plan.figures.append((html_dest, tabname_src, tabname_dest))
+
+def map_node_plan(plan, src, dest, report_dir):
+    """Add the rewrite of the project map node highlighted by the moved
+    html of a page to plan (its out_base changes)
     """
-    if len(src) == 1:
-        # if src holds a single file - handle the same as if multiple
-        if os.path.isdir(src[0]):
-            new_src = sk_move_walk(src)
-            if not os.path.exists(dest[0]):
-                new_dest = list(map(lambda f: \
-                    os.path.join(dest[0], rm_commdir(f, src[0])), \
-                    new_src))
-            else:
-                new_dest = list(map(lambda f: \
-                    os.path.join(dest[0], os.path.basename(src[0]),
-                        rm_commdir(f, src[0])), \
-                    new_src))
-            return (new_src, new_dest)
-        if os.path.isfile(src[0]) and \
-            (not os.path.isdir(dest[0])):
-            return (src, dest)
-    # if dest[0] doesn't exist, or is a file
-    # shutil.move will take care of that
-    # so dest[0] is an existing directory
-    new_src = list()
-    new_dest = list()
+    html_dest = os.path.join(report_dir, "out_html", os.path.splitext(dest)[0] + ".html")
+    plan.map_nodes.append((html_dest, os.path.splitext(src)[0],
+        os.path.splitext(dest)[0]))
+
+def plan_move(src, dest):
+    """Work out the moves of sk mv src dest
+    src -- list of files and directories to move
+    dest -- list containing the file/dir to move to
+    Returns a MovePlan
+    """
+    txn = ConfigTransaction(need_pages=True)
+    analysis = txn.analysis
+    sk_move_check(src, dest, analysis)
+    plan = MovePlan(txn)
+    # where each argument ends up (as shutil.move)
+    targets = dict()
     for s in src:
-        if os.path.isfile(s):
-            new_src.append(s)
-            new_dest.append(os.path.join(dest[0], os.path.basename(s)))
+        if os.path.isdir(dest[0]):
+            target = os.path.join(dest[0], os.path.basename(s))
+        else:
+            target = dest[0]
+        targets[s] = os.path.normpath(target)
+        plan.moves.append((s, dest[0]))
         if os.path.isdir(s):
-            dir_src = sk_move_walk([s])
-            new_src += dir_src
-            new_dest += list(map(lambda f: \
-                os.path.join(dest[0], os.path.basename(s), \
-                    rm_commdir(f, s)), dir_src))
-    return (new_src, new_dest)
-
-def sk_move_extras(mv_dict):
-    """Performs move operations specific to scikick
-    Moves md files, figures in output/ directories
-    and renames files in scikick.yml
-    mv_dict -- dict with keys as src and values as dest files
+            plan.files[s] = sk_move_walk([s])
+    # scikick.yml entries in a single pass over the names
+    for exe, deps in analysis.items():
+        for name in [exe] + (list(deps) if deps is not None else []):
+            if name in plan.renames:
+                continue
+            new_name = moved_name(name, targets)
+            if new_name is not None:
+                plan.renames[name] = new_name
+    # outputs of the moved pages, whole directories at once if possible
+    report_dir = txn.config["reportdir"]
+    batched = dict()
+    batched_htmls = dict()
+    for s, target in targets.items():
+        md_srcdir = os.path.join(report_dir, "out_md", s)
+        md_destdir = os.path.join(report_dir, "out_md", target)
+        if s in plan.files and os.path.isdir(md_srcdir) and \
+            not os.path.exists(md_destdir):
+            plan.outputs.append((md_srcdir, md_destdir))
+            batched[s] = target
+            # page names (and figure paths) are unchanged in a moved directory
+            html_srcdir = os.path.join(report_dir, "out_html", s)
+            html_destdir = os.path.join(report_dir, "out_html", target)
+            if os.path.isdir(html_srcdir) and same_depth(s, target) and \
+                not os.path.exists(html_destdir):
+                plan.outputs.append((html_srcdir, html_destdir))
+                batched_htmls[s] = target
+    for name, new_name in plan.renames.items():
+        if name not in analysis.keys():
+            continue
+        if moved_name(name, batched) is None:
+            page_outputs_plan(plan, name, new_name, report_dir)
+        elif moved_name(name, batched_htmls) is not None and \
+            os.path.isfile(os.path.join(report_dir, "out_html",
+                os.path.splitext(name)[0] + ".html")):
+            map_node_plan(plan, name, new_name, report_dir)
+    return plan
+
+def print_plan(plan, verbose=False):
+    """Print the moves of plan (sk mv --dry-run)"""
+    for s, d in plan.moves:
+        if s in plan.files:
+            print(f"sk: mv {s} {d} ({len(plan.files[s])} files)")
+            if verbose:
+                for f in plan.files[s]:
+                    print(f"sk:   {f}")
+        else:
+            print(f"sk: mv {s} {d}")
+    for s, d in plan.outputs:
+        print(f"sk: mv {s} {d}")
+    for path, tabname_src, tabname_dest in plan.figures:
+        print(f"sk: figure/{tabname_src} -> figure/{tabname_dest} in {path}")
+    for path, out_base_src, out_base_dest in plan.map_nodes:
+        print(f"sk: project map node {out_base_src} -> {out_base_dest} in {path}")
+    for name, new_name in plan.renames.items():
+        print(f"sk: {name} -> {new_name} in ./scikick.yml")
+    print("sk: Dry run, nothing was moved")
+
+def move_path(s, d, git=False):
+    """mv (or git mv, falling back to mv) s to d"""
+    git_retcode = 0
+    if git:
+        print(f"sk: git mv {s} {d}")
+        git_res = subprocess.run(["git", "mv", s, d], stderr=subprocess.PIPE)
+        git_retcode = git_res.returncode
+        if git_retcode != 0:
+            warn("sk: Warning: Git returned an error:")
+            warn(git_res.stderr.decode().strip())
+            warn("sk: Warning: Falling back to mv")
+    if (git_retcode != 0) or (not git):
+        print(f"sk: mv {s} {d}")
+        shutil.move(s, d)
+
+def figure_ref_pattern(tabname):
+    """Pattern of paths into the figure directory of a page in its md
+    (src="figure/tab/..., ![](figure/tab/...) or html
+    """
+    return re.compile(rb'(["\'(=])figure/' + re.escape(tabname.encode()) + rb'/')
+
+def rewrite_lines(path, pattern, repl):
+    """Substitute pattern (bytes) in a file line by line through a temporary
+    file that replaces path, keeping the mtime of path to avoid reexecution
+    Returns False if pattern was not found
     """
-    # Moving mds, knitmetas and output figures in out_md/; 
+    st = os.stat(path)
+    changed = False
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    try:
+        with open(path, "rb") as src_file, os.fdopen(tmp_fd, "wb") as tmp_file:
+            for line in src_file:
+                new_line = pattern.sub(repl, line)
+                changed = changed or new_line != line
+                tmp_file.write(new_line)
+        if not changed:
+            os.remove(tmp_path)
+            return False
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return True
+
+def rewrite_figure_refs(path, tabname_src, tabname_dest):
+    """Point the figure paths in an md or html to the renamed figure
+    directory
+    Returns False if path had no figure paths to rewrite
+    """
+    new_dir = b"figure/" + tabname_dest.encode() + b"/"
+    return rewrite_lines(path, figure_ref_pattern(tabname_src),
+        lambda match: match.group(1) + new_dir)
+
+def rewrite_map_node(path, out_base_src, out_base_dest):
+    """Point the project map iframe of a moved html to the node of its new
+    out_base (see graph.project_map_html)
+    Returns False if the html did not highlight the old node
+    """
+    pattern = re.compile(re.escape(b"#" + node_id(out_base_src).encode()) + rb'(?=")')
+    new_id = b"#" + node_id(out_base_dest).encode()
+    return rewrite_lines(path, pattern, lambda match: new_id)
+
+def execute_plan(plan, git=False, verbose=False):
+    """Move the files of plan and rename them in scikick.yml"""
+    for s, d in plan.moves:
+        move_path(s, d, git)
+        if verbose and s in plan.files:
+            for f in plan.files[s]:
+                print(f"sk:   {f}")
+    # Moving mds, knitmetas and output figures in out_md/ and htmls;
     ## No need to change _site.ymls, since
     ## they are recreated after each change in scikick.yml
-    yaml_dict = yaml_in()
-    analysis = yaml_dict["analysis"]
-    reportdir = yaml_dict["reportdir"]
-    for src, dest in mv_dict.items():
-        # if not in analysis.keys -> regular file
-        # in this case, rename and continue
-        if src not in analysis.keys():
-            if 1 == rename(src, dest):
-                warn("sk: %s renamed to %s in ./scikick.yml" % (src, dest))
-            else:
-                warn("sk: Warning: %s not found in ./scikick.yml" % src)
-            continue
-        md_rootdir = os.path.join(reportdir, "out_md")
-        md_destdir = os.path.join(md_rootdir, os.path.dirname(dest))
-        md_srcdir = os.path.join(md_rootdir, os.path.dirname(src))
-        if not os.path.isdir(md_destdir):
-            os.makedirs(md_destdir)
-        # Move .md
-        md_src = os.path.join(md_rootdir, os.path.splitext(src)[0] + ".md")
-        md_dest = os.path.join(md_destdir, os.path.splitext(os.path.basename(dest))[0] + ".md")
-        if os.path.isfile(md_src):
-            shutil.move(md_src, md_dest)
-        # Move knitmeta
-        k_src = sub(pattern="\.md$", repl=".knitmeta.RDS",
-                    string=md_src)
-        k_dest = sub(pattern="\.md$", repl=".knitmeta.RDS",
-                     string=md_dest)
-        if os.path.isfile(k_src):
-            shutil.move(k_src, k_dest)
-        # Move markdown outputs (figures)
-        tabname_src = sub(string=os.path.basename(md_src),
-            pattern="\.md$", repl="")
-        tabname_dest = sub(string=os.path.basename(md_dest),
-            pattern="\.md$", repl="")
-        # "figure" must match execute_code.R fig.path
-        md_srcfigdir = os.path.join(md_srcdir, "figure", tabname_src)
-        md_destfigdir = os.path.join(md_destdir, "figure", tabname_dest)
-        if os.path.isdir(md_srcfigdir):
-            dest_dirname = os.path.dirname(md_srcfigdir)
-            if not os.path.isdir(dest_dirname):
-                os.makedirs(dest_dirname, exist_oke=True)
-            print(f"sk: mv {md_srcfigdir} {md_destfigdir}")
-            shutil.move(md_srcfigdir, md_destfigdir)
-            # rename the figure/ directory name in the dest md
-            ## get the initial timestamp
-            initial_timestamp = os.path.getmtime(md_dest)
-            md_file = open(md_dest, 'r+')
-            md_lines = [sub(string=line,
-                pattern=f'src="figure/{tabname_src}',
-                repl=f'src="figure/{tabname_dest}')
-                for line in md_file]
-            md_file.seek(0)
-            for l in md_lines:
-                md_file.write(l)
-            md_file.close()
-            # set the initial timestamp back to avoid reexecution
-            os.utime(md_dest, (initial_timestamp, initial_timestamp))
-        # rename all entries in scikick.yml from from to f_dest
-        if 1 == rename(src, dest):
+    for s, d in plan.outputs:
+        os.makedirs(os.path.dirname(d), exist_ok=True)
+        if verbose or os.path.isdir(s):
+            print(f"sk: mv {s} {d}")
+        shutil.move(s, d)
+    for path, tabname_src, tabname_dest in plan.figures:
+        rewrite_figure_refs(path, tabname_src, tabname_dest)
+    for path, out_base_src, out_base_dest in plan.map_nodes:
+        rewrite_map_node(path, out_base_src, out_base_dest)
+    # rename all entries in scikick.yml from src to dest at once
+    found = plan.txn.rename(plan.renames)
+    for src, dest in plan.renames.items():
+        if src in found:
             warn("sk: %s renamed to %s in ./scikick.yml" % (src, dest))
-        else:
-            warn("sk: Warning: %s not found in ./scikick.yml" % src)
+    for s, _ in plan.moves:
+        if s not in plan.files and s not in found:
+            warn("sk: Warning: %s not found in ./scikick.yml" % s)
+    plan.txn.commit()
@@ -0,0 +1,62 @@
+"""Unix socket server for worker pools started by sk run
+
+Jobs started by snakemake send one JSON request per connection and
+wait for the JSON response (see rworkers.py and kernels.py)
+"""
+import os
+import json
+import shutil
+import socket
+import tempfile
+import threading
+
+class RequestServer:
+    """Answers requests with self.run(request) in a thread per connection"""
+    def __init__(self):
+        self.sock_dir = tempfile.mkdtemp(prefix="sk_pool_")
+        self.address = os.path.join(self.sock_dir, "socket")
+        self.server = None
+
+    def run(self, request):
+        """Return the response (dict) to request (dict)"""
+        raise NotImplementedError
+
+    def start(self):
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.address)
+        self.server.listen()
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                # server was closed
+                return
+            threading.Thread(target=self.handle, args=(conn,), \
+                daemon=True).start()
+
+    def handle(self, conn):
+        with conn, conn.makefile("rw") as stream:
+            response = self.run(json.loads(stream.readline()))
+            stream.write(json.dumps(response) + "\n")
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
+        shutil.rmtree(self.sock_dir, ignore_errors=True)
+
+def submit(address, request):
+    """Send request (dict) to the server at address
+    Returns the response (dict), None if the connection was closed
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        with sock.makefile("rw") as stream:
+            stream.write(json.dumps(request) + "\n")
+            stream.flush()
+            response = stream.readline()
+    if response == "":
+        return None
+    return json.loads(response)
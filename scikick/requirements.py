@@ -0,0 +1,236 @@
+"""Checks of the software scikick needs (sk init and sk doctor)
+
+The programs are probed concurrently and the R packages are checked in a
+single Rscript. Results are cached per user (cache_path()) by the resolved
+path and mtime of each program, so they are only probed again when a
+program is installed, updated or removed. Missing programs and R packages
+are not cached. sk doctor probes everything again.
+"""
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from scikick.utils import reterr, warn
+
+# R packages needed to execute and render pages
+r_packages = ["yaml", "knitr", "rmarkdown", "git2r"]
+# {package: minimum version} (warnings only)
+r_min_versions = {"git2r": (0, 27)}
+# (program, minimum version, level) in the order they are reported
+# "Error" programs are required
+programs = [("pandoc", (2, 0), "Error"), ("git", (2, 0), "Warning"),
+    ("singularity", (0, 0), "Warning"), ("conda", (0, 0), "Warning")]
+
+# Prints one line per package: name, version (NA if missing)
+r_check_script = "for (p in commandArgs(TRUE)) cat(p, " + \
+    "if (requireNamespace(p, quietly = TRUE)) " + \
+    "as.character(packageVersion(p)) else 'NA', '\\n'); " + \
+    "cat('R', paste(R.version$major, R.version$minor, sep = '.'), '\\n')"
+
+def cache_path():
+    cache_home = os.environ.get("XDG_CACHE_HOME",
+        os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "scikick", "requirements.json")
+
+class RequirementsCache:
+    """Probe results of the last check
+    tools -- {program: {"path": resolved path, "mtime_ns": int, ...}}
+    """
+    version = 1
+
+    def __init__(self, refresh=False):
+        self.path = cache_path()
+        self.tools = dict()
+        self.modified = False
+        if refresh:
+            return
+        try:
+            with open(self.path, "r") as cache_file:
+                cache = json.load(cache_file)
+            if cache.get("version") == self.version:
+                self.tools = cache["tools"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def get(self, program, key):
+        """Cached result of program if it is still the same file"""
+        entry = self.tools.get(program)
+        if entry is None or key is None or \
+            [entry["path"], entry["mtime_ns"]] != key:
+            return None
+        return entry
+
+    def put(self, program, key, **result):
+        self.tools[program] = dict(path=key[0], mtime_ns=key[1], **result)
+        self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+        # Write atomically, sk may run in several projects at once
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+            with os.fdopen(tmp_fd, "w") as tmp_file:
+                json.dump({"version": self.version, "tools": self.tools}, tmp_file)
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            warn(f"sk: Warning: Could not write {self.path}: {e}")
+
+def program_key(program):
+    """[resolved path, mtime_ns] of program on PATH (None if not found)"""
+    path = shutil.which(program)
+    if path is None:
+        return None
+    path = os.path.realpath(path)
+    try:
+        return [path, os.stat(path).st_mtime_ns]
+    except OSError:
+        return None
+
+def parse_version(line):
+    """(major, minor) of the first word of line that looks like a version
+    (None if there is none)
+    """
+    for word in line.strip().split(" "):
+        parts = word.split(".")
+        if len(parts) >= 2 and parts[0].isdigit() and parts[1].isdigit():
+            return (int(parts[0]), int(parts[1]))
+    return None
+
+def probe_program(program, key, cache):
+    """First line of program --version (None if it did not run)"""
+    if key is None:
+        return None
+    entry = cache.get(program, key)
+    if entry is not None:
+        return entry["line"]
+    try:
+        proc = subprocess.run([key[0], "--version"], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    line = proc.stdout.decode("utf-8", errors="replace").split("\n")[0].strip()
+    cache.put(program, key, line=line)
+    return line
+
+def probe_r(key, cache):
+    """Versions of R and of r_packages in one Rscript
+    Returns ({package: version or None}, R version), None if R did not run
+    """
+    if key is None:
+        return None
+    entry = cache.get("Rscript", key)
+    if entry is not None and set(entry["packages"].keys()) == set(r_packages):
+        return entry["packages"], entry["r_version"]
+    try:
+        proc = subprocess.run([key[0], "-e", r_check_script] + r_packages,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    packages = {pkg: None for pkg in r_packages}
+    r_version = None
+    for line in proc.stdout.decode("utf-8", errors="replace").split("\n"):
+        fields = line.split()
+        if len(fields) != 2:
+            continue
+        if fields[0] == "R":
+            r_version = fields[1]
+        elif fields[0] in packages and fields[1] != "NA":
+            packages[fields[0]] = fields[1]
+    # missing packages are checked again next time
+    if all(version is not None for version in packages.values()):
+        cache.put("Rscript", key, packages=packages, r_version=r_version)
+    return packages, r_version
+
+def probe_all(refresh=False):
+    """Probe R and programs concurrently
+    Returns (R probe, {program: (path, --version line)})
+    """
+    cache = RequirementsCache(refresh)
+    names = ["Rscript"] + [program for program, _, _ in programs]
+    keys = {name: program_key(name) for name in names}
+    with ThreadPoolExecutor(max_workers=len(names)) as pool:
+        r_future = pool.submit(probe_r, keys["Rscript"], cache)
+        futures = {program: pool.submit(probe_program, program, keys[program], cache) \
+            for program, _, _ in programs}
+        r_result = r_future.result()
+        lines = {program: future.result() for program, future in futures.items()}
+    cache.save()
+    found = {program: (keys[program][0] if keys[program] is not None else None, \
+        lines[program]) for program in lines}
+    return r_result, found
+
+def report_program(program, line, min_ver, level):
+    """Warn about a missing or old program, returns 0 on failure, else 1"""
+    if line is None:
+        warn(f"sk: Warning: {program} not found")
+        return 0
+    version = parse_version(line)
+    if version is None:
+        warn(f"sk: Warning: Could not parse {program} version")
+        return 1
+    if version < min_ver:
+        warn(f"sk: {level}: {program} version " + \
+            f">= {'.'.join(map(str, min_ver))} not found")
+        return 0
+    return 1
+
+def report_r(r_result):
+    """Warn about missing R packages, returns 0 on failure, else 1"""
+    if r_result is None:
+        warn("sk: Error: R / Rscript not found")
+        return 0
+    packages, _ = r_result
+    all_installed = 1
+    for pkg in r_packages:
+        if packages[pkg] is None:
+            warn(f"sk: Error: required R library '{pkg}' is not installed")
+            all_installed = 0
+    for pkg, min_ver in r_min_versions.items():
+        version = packages.get(pkg)
+        if version is not None and parse_version(version.replace("-", ".")) < min_ver:
+            warn(f"sk: Warning: Version of {pkg} needs to be at least " + \
+                ".".join(map(str, min_ver)))
+    return all_installed
+
+def check_requirements(refresh=False):
+    """Performs a check for necessary and optional applications/packages
+    refresh -- bool, probe everything again instead of using the cache
+    """
+    warn("sk: Checking scikick software dependencies")
+    r_result, found = probe_all(refresh)
+    status = dict()
+    for program, min_ver, level in programs:
+        if level == "Error":
+            status[program] = report_program(program, found[program][1], min_ver, level)
+    r_ver_stat = report_r(r_result)
+    # exit if not sufficient / found
+    if r_ver_stat == 0 or any(stat == 0 for stat in status.values()):
+        reterr("sk: Error: Required packages not found")
+    # check for optional programs (warnings only)
+    for program, min_ver, level in programs:
+        if level != "Error":
+            report_program(program, found[program][1], min_ver, level)
+    return r_result, found
+
+def doctor():
+    """sk doctor: check the software again and show what was found"""
+    r_result, found = check_requirements(refresh=True)
+    packages, r_version = r_result
+    print(f"R {r_version} ({os.path.realpath(shutil.which('Rscript'))})")
+    for pkg in r_packages:
+        print(f"  {pkg} {packages[pkg]}")
+    for program, _, _ in programs:
+        path, line = found[program]
+        if line is None:
+            print(f"{program}: not found")
+        else:
+            print(f"{program}: {line} ({path})")
+    print(f"sk: Results cached in {cache_path()}")
@@ -0,0 +1,163 @@
+"""Pool of persistent R processes that execute R/Rmd pages and render html
+
+sk run starts the pool (snakefile_args: r_workers). The sk_exe_rmd, sk_exe_r
+and generate_html jobs submit their page with 'python -m scikick.rworkers'
+instead of starting Rscript and loading knitr and rmarkdown for every page.
+Renders are not batched: each html is still its own generate_html job (as
+used by sk status and early cutoff) and request, only the R process is
+shared, up to r_workers pages render at once. Without r_workers every page
+starts Rscript.
+
+After each page the worker restores the working directory, options(), the
+RNG (unseeded, as in a new session), environment variables, knitr options,
+attached packages and globals (see .sk_reset in worker.R). Namespaces loaded
+by a page stay loaded for the next pages of the worker, so code depending
+on whether a package is loaded (e.g. isNamespaceLoaded(), S3 methods
+registered on load) may behave differently than in a new Rscript.
+"""
+import os
+import sys
+import queue
+import shutil
+import tempfile
+import contextlib
+import subprocess
+from scikick.utils import warn, get_sk_exe_dir
+from scikick import pool
+from scikick.pool import RequestServer
+
+# Environment variable with the address (socket path) of the running pool
+pool_env_var = "SK_R_POOL"
+
+class RWorker:
+    """An R process running worker.R"""
+    def __init__(self):
+        worker_script = os.path.join(get_sk_exe_dir(), "workflow", \
+            "notebook_rules", "worker.R")
+        self.proc = subprocess.Popen(["Rscript", worker_script], \
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, \
+            stderr=subprocess.STDOUT, text=True, bufsize=1)
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def request(self, task, args, log):
+        """Run a task of worker.R, logging to log
+        task -- 'knit' (args: exe, md) or 'render' (args: md, html, index_html)
+        Returns True if the task was successful
+        """
+        fields = [task] + list(args) + [log]
+        try:
+            self.proc.stdin.write("\t".join(fields) + "\n")
+            self.proc.stdin.flush()
+            # skip output of R outside of requests
+            for line in self.proc.stdout:
+                if line.startswith("SK "):
+                    return line.strip() == "SK OK"
+        except (BrokenPipeError, OSError):
+            pass
+        # the R process ended during the page (e.g. quit() was called)
+        with open(log, "a") as logfile:
+            logfile.write("sk: R worker process ended unexpectedly\n")
+        return False
+
+    def stop(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
+
+class RWorkerPool(RequestServer):
+    """R workers serving page requests on a unix socket"""
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+        self.idle = queue.Queue()
+        self.workers = []
+
+    def start(self):
+        for _ in range(self.size):
+            worker = RWorker()
+            self.workers.append(worker)
+            self.idle.put(worker)
+        super().start()
+
+    def run(self, request):
+        worker = self.idle.get()
+        try:
+            ok = worker.request(request["task"], request["args"], \
+                request["log"])
+        finally:
+            if not worker.alive():
+                self.workers.remove(worker)
+                worker = RWorker()
+                self.workers.append(worker)
+            self.idle.put(worker)
+        return {"ok": ok}
+
+    def stop(self):
+        super().stop()
+        for worker in self.workers:
+            worker.stop()
+
+@contextlib.contextmanager
+def r_worker_pool(skconf, dryrun=False):
+    """Run a RWorkerPool (if enabled) while snakemake executes
+    skconf -- ScikickConfig
+    The pool's address is exported in os.environ[pool_env_var]
+    """
+    size = int(skconf.snakefile_arg("r_workers") or 0)
+    if dryrun or size <= 0:
+        yield None
+        return
+    if skconf.snakefile_arg("singularity") != "" or \
+        skconf.snakefile_arg("conda") != "":
+        warn("sk: Warning: r_workers is not used with singularity or conda")
+        yield None
+        return
+    # every page (and the homepage) is rendered
+    pages = len(set(skconf.exes + [skconf.index_exe]))
+    workers = RWorkerPool(min(size, pages))
+    try:
+        workers.start()
+    except OSError as e:
+        warn(f"sk: Warning: Could not start R workers ({e})")
+        workers.stop()
+        yield None
+        return
+    os.environ[pool_env_var] = workers.address
+    try:
+        yield workers
+    finally:
+        os.environ.pop(pool_env_var, None)
+        workers.stop()
+
+def submit(task, args, log):
+    """Run a task with the pool at os.environ[pool_env_var]
+    Returns True if the task was successful
+    """
+    request = {"task": task, "args": args, "log": log}
+    response = pool.submit(os.environ[pool_env_var], request)
+    return response is not None and response["ok"]
+
+def main(argv):
+    """python -m scikick.rworkers knit <exe> <md> <log>
+    python -m scikick.rworkers render <md> <html> <index_html>
+    """
+    task = argv[0]
+    if task == "knit":
+        return submit(task, argv[1:3], argv[3])
+    # render output goes to the job's output as with Rscript
+    logfd, log = tempfile.mkstemp(prefix="sk_render_", suffix=".txt")
+    os.close(logfd)
+    try:
+        ok = submit(task, argv[1:4], log)
+        with open(log) as logfile:
+            shutil.copyfileobj(logfile, sys.stdout)
+    finally:
+        os.remove(log)
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if main(sys.argv[1:]) else 1)
@@ -1,31 +1,25 @@
 #!/usr/bin/env python3
-"""CLI tool script"""
+"""CLI tool script
+
+Modules used by the subcommands are imported in the functions running
+them, so that e.g. sk add does not import snakemake (see
+tests/test_startup.py)
+"""
 import os
 import sys
 import argparse
-import shutil
-import subprocess
-from re import sub, match, IGNORECASE
-from ruamel.yaml import YAML, dump, RoundTripDumper
-from ruamel.yaml.compat import ordereddict
 import scikick
-import scikick.yaml
-from scikick.utils import reterr, warn, get_sk_snakefile, get_sk_exe_dir
-from scikick.snakemake import run_snakemake
-from scikick.status import snake_status
-from scikick.config import ScikickConfig, write_snakefile_arg
-from scikick.layout import rearrange_tabs, rearrange_submenus, new_tab_order, get_tabs
-from scikick.init import init
-from scikick.yaml import yaml_in, yaml_dump, yaml_check
-from scikick.move import sk_move_check, sk_move_extras
-from scikick.move import sk_move_prepare_src_dest
+from scikick.utils import reterr, warn, get_sk_snakefile
 
 def sk_run(args):
     """Run the workflow"""
-    
+    from scikick.snakemake import run_snakemake
+    from scikick.yaml import reterr_no_pages
     # check for empty analysis unless a script will be added
     need_pages = args.script is None
-    skconfig = ScikickConfig(need_pages=need_pages) 
+    skconfig = args.skconfig
+    if need_pages and len(skconfig.analysis) == 0:
+        reterr_no_pages()
     reportdir = skconfig.report_dir
 
     if args.snakeargs is not None:
@@ -39,12 +33,18 @@ def sk_run(args):
                   snakeargs=snakeargs, \
                   verbose=args.verbose, \
                   rmds=args.script, \
-                  quiet=args.quiet)
+                  quiet=args.quiet, \
+                  skconfig=skconfig, \
+                  jobs=args.jobs, \
+                  only=args.only or [], \
+                  downstream=args.downstream or [], \
+                  no_upstream=args.no_upstream)
     sys.exit(retcode)
 
 
 def sk_init(args):
     """Initialize scikick project"""
+    from scikick.init import init
     if not (args.git or args.dirs or args.yaml or args.readme or args.demo):
         args.yaml = True
         warn("sk: No arguments supplied, defaulting to sk init -y")
@@ -62,61 +62,47 @@ def sk_init(args):
 
 def sk_add(args):
     """Add Rmds to scikick.yml"""
+    import scikick.yaml
     scikick.yaml.add(args.script, args.depends_on, args.force, args.copy_deps)
 
 
 def sk_del(args):
     """Remove Rmds from scikick.yml"""
+    import scikick.yaml
     scikick.yaml.rm(args.script, args.depends_on)
 
 
 def sk_mv(args):
     """Rename an Rmd in scikick.yml and associated files"""
-    config = yaml_in(need_pages=True)
+    from scikick.move import plan_move, print_plan, execute_plan
     # multiple args
     src = [os.path.normpath(p) for p in args.src]
     # only a single arg
     dest = [os.path.normpath(p) for p in args.dest]
-    #check if src and dest are valid
-    sk_move_check(src, dest)
-    # save the (src, dest) pairs (to be used with moves in scikick.yml)
-    (new_src, new_dest) = sk_move_prepare_src_dest(src, dest)
-    new_src = list(map(os.path.normpath, new_src))
-    new_dest = list(map(os.path.normpath, new_dest))
-    # leave only unique pairs of (src, dest) files
-    mv_dict = ordereddict()
-    for k in new_src:
-        i = new_src.index(k)
-        mv_dict[new_src[i]] = new_dest[i]
-    # perform the move operation (using the initial args)
-    for s in src:
-        git_retcode = 0
-        if args.git:
-            print(f"sk: git mv {s} {dest[0]}")
-            git_res = subprocess.run(f"git mv {s} {dest[0]}", shell=True, \
-                stderr=subprocess.PIPE)
-            git_retcode = git_res.returncode
-            if git_retcode != 0:
-                warn("sk: Warning: Git returned an error:")
-                warn(git_res.stderr.decode().strip())
-                warn("sk: Warning: Falling back to mv")
-        if (git_retcode != 0) or (not args.git):
-            print(f"sk: mv {s} {dest[0]}")
-            shutil.move(s, dest[0])
-    sk_move_extras(mv_dict)
+    plan = plan_move(src, dest)
+    if args.dry_run:
+        print_plan(plan, args.verbose)
+    else:
+        execute_plan(plan, args.git, args.verbose)
 
 def sk_status(args):
     """Get status of the current workflow"""
+    from scikick.status import snake_status
     snake_status(snakefile=get_sk_snakefile(), \
                  workdir=os.getcwd(), \
                  verbose=args.verbose, \
-                 rmd=args.script)
+                 rmd=args.script, \
+                 skconf=args.skconfig, \
+                 snakemake=args.snakemake)
 
 
 def sk_layout(args):
     """Manipulate the tab order in resulting htmls by changing
     the order of keys of 'analysis' dict in scikick.yml.
     """
+    from scikick.config import ScikickConfig
+    from scikick.layout import rearrange_tabs, rearrange_submenus, get_tabs
+    from scikick.yaml import yaml_dump
     skconf=ScikickConfig(need_pages=True)
     tabs = get_tabs(skconf)
     # modify the layout of a submenu
@@ -144,19 +130,29 @@ def sk_layout(args):
 # 1. sk config 			Show the full config          (get)
 # 2. sk config --<arg> 		Show the setting for this arg (get)
 # 3. sk config --<arg> <value> 	Assign value to arg           (set)
+# With a script, modes 2 and 3 apply to the script's resources only
 def sk_config(args):
-    skconfig=ScikickConfig()
+    from ruamel.yaml import YAML
+    from scikick.config import write_snakefile_arg
+    skconfig=args.skconfig
     config_exists = 'snakefile_args' in skconfig.config.keys()
 
     # values that will be present if only arg was provided (e.g. sk config --conda)
-    const_vals = ["SING_GET", "CONDA_GET", 999999, "BENCH_GET"]
-    possible_args = ["singularity", "conda", "threads", "benchmark"]
+    const_vals = ["SING_GET", "CONDA_GET", 999999, "BENCH_GET", 999999, 999999,
+        999999, 999999, "CACHE_GET", 999999, "NAV_GET", 999999]
+    possible_args = ["singularity", "conda", "threads", "benchmark", "jobs", "mem_mb",
+        "r_workers", "kernels", "build_cache", "build_cache_mb", "navbar",
+        "early_cutoff"]
+
+    if args.script is not None:
+        sk_config_page(args, const_vals, possible_args)
+        return
 
     # Mode 1 - get all values
     provided_args = list(filter(lambda s: getattr(args, s) is not None, possible_args))
     if len(provided_args) == 0:
         if config_exists:
-            dump(skconfig.config['snakefile_args'], sys.stdout, Dumper=RoundTripDumper)
+            YAML().dump(skconfig.config['snakefile_args'], sys.stdout)
         else:
             print("sk: No config options have been set (see sk config --help for options)")
     else:
@@ -177,8 +173,43 @@ def sk_config(args):
                         print(f"sk: Argument {this_arg} has not been set")
             # Mode 3 - set value
             elif arg_was_provided and not val_was_empty:
+                if this_arg == "navbar" and given_val not in ["embedded", "external"]:
+                    reterr("sk: Error: --navbar must be 'embedded' or 'external'")
                 write_snakefile_arg(this_arg, given_val)
 
+def sk_config_page(args, const_vals, possible_args):
+    """sk config modes for the resources of a single script"""
+    from ruamel.yaml import YAML
+    from scikick.config import write_page_resource
+    skconfig = args.skconfig
+    script = os.path.normpath(args.script)
+    if script not in skconfig.analysis.keys():
+        reterr(f"sk: Error: {script} not found in scikick.yml")
+    page_resources = skconfig.page_resources.get(script)
+    if page_resources is None:
+        page_resources = dict()
+    provided_args = list(filter(lambda s: getattr(args, s) is not None, possible_args))
+    # Mode 1 - get all values
+    if len(provided_args) == 0:
+        if len(page_resources) > 0:
+            YAML().dump(dict(page_resources), sys.stdout)
+        else:
+            print(f"sk: No resources have been set for {script}")
+        return
+    for this_arg in provided_args:
+        if this_arg not in skconfig.page_resource_names:
+            reterr(f"sk: Error: Only {', '.join(skconfig.page_resource_names)} can be set for a script")
+        given_val = getattr(args, this_arg)
+        # Mode 2 - get one value
+        if given_val == const_vals[possible_args.index(this_arg)]:
+            if this_arg in page_resources:
+                print(f"sk: Resource {this_arg} of {script} is set to {page_resources[this_arg]}")
+            else:
+                print(f"sk: Resource {this_arg} of {script} has not been set")
+        # Mode 3 - set value
+        else:
+            write_page_resource(script, this_arg, given_val)
+
 parser = argparse.ArgumentParser(
 		description="See available scikick commands below")
 parser.add_argument("-v", "--version", action="version", \
@@ -193,8 +224,16 @@ parser_run.add_argument("script", type=str, nargs="*", \
                         help="Generate htmls only for the listed script (optional)")
 parser_run.add_argument("-v", "--verbose", action="store_true")
 parser_run.add_argument("-q", "--quiet", action="store_true")
+parser_run.add_argument("-j", "--jobs", type=int, \
+                        help="Number of cores to use, allowing independent scripts to execute in parallel (default: sk config --jobs, or 1)")
 parser_run.add_argument("-d", "--dryrun", action="store_true", \
                         help="Show snakemake's planned execution (wrapper for snakemake -n)")
+parser_run.add_argument("--only", type=str, action="append", metavar="SCRIPT", \
+                        help="Generate the html of SCRIPT, a script in scikick.yml (can be repeated)")
+parser_run.add_argument("--downstream", type=str, action="append", metavar="FILE", \
+                        help="Generate the htmls of the scripts depending (recursively) on FILE (can be repeated)")
+parser_run.add_argument("--no-upstream", action="store_true", \
+                        help="Only execute the targeted scripts, using the current outputs of the scripts they depend on")
 parser_run.add_argument("-s", "--snakeargs", nargs=argparse.REMAINDER, \
                         help="Pass all trailing arguments to snakemake")
 parser_run.set_defaults(func=sk_run, which="run")
@@ -254,6 +293,8 @@ parser_mv.add_argument("-g", "--git", action="store_true", \
                        help="Use git mv instead of basic mv to track with git")
 parser_mv.add_argument("-v", "--verbose", action="store_true", \
                        help="Show all moves taking place (mainly for debugging)")
+parser_mv.add_argument("-n", "--dry-run", action="store_true", \
+                       help="Show the planned moves and scikick.yml changes without moving anything")
 parser_mv.set_defaults(func=sk_mv, which="mv")
 
 # status
@@ -264,6 +305,8 @@ parser_status.add_argument("script", type=str, nargs="?", \
                            help="Show status of the script and everything it depends on (optional)")
 parser_status.add_argument("-v", "--verbose", action="store_true", \
                            help="Show the workflow config for all scripts")
+parser_status.add_argument("--snakemake", action="store_true", \
+                           help="Determine the status with a snakemake dry-run")
 parser_status.set_defaults(func=sk_status, which="status")
 
 # layout
@@ -287,11 +330,48 @@ parser_config.add_argument("--conda", nargs="?", type=str, \
                        const="CONDA_GET", help="Set conda environment file")
 parser_config.add_argument("--threads", nargs="?", type=int, \
                        const=999999,
-                       help="Set number of threads for script execution")
+                       help="Set number of threads for script execution (or for a single script)")
 parser_config.add_argument("--benchmark", nargs="?", type=str, \
                        const="BENCH_GET", help="Set benchmark output prefix")
+parser_config.add_argument("--jobs", nargs="?", type=int, \
+                       const=999999,
+                       help="Set default number of cores for sk run (scripts executing in parallel)")
+parser_config.add_argument("--mem_mb", nargs="?", type=int, \
+                       const=999999,
+                       help="Set memory (MB) available to sk run, or with a script, the memory the script needs")
+parser_config.add_argument("--r_workers", nargs="?", type=int, \
+                       const=999999,
+                       help="Set number of persistent R processes that execute R/Rmd scripts and render htmls, one page per request, during sk run (0 to start Rscript for each page). The R session is reset between scripts, except for the package namespaces they loaded")
+parser_config.add_argument("--kernels", nargs="?", type=int, \
+                       const=999999,
+                       help="Set number of warm Jupyter kernels (at most one per core) that execute ipynb scripts during sk run (0 to use jupyter nbconvert for each script)")
+parser_config.add_argument("--build_cache", nargs="?", type=str, \
+                       const="CACHE_GET",
+                       help="Set a directory (may be shared) where outputs of executed scripts are cached and reused when the script, its dependencies and config are unchanged")
+parser_config.add_argument("--build_cache_mb", nargs="?", type=int, \
+                       const=999999,
+                       help="Set the size limit (MB) of the build cache, least recently used outputs are removed (default 10000)")
+parser_config.add_argument("--navbar", nargs="?", type=str, \
+                       const="NAV_GET",
+                       help="Set to 'external' to load the navbar from a shared out_html/site_navbar.js so that adding, removing or reordering scripts does not render all pages again (default 'embedded')")
+parser_config.add_argument("--early_cutoff", nargs="?", type=int, \
+                       const=999999,
+                       help="Set to 1 to keep the md of a re-executed script if only its footer changed, and to skip scripts and htmls whose inputs are then unchanged (files passing results between scripts must be listed as dependencies)")
+parser_config.add_argument("script", nargs="?", type=str, \
+                       help="Get or set --threads and --mem_mb for this script only (e.g. sk config code/a.Rmd --mem_mb 4000)")
 parser_config.set_defaults(func=sk_config, which="config")
 
+# doctor
+def sk_doctor(args):
+    """Check the software scikick uses again (not using the cached results)"""
+    from scikick.requirements import doctor
+    doctor()
+
+parser_doctor = subparsers.add_parser("doctor", \
+                                      help="Check the software needed by scikick",
+                                      description="Check R, the required R packages, pandoc, git, singularity and conda and show their versions. The results of these checks are cached (used by sk init) and are refreshed by sk doctor.")
+parser_doctor.set_defaults(func=sk_doctor, which="doctor")
+
 # clean
 def sk_clean(args):
   print("Not yet implemented")
@@ -314,7 +394,10 @@ def main():
         parser.print_help()
         return
     if args.which in ["run", "config", "status"]:
+        from scikick.config import ScikickConfig
+        from scikick.yaml import yaml_check
+        # Single read-only load of scikick.yml shared by the subcommand
+        args.skconfig = ScikickConfig(readonly=True)
         # check for unsupported fields
-        ymli = yaml_in()
-        yaml_check(ymli)
+        yaml_check(args.skconfig.config)
     func(args)
@@ -3,10 +3,25 @@ import os
 import re
 import subprocess
 import sys
-from scikick.utils import warn, get_sk_snakefile, get_sk_exe_dir
+import threading
+import json
+import collections
+import contextlib
+from scikick.utils import reterr, warn, get_sk_snakefile, get_sk_exe_dir
 from scikick.yaml import yaml_in, get_indexes
 import scikick.yaml
+import scikick.config
 from scikick.config import ScikickConfig
+from scikick.workflow.loghandler import log_handler as page_error_handler
+from scikick.rworkers import r_worker_pool
+from scikick.kernels import kernel_pool
+from scikick.githistory import write_git_history
+
+# Rules that execute a page (their errors are reported with the page log)
+page_rules = ['sk_exe_rmd', 'sk_exe_r', 'sk_exe_ipynb']
+# Path of the list of pages allowed to execute (sk run --no-upstream),
+# read by presnakemake.py
+run_pages_env_var = "SK_RUN_PAGES"
 
 # Functions for parsing snakemake output during run_snakemake
 def detect_page_error(line):
@@ -26,11 +41,15 @@ def detect_snakemake_progress(line, quiet=False):
     if ntbd_match:
         warn("sk: Nothing to be done")
     elif job_match:
-        # sanitize system index.Rmd path
-        job_msg = job_match.groups()[0].replace(get_sk_exe_dir(),"system's ")
-        if job_msg[0] ==' ' and quiet:
-            return
-        warn("sk: " + job_msg)
+        report_job(job_match.groups()[0], quiet)
+
+def report_job(job_msg, quiet=False):
+    """Print the message of a snakemake job"""
+    # sanitize system index.Rmd path
+    job_msg = job_msg.replace(get_sk_exe_dir(),"system's ")
+    if job_msg[0] ==' ' and quiet:
+        return
+    warn("sk: " + job_msg)
 
 
 def detect_snakemake_error(line):
@@ -55,8 +74,210 @@ def detect_snakemake_error(line):
         ret=0
     return ret
 
+class SnakemakeMonitor:
+    """Log handler for snakemake's python API and loghandler.py events
+
+    Receives snakemake's log messages (dicts with a 'level') and reports
+    progress and errors. The text of the last max_log_lines messages and
+    job outputs is kept in logs (dumped if snakemake fails).
+    """
+    max_log_lines = 10000
+
+    def __init__(self, quiet=False, echo=True):
+        """
+        quiet -- bool (hide messages of jobs that are not page executions)
+        echo -- bool (print progress and errors, False to only record them)
+        """
+        self.quiet = quiet
+        self.echo = echo
+        self.page_err = 0
+        self.sm_err = 0
+        # "Job ..." and "Reason: ..." lines of each job with a message
+        self.jobs = []
+        self.reasons = []
+        self.logs = collections.deque(maxlen=self.max_log_lines)
+        # snakemake's log file (if reported)
+        self.logfile = None
+
+    def log(self, text):
+        self.logs.extend(f"{line}\n" for line in str(text).splitlines())
+
+    def __call__(self, msg):
+        level = msg["level"]
+        text = msg.get("msg")
+        if level == "job_info":
+            if text is None:
+                return
+            job_line = f"Job {msg['jobid']}: {text}"
+            reason_line = f"Reason: {msg['reason']}"
+            self.jobs.append(job_line)
+            self.reasons.append(reason_line)
+            self.log(job_line)
+            self.log(reason_line)
+            if self.echo:
+                report_job(text, self.quiet)
+        elif level == "job_error":
+            self.log(f"Error in rule {msg['name']}, jobid: {msg['jobid']}")
+            if msg["name"] in page_rules:
+                self.page_err = 1
+            if self.echo:
+                page_error_handler(msg)
+        elif level == "job_finished":
+            self.log(f"Finished job {msg['jobid']}.")
+        elif level == "progress":
+            self.log(f"{msg['done']} of {msg['total']} steps done")
+        elif level in ("info", "warning", "error", "run_info"):
+            self.log(text)
+            if not self.echo:
+                return
+            for line in str(text).splitlines():
+                detect_snakemake_progress(line, self.quiet)
+                if level == "error":
+                    self.sm_err += detect_snakemake_error(line)
+                    # In case of snakemake error start writing stderr
+                    if self.sm_err:
+                        sys.stderr.write(line + "\n")
+
+def snakemake_api():
+    """Return snakemake's python API function
+    or None if it is not available (snakemake>=8)
+    """
+    try:
+        from snakemake import snakemake as api
+    except ImportError:
+        return None
+    return api if callable(api) else None
+
+@contextlib.contextmanager
+def job_output_captured(monitor):
+    """Collect output of processes started by snakemake jobs in monitor.logs
+
+    File descriptors 1 and 2 are redirected to a pipe while sys.stdout
+    and sys.stderr keep writing to the terminal. 'sk:' messages from the
+    processes are still printed (if monitor.echo)
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = [os.dup(1), os.dup(2)]
+    saved_streams = (sys.stdout, sys.stderr)
+    read_fd, write_fd = os.pipe()
+    def forward():
+        with os.fdopen(read_fd, "rb") as pipe:
+            for line in pipe:
+                line = line.decode("utf-8", "replace")
+                monitor.logs.append(line)
+                if monitor.echo:
+                    detect_page_error(line)
+    reader = threading.Thread(target=forward, daemon=True)
+    reader.start()
+    try:
+        sys.stdout = os.fdopen(saved_fds[0], "w", buffering=1, closefd=False)
+        sys.stderr = os.fdopen(saved_fds[1], "w", buffering=1, closefd=False)
+        os.dup2(write_fd, 1)
+        os.dup2(write_fd, 2)
+        os.close(write_fd)
+        yield
+    finally:
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+        # wait for the remaining output of job processes
+        reader.join(5)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sys.stdout, sys.stderr = saved_streams
+        for fd in saved_fds:
+            os.close(fd)
+
+@contextlib.contextmanager
+def run_pages(skconf, scope):
+    """Let only the pages of scope execute if it excludes the pages they
+    depend on (their mds are used as they are)
+    scope -- status.RunScope or None
+    """
+    if scope is None or scope.upstream:
+        yield
+        return
+    path = os.path.join(skconf.report_dir, "sk_cache", "run_pages.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as run_pages_file:
+        json.dump(scope.exec_out_bases, run_pages_file)
+    os.environ[run_pages_env_var] = os.path.abspath(path)
+    try:
+        yield
+    finally:
+        os.environ.pop(run_pages_env_var, None)
+
+def snakemake_inprocess(skconf, monitor, snakefile=get_sk_snakefile(),
+    workdir=os.getcwd(), **kwargs):
+    """Run snakemake in this process through its python API
+    skconf -- ScikickConfig reused by the Snakefile
+    monitor -- SnakemakeMonitor receiving all snakemake log messages
+    kwargs -- passed to snakemake.snakemake()
+    Returns None if the API is not available, otherwise snakemake's
+    return code. Output of job processes is added to monitor.logs
+    """
+    api = snakemake_api()
+    if api is None:
+        return None
+    from snakemake.logging import logger
+    # monitor replaces snakemake's console output ('quiet' would also
+    # end dry-runs before jobs are listed)
+    logger.log_handler = []
+    scikick.config.workflow_config = skconf
+    # Snakefile imports presnakemake, which must pick up skconf
+    sys.modules.pop("scikick.workflow.presnakemake", None)
+    try:
+        with job_output_captured(monitor):
+            success = api(snakefile, workdir=workdir, \
+                log_handler=[monitor], **kwargs)
+    finally:
+        scikick.config.workflow_config = None
+        sys.modules.pop("scikick.workflow.presnakemake", None)
+    return 0 if success else 1
+
+def read_job_output(stdout, monitor):
+    """Keep the output of a snakemake process in monitor.logs
+    and forward 'sk:' messages of scripts (if monitor.echo)"""
+    for line in stdout:
+        line = line.decode("utf-8", "replace")
+        monitor.logs.append(line)
+        if line.startswith("SK INTERNAL: logfile "):
+            # Use the first found match
+            if monitor.logfile is None:
+                monitor.logfile = line[len("SK INTERNAL: logfile "):].strip()
+        elif monitor.echo:
+            detect_page_error(line)
+
+def snakemake_subprocess(snakemake_args, monitor):
+    """Run the snakemake command, events from loghandler.py
+    (JSON lines on the file descriptor SK_EVENT_FD) are passed to monitor
+    snakemake_args -- string (arguments to snakemake)
+    monitor -- SnakemakeMonitor
+    Returns snakemake's return code
+    """
+    read_fd, write_fd = os.pipe()
+    env = dict(os.environ, SK_EVENT_FD=str(write_fd))
+    snake_p = subprocess.Popen(f"snakemake {snakemake_args}", \
+        shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, \
+        pass_fds=[write_fd], env=env)
+    os.close(write_fd)
+    reader = threading.Thread(target=read_job_output, \
+        args=(snake_p.stdout, monitor), daemon=True)
+    reader.start()
+    with os.fdopen(read_fd) as events:
+        for line in events:
+            monitor(json.loads(line))
+    reader.join()
+    return snake_p.wait()
+
+def snakemake_logfile():
+    """Path to the log file of the last in-process snakemake run"""
+    from snakemake.logging import logger
+    return logger.logfile
+
 def run_snakemake(snakefile=get_sk_snakefile(), workdir=os.getcwd(), \
-    verbose=False, dryrun=False, snakeargs=None, rmds=[], quiet=False):
+    verbose=False, dryrun=False, snakeargs=None, rmds=[], quiet=False,
+    skconfig=None, jobs=None, only=(), downstream=(), no_upstream=False):
     """Run snakemake with specified arguments
     snakefile -- string (path to the main snakefile)
     workdir -- string
@@ -64,11 +285,20 @@ def run_snakemake(snakefile=get_sk_snakefile(), workdir=os.getcwd(), \
     dryrun -- bool
     snakeargs -- list (list of additional arguments to snakemake)
     rmds -- string rmd who's output should be targetted
+    skconfig -- ScikickConfig already loaded by the caller (optional)
+    jobs -- int number of cores for parallel execution (default from
+        snakefile_args: jobs)
+    only -- list of exes in scikick.yml to target (as rmds, not added)
+    downstream -- list of files, the exes depending on them are targeted
+    no_upstream -- bool, only the targeted exes execute, the mds of the
+        exes they depend on are used as they are
+    snakemake runs in this process unless verbose output or additional
+    snakemake arguments require the snakemake command
     """
     exe_dir = get_sk_exe_dir()
     loghandler = os.path.join(exe_dir, 'workflow/loghandler.py')
 
-    skconf = ScikickConfig()
+    skconf = skconfig if skconfig is not None else ScikickConfig(readonly=True)
     yml = skconf.config
 
     # logfile created by snakemake
@@ -81,14 +311,29 @@ def run_snakemake(snakefile=get_sk_snakefile(), workdir=os.getcwd(), \
     snakemake_args = ""
     snakemake_args += f" --snakefile {snakefile}"
     snakemake_args += f" --directory '{workdir}'"
-    snakemake_args += " --cores 1"
+    if jobs is None:
+        jobs = skconf.snakefile_arg("jobs")
+    snakemake_args += f" --cores {int(jobs)}"
+    # Memory available to all running pages (see per-page mem_mb)
+    mem_mb = skconf.snakefile_arg("mem_mb")
+    resources = dict()
+    if mem_mb is not None:
+        resources["mem_mb"] = int(mem_mb)
+        snakemake_args += f" --resources mem_mb={int(mem_mb)}"
     snakemake_args += f" --log-handler-script {loghandler}"
 
     # Translate Rmd script to HTML target 
     # TODO - factor out
     # TODO - move this to sk_run as an additional snake_arg
     # to reduce skconfig read ins
-    target_arg = ""
+    targets = list()
+    # pages of a targeted run, only their jobs are checked
+    scope = None
+    if len(rmds) > 0 or len(only) > 0 or len(downstream) > 0:
+        scope = list()
+    elif no_upstream:
+        reterr("sk: Error: --no-upstream needs scripts to run " + \
+            "(sk run script, --only or --downstream)")
     if len(rmds) > 0:
         for rmd in rmds:
 
@@ -104,7 +349,7 @@ def run_snakemake(snakefile=get_sk_snakefile(), workdir=os.getcwd(), \
                 if os.path.exists(rmd):
                     scikick.yaml.add([rmd])
                     # Must reload or modify the yml since it changed
-                    skconf = ScikickConfig()
+                    skconf = ScikickConfig(readonly=True)
                     yml = skconf.config
                 else:
                     warn(f"sk: Warning: Will not try to add non-existing file {rmd}")
@@ -113,11 +358,25 @@ def run_snakemake(snakefile=get_sk_snakefile(), workdir=os.getcwd(), \
             # Set target. Index file is treated differently
             index_rmds = get_indexes(yml)
             if (len(index_rmds) == 1) and (index_rmds[0] == rmd):
-                target_arg += " " + os.path.join(yml["reportdir"], \
-                    "out_html", "index.html")
+                targets.append(os.path.join(yml["reportdir"], \
+                    "out_html", "index.html"))
             else:
-                target_arg += " " + os.path.join(yml["reportdir"], \
-                    "out_html", os.path.splitext(rmd)[0] + ".html")
+                targets.append(os.path.join(yml["reportdir"], \
+                    "out_html", os.path.splitext(rmd)[0] + ".html"))
+            scope.append(os.path.normpath(rmd))
+    if scope is not None:
+        # (imported here, status.py imports this module)
+        from scikick.status import RunScope, select_pages
+        for exe in only:
+            if skconf.get_info(exe, "out_base") is None:
+                reterr(f"sk: Error: {exe} was not found in scikick.yml")
+        out_bases = select_pages(skconf, scope + \
+            [os.path.normpath(exe) for exe in only], downstream)
+        if len(out_bases) == 0:
+            warn(f"sk: No scripts depend on {', '.join(downstream)}")
+            return 0
+        scope = RunScope(skconf, out_bases, upstream=not no_upstream)
+        targets = [skconf.get_info(out_base, "html") for out_base in scope.out_bases]
 
     # set more snakemake arguments
     if dryrun:
@@ -125,62 +384,74 @@ def run_snakemake(snakefile=get_sk_snakefile(), workdir=os.getcwd(), \
     # Add user defined snakemake arguments
     if snakeargs is not None:
         snakemake_args += f" {snakeargs}"
-    if 'snakemake_args' in yml.keys() and yml['snakemake_args'] is not None:
+    deprecated_args = 'snakemake_args' in yml.keys() and \
+        yml['snakemake_args'] is not None
+    if deprecated_args:
         warn("sk: Warning: snakemake_args is deprecated")
         snakemake_args += f" {' '.join(yml['snakemake_args'])}"
     # add the implied targets (html of Rmd)
-    snakemake_args += f" {target_arg}"
+    snakemake_args += f" {' '.join(targets)}"
     # Check for a user defined snakefile (imported by scikick Snakefile)
     user_snakefile = os.path.join(os.getcwd(), "Snakefile")
     if os.path.isfile(user_snakefile):
         warn("sk: Including Snakefile found in project directory")
     ### Execution
-    if verbose:
-        warn("sk: Starting snakemake")
-        cmd = f"{env_vars} snakemake {snakemake_args}"
-        print(cmd)
-        sys.exit(subprocess.call(cmd, shell=True))
+    # (imported here, fingerprints.py uses status.py which imports this module)
+    from scikick.fingerprints import restore_unchanged, record_fingerprints
+    from scikick.workflow.site_rules.render_site_yamlgen import write_site_files
+    from scikick.cutoff import snapshot
+    if not dryrun:
+        # compiled project model read by the jobs (and later sk commands)
+        if not skconf.model_loaded:
+            skconf.save_model()
+        # git history shown in the footers (read by the site files too)
+        write_git_history(skconf)
+        # navbar/project map changes (the rule only creates missing files)
+        write_site_files(skconf)
+        # outputs of inputs with unchanged content are up to date
+        restore_unchanged(skconf, scope)
+        # previous mds of the pages (early cutoff)
+        snapshot(skconf, scope.exec_out_bases if scope is not None else None)
+    monitor = SnakemakeMonitor(quiet)
+    with r_worker_pool(skconf, dryrun), kernel_pool(skconf, dryrun), \
+        run_pages(skconf, scope):
+        if verbose:
+            warn("sk: Starting snakemake")
+            cmd = f"{env_vars} snakemake {snakemake_args}"
+            print(cmd)
+            sys.exit(subprocess.call(cmd, shell=True))
+        returncode = None
+        # Arbitrary snakemake arguments need the snakemake command line
+        if snakeargs is None and not deprecated_args:
+            returncode = snakemake_inprocess(skconf, monitor, snakefile,
+                workdir, cores=int(jobs), resources=resources, dryrun=dryrun,
+                targets=targets)
+            if returncode is not None and not dryrun and \
+                snakemake_logfile() is not None:
+                snake_logfile = snakemake_logfile()
+                with open(snake_logfile, "a") as logfile:
+                    logfile.writelines(monitor.logs)
+        if returncode is None:
+            returncode = snakemake_subprocess(snakemake_args, monitor)
+            snake_logfile = monitor.logfile or ""
+    logs = monitor.logs
+    page_err = monitor.page_err
+    sm_err = monitor.sm_err
+    if returncode != 0:
+        if not page_err:
+            warn("sk: Error: Snakemake returned a non-zero return code")
+            if not sm_err:
+                warn("sk: Warning: scikick was unable to find snakemake error in logs, dumping stderr...")
+                for line in logs:
+                    sys.stderr.write(line)
+                return returncode
     else:
-        snake_p = subprocess.Popen(f"snakemake {snakemake_args}", \
-            shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        logs=[]
-        sm_err = 0
-        page_err = 0
-        while True:
-            line = snake_p.stdout.readline().decode('utf-8')
-            if not line:
-                break
-            # Capture logs
-            logs.append(line)
-
-            # Report progress
-            detect_snakemake_progress(line,quiet)
-            page_err = detect_page_error(line) or page_err
-
-            # In case of snakemake error start writing stderr
-            sm_err += detect_snakemake_error(line)
-            if sm_err:
-                sys.stderr.write(line) 
-
-            logfile_name_match = re.match("^SK INTERNAL: logfile (.*)$", line)
-            if logfile_name_match is not None:
-                # Use the first found match
-                if snake_logfile == "":
-                    snake_logfile = logfile_name_match.groups()[0]
-        snake_p.wait()
-        if snake_p.returncode != 0:
-            if not page_err:
-                warn("sk: Error: Snakemake returned a non-zero return code")
-                if not sm_err:
-                    warn("sk: Warning: scikick was unable to find snakemake error in logs, dumping stderr...")
-                    for line in logs:
-                        sys.stderr.write(line)
-                    return snake_p.returncode
-        else:
-            if not os.path.exists(skconf.homepage):
-                warn(f"sk: Warning: Expected homepage {skconf.homepage} is missing")
-        if snake_logfile != "":
-            rellog=os.path.relpath(snake_logfile,start=os.getcwd())
-            if snake_p.returncode!=0:
-                warn(f"sk: Complete log: {rellog}")
-        return snake_p.returncode
+        if not dryrun:
+            record_fingerprints(skconf, scope)
+        if not os.path.exists(skconf.homepage):
+            warn(f"sk: Warning: Expected homepage {skconf.homepage} is missing")
+    if snake_logfile != "":
+        rellog=os.path.relpath(snake_logfile,start=os.getcwd())
+        if returncode!=0:
+            warn(f"sk: Complete log: {rellog}")
+    return returncode
@@ -2,13 +2,20 @@
 import os
 import re
 import subprocess
+import collections
 from scikick.yaml import yaml_in, get_indexes
 from scikick.utils import reterr, warn, get_sk_exe_dir, get_sk_snakefile
 from scikick.config import ScikickConfig
+from scikick.snakemake import SnakemakeMonitor, snakemake_inprocess
 
 ### How 'sk status' works:
-# Snakemake output is parsed to assign flags to each scikick.yml file which
-# indicate what will run and why it needs to run
+# The jobs that snakemake would run for scikick's rules, and why, are
+# determined from scikick.yml and file modification times
+# (native_status_jobs()). These are used to assign flags to each
+# scikick.yml file which indicate what will run and why it needs to run
+#
+# With 'sk status --snakemake' (or when the project has its own
+# Snakefile) snakemake output is parsed instead:
 #
 # Details:
 # `snakemake --dryrun --reason` output is parsed
@@ -36,9 +43,18 @@ reason_pattern = "^Reason:.*$"
 
 # get job/reason for internal debugging
 def run_sk_dryrun(snakefile=get_sk_snakefile(),
-    workdir=os.getcwd()):
+    workdir=os.getcwd(), skconf=None):
     # get snakemake --dryrun output with --reason
-    # TODO - use python API
+    if skconf is not None:
+        monitor = SnakemakeMonitor(echo=False)
+        returncode = snakemake_inprocess(skconf, monitor, snakefile, workdir,
+            dryrun=True, printreason=True)
+        if returncode is not None:
+            if returncode != 0:
+                warn("sk: There was an error in snakemake --dry-run, see below")
+                reterr("".join(monitor.logs))
+            return monitor.jobs, monitor.reasons
+    # snakemake>=8 has no python API for this
     status = subprocess.run(
         ["snakemake", "--snakefile", snakefile, \
             "--directory", workdir, \
@@ -61,17 +77,12 @@ def run_sk_dryrun(snakefile=get_sk_snakefile(),
     reasons = list(map(lambda i: stdout[i*2+1], range(0, int(len(stdout)/2))))
     return jobs, reasons
 
-# Main - called from sk_status()
-def snake_status(snakefile=get_sk_snakefile(),
-    workdir=os.getcwd(), verbose=False, rmd=None):
-    """Print workflow status
-    snakefile -- string (path to the main snakefile)
-    workdir -- string
-    verbose -- bool
-    rmd -- string (show status for just this file)
+def snakemake_status_jobs(skconf, snakefile=get_sk_snakefile(),
+    workdir=os.getcwd()):
+    """Parse the jobs of a snakemake dry-run
+    Returns what native_status_jobs() returns
     """
-    skconf = ScikickConfig() # OR status with no pages just indicates whether index.html exists
-    jobs, reasons = run_sk_dryrun(snakefile, workdir)
+    jobs, reasons = run_sk_dryrun(snakefile, workdir, skconf)
     # split jobs/reasons into types
     def subset_jobs(jobs,reasons,jtype):
         # Trying to use only exe_job info
@@ -84,7 +95,6 @@ def snake_status(snakefile=get_sk_snakefile(),
         return ret_jobs, ret_reasons
     exe_jobs, exe_reasons = subset_jobs(jobs,reasons,"exe_to_md")
     md_jobs, md_reasons = subset_jobs(jobs,reasons,"md_to_html")
-    unknown_jobs, unknown_reasons = subset_jobs(jobs,reasons,"unknown")
 
     exes = skconf.exes
     if skconf.index_exe not in exes:
@@ -102,6 +112,37 @@ def snake_status(snakefile=get_sk_snakefile(),
     # get which scripts will be executed (processed as exe => md)
     exec_scripts = [re.match(exe_pattern,exe_job).groups()[0] for exe_job in
             exe_jobs]
+    # get which out_bases will have an html generated
+    html_out_bases = []
+    for job in md_jobs:
+        match = re.match(htmlgen_pattern,job)
+        if match is not None:
+            html_out_bases.append(match.groups()[0])
+    return exec_scripts, updated_inputs, expected_input_updates, \
+        missing_outs, html_out_bases
+
+# Main - called from sk_status()
+def snake_status(snakefile=get_sk_snakefile(),
+    workdir=os.getcwd(), verbose=False, rmd=None, skconf=None,
+    snakemake=False):
+    """Print workflow status
+    snakefile -- string (path to the main snakefile)
+    workdir -- string
+    verbose -- bool
+    rmd -- string (show status for just this file)
+    skconf -- ScikickConfig already loaded by the caller (optional)
+    snakemake -- bool (use a snakemake dry-run instead of native_status_jobs())
+    """
+    if skconf is None:
+        skconf = ScikickConfig(readonly=True) # OR status with no pages just indicates whether index.html exists
+    # rules of a project Snakefile are only known to snakemake
+    user_snakefile = os.path.join(workdir, "Snakefile")
+    if snakemake or os.path.isfile(user_snakefile):
+        exec_scripts, updated_inputs, expected_input_updates, missing_outs, \
+            html_out_bases = snakemake_status_jobs(skconf, snakefile, workdir)
+    else:
+        exec_scripts, updated_inputs, expected_input_updates, missing_outs, \
+            html_out_bases = native_status_jobs(skconf)
 
     # get status markers (codes ---) for each script
     markers = file_markers(skconf,
@@ -110,14 +151,11 @@ def snake_status(snakefile=get_sk_snakefile(),
                   exec_scripts)
 
     # Add site status
-    for job in md_jobs:
-        match = re.match(htmlgen_pattern,job)
+    for out_base in html_out_bases:
         # if the script has an html step fill in the gaps with ---
-        if match is not None:
-            out_base = match.groups()[0]
-            md_job_exe = skconf.get_info(out_base,"exe")
-            markers[md_job_exe] = ["-" if x == " " else x for x in
-                    markers[md_job_exe]]
+        md_job_exe = skconf.get_info(out_base,"exe")
+        markers[md_job_exe] = ["-" if x == " " else x for x in
+                markers[md_job_exe]]
 
     # Checking for valid codes
     # Probably better to be more careful than do this
@@ -142,13 +180,273 @@ def snake_status(snakefile=get_sk_snakefile(),
             markers['system index (homepage)'] = markers[skconf.index_exe]
         print_status(config, markers, verbose)
 
+### Native status engine
+# Models the jobs of scikick's Snakefile rules and decides which of them
+# need to run the way snakemake does for a dry-run (modification times):
+#   sk_exe_* (X): exe and its inputs => md
+#   md_postprocess (P): md, project map file => temporary _tmp.md
+#   generate_html (G): _site.yml files, _tmp.md => html
+#   generate_site_files (S): => _site.yml files, project map file
+#   sk_done (D): all htmls (the target)
+
+# exe extension => rule producing the md
+exe_rules = {".rmd": "sk_exe_rmd", ".r": "sk_exe_r",
+    ".ipynb": "sk_exe_ipynb", ".md": "sk_exe_md"}
+# exe rules recording a benchmark file
+benchmark_rules = ["sk_exe_rmd", "sk_exe_r", "sk_exe_ipynb"]
+
+class StatusJob:
+    """A job of the scikick workflow as seen by native_status_jobs()"""
+    def __init__(self, rule, inputs, outputs, out_base=None, benchmark=None,
+        temp=False):
+        self.rule = rule
+        self.inputs = inputs
+        self.outputs = outputs
+        self.out_base = out_base
+        self.benchmark = benchmark
+        # outputs are removed once used
+        self.temp = temp
+        # producer job => files, consumer job => files (in DAG order)
+        self.dependencies = dict()
+        self.depending = dict()
+        self.buildable = None
+        # reasons to run
+        self.missing_output = set()
+        self.updated_input = set()
+        self.updated_input_run = set()
+
+    def has_reason(self):
+        return len(self.missing_output) + len(self.updated_input) + \
+            len(self.updated_input_run) > 0
+
+class MtimeCache:
+    """mtime of files (None if missing), each file is stat'ed once"""
+    def __init__(self):
+        self.mtimes = dict()
+
+    def __call__(self, path):
+        if path not in self.mtimes:
+            try:
+                self.mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                self.mtimes[path] = None
+        return self.mtimes[path]
+
+class RunScope:
+    """Pages of a targeted sk run (sk run script, --only, --downstream)
+    out_bases -- pages whose htmls are the targets
+    exec_out_bases -- pages that may execute: the targets and the pages
+        they depend on, or only the targets with upstream=False (the
+        outputs of the other pages are used as they are)
+    """
+    def __init__(self, skconf, out_bases, upstream=True):
+        graph = skconf.project_graph
+        exes = [skconf.get_info(out_base, "exe") for out_base in out_bases]
+        needed = graph.upstream_of(exes) if upstream else set(exes)
+        # in topological order
+        ordered = [exe for exe in graph.order if exe in needed] + \
+            [exe for exe in exes if exe not in graph.exes]
+        targets = set(exes)
+        self.out_bases = [skconf.get_info(exe, "out_base") for exe in ordered \
+            if exe in targets]
+        self.exec_out_bases = [skconf.get_info(exe, "out_base") for exe in ordered]
+        self.upstream = upstream
+
+def select_pages(skconf, exes=(), downstream=()):
+    """out_bases of exes and of the exes depending (recursively) on the
+    files in downstream
+    """
+    graph = skconf.project_graph
+    downstream = [os.path.normpath(path) for path in downstream]
+    for path in downstream:
+        if path not in graph.upstream:
+            reterr(f"sk: Error: {path} is not used by any script in scikick.yml")
+    selected = set(exes) | (graph.downstream_of(downstream) & graph.exes)
+    return [skconf.get_info(exe, "out_base") for exe in \
+        [exe for exe in graph.order if exe in selected] + \
+        [exe for exe in exes if exe not in graph.exes]]
+
+def workflow_jobs(skconf, mtime, scope=None):
+    """Build the jobs of the workflow that sk_done needs
+    mtime -- MtimeCache
+    scope -- RunScope, only the jobs of its pages are built (default all)
+    Jobs with missing inputs that can not be produced are left out (their
+    outputs are used if they exist)
+    Returns the jobs in topological order (sk_done last)
+    """
+    from scikick.workflow.site_rules.render_site_yamlgen import postprocess_inputs
+    producers = dict()
+    site_files = StatusJob("generate_site_files", [], \
+        skconf.get_site_yaml_files() + [skconf.project_map_file] + \
+        ([skconf.navbar_file] if skconf.external_navbar else []))
+    for site_file in site_files.outputs:
+        producers[site_file] = site_files
+    benchmark_prefix = skconf.snakefile_arg("benchmark")
+    inferred_inputs = skconf.inferred_inputs
+    map_inputs = postprocess_inputs(skconf)
+    htmls = list()
+    rows = skconf.exe_core_outputs
+    if scope is not None:
+        rows = [skconf.get_info(out_base) for out_base in scope.exec_out_bases]
+    for exe, md, html, _, out_base, ext, _, _ in rows:
+        # as named by md_postprocess (not under report_dir)
+        post_md = f"report/out_md/{out_base}_tmp.md"
+        rule = exe_rules.get(ext.lower())
+        if rule is not None:
+            if benchmark_prefix != "":
+                benchmark = benchmark_prefix + out_base
+            else:
+                benchmark = os.path.join(skconf.report_dir, "benchmark", out_base)
+            producers[md] = StatusJob(rule, inferred_inputs[out_base], [md], \
+                out_base, benchmark if rule in benchmark_rules else None)
+        producers[post_md] = StatusJob("md_postprocess", \
+            [md] + map_inputs, [post_md], out_base, temp=True)
+        producers[html] = StatusJob("generate_html", \
+            [skconf.site_yaml_file(out_base), post_md], [html], out_base)
+        if scope is None or out_base in scope.out_bases:
+            htmls.append(html)
+    done = StatusJob("sk_done", htmls, [])
+
+    order = list()
+    def build(job):
+        if job.buildable is not None:
+            return job.buildable
+        job.buildable = True
+        dependencies = dict()
+        for path in job.inputs:
+            producer = producers.get(path)
+            if producer is not None and build(producer):
+                dependencies.setdefault(producer, list()).append(path)
+            elif mtime(path) is None:
+                job.buildable = False
+                job.missing_inputs = [path]
+                return False
+        job.dependencies = dependencies
+        for producer, paths in dependencies.items():
+            producer.depending[job] = paths
+        order.append(job)
+        return True
+    if not build(done):
+        missing = set()
+        for job in producers.values():
+            if job.buildable is False:
+                missing.update(job.missing_inputs)
+        warn("sk: Error: Missing input files:")
+        reterr("\n".join(f"sk: Error:   {path}" for path in sorted(missing)))
+    return order
+
+def needrun_jobs(order, mtime, rewritten=()):
+    """Decide which jobs need to run, filling their reasons
+    order -- jobs from workflow_jobs()
+    mtime -- MtimeCache
+    rewritten -- files that will be written before snakemake runs
+    Returns the set of jobs to run
+    """
+    done = order[-1]
+    # Oldest output of each job (or of the jobs using its outputs)
+    output_mintime = dict()
+    for job in reversed(order):
+        own = [mtime(path) for path in job.outputs if mtime(path) is not None]
+        if job.benchmark is not None and mtime(job.benchmark) is not None:
+            own.append(mtime(job.benchmark))
+        output_mintime[job] = min(own) if len(own) > 0 else None
+        if output_mintime[job] is None:
+            for job_ in job.depending:
+                if output_mintime[job_] is not None:
+                    output_mintime[job] = output_mintime[job_]
+                    break
+
+    # Jobs with a reason of their own, everything downstream follows them
+    queue = collections.deque()
+    masked = set()
+    for job in order:
+        if job in masked:
+            continue
+        if job is done:
+            job.updated_input_run.update(path for path in job.inputs \
+                if mtime(path) is None)
+        elif output_mintime[job] is not None:
+            job.updated_input.update(path for path in job.inputs \
+                if mtime(path) is not None and (path in rewritten or \
+                    mtime(path) > output_mintime[job]))
+        if job.has_reason():
+            queue.append(job)
+            downstream = [job]
+            while len(downstream) > 0:
+                job_ = downstream.pop()
+                if job_ not in masked:
+                    masked.add(job_)
+                    downstream.extend(job_.depending)
+
+    # Jobs that produce missing inputs of, or use outputs of, needed jobs
+    needrun = set()
+    visited = set(queue)
+    while len(queue) > 0:
+        job = queue.popleft()
+        needrun.add(job)
+        for job_, paths in job.dependencies.items():
+            missing = [path for path in paths \
+                if mtime(path) is None and path not in rewritten]
+            job_.missing_output.update(missing)
+            if len(missing) > 0 and job_ not in visited:
+                visited.add(job_)
+                queue.append(job_)
+        for job_, paths in job.depending.items():
+            if job_ not in visited:
+                visited.add(job_)
+                queue.append(job_)
+            job_.updated_input_run.update(paths)
+    return needrun
+
+def native_status_jobs(skconf):
+    """Determine which jobs of the workflow need to run without snakemake
+    Inputs are only considered updated if their content differs from the
+    fingerprints recorded by the last sk run (see fingerprints.py)
+    Returns
+        exec_scripts -- list of exes that will execute
+        updated_inputs -- dict of updated inputs for each exe
+        expected_input_updates -- dict of inputs to be updated for each exe
+        missing_outs -- list of missing mds that will be generated
+        html_out_bases -- list of out_bases that will have an html generated
+    """
+    from scikick.fingerprints import FingerprintStore, apply_fingerprints
+    from scikick.workflow.site_rules.render_site_yamlgen import outdated_site_files
+    mtime = MtimeCache()
+    order = workflow_jobs(skconf, mtime)
+    fingerprints = FingerprintStore(skconf.report_dir)
+    # as sk run will find them
+    # (the updated stat cache is only saved by sk run)
+    apply_fingerprints(order, mtime, fingerprints)
+    # sk run rewrites site files with outdated content before snakemake
+    needrun = needrun_jobs(order, mtime, outdated_site_files(skconf))
+
+    exes = skconf.exes
+    if skconf.index_exe not in exes:
+        exes.append(skconf.index_exe)
+    updated_inputs = {exe: list() for exe in exes}
+    expected_input_updates = {exe: list() for exe in exes}
+    exec_scripts = list()
+    missing_outs = list()
+    for job in order:
+        if job not in needrun or job.rule not in exe_rules.values():
+            continue
+        exe = skconf.get_info(job.out_base, "exe")
+        exec_scripts.append(exe)
+        # as listed by snakemake's reason
+        updated_inputs[exe] = sorted(job.updated_input - job.updated_input_run)
+        expected_input_updates[exe] = sorted(job.updated_input_run)
+        missing_outs += sorted(job.missing_output)
+    html_out_bases = [job.out_base for job in order \
+        if job in needrun and job.rule == "generate_html"]
+    return exec_scripts, updated_inputs, expected_input_updates, \
+        missing_outs, html_out_bases
+
 def flatten_dependency_tree(exe, skconf):
-    """Returns a list of exe and its recursive deps (includes exes only)"""
-    file_list = [exe]
-    if exe in skconf.exes and skconf.analysis[exe] is not None:
-        for dep in skconf.analysis[exe]:
-            file_list += flatten_dependency_tree(dep, skconf)
-    return file_list
+    """Returns a list of exe and its recursive deps (each once)"""
+    graph = skconf.project_graph
+    deps = graph.upstream_of([exe])
+    deps.discard(exe)
+    return [exe] + sorted(deps, key=graph.position.get)
 
 def file_markers(skconf, inupds, exinupds, missing_outs, exec_scripts):
     """Get markers for each file in scikick.yml
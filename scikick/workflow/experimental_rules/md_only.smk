@@ -4,6 +4,7 @@ rule sk_noexe_ipynb:
     input:
         deps = lambda wildcards: ipynb_inputs[wildcards.out_base],
         exe = lambda wildcards: skconfig.get_info(wildcards.out_base,"exe")
+    wildcard_constraints: out_base = exe_out_base_pattern
     output:
         md = skconfig.md_pattern
     message: "Executing code in {input.exe}, outputting to {output.md}"
@@ -1,8 +1,36 @@
 import sys
 import os
+import json
+
+# sk run reads JSON events (one per line) from this file descriptor
+event_fd = os.environ.get("SK_EVENT_FD")
+events = None
+if event_fd is not None:
+    try:
+        events = os.fdopen(int(event_fd), "w", buffering=1, closefd=False)
+    except (OSError, ValueError):
+        # not inherited (e.g. by processes started by jobs)
+        events = None
+
+# message fields sent as events
+event_keys = ['level', 'msg', 'jobid', 'name', 'reason', 'output', 'log',
+    'done', 'total']
+
+def event(msg):
+    """Reduce a snakemake log message to a JSON serializable event"""
+    ev = {k: msg[k] for k in event_keys if k in msg}
+    wildcards = msg.get('wildcards')
+    if wildcards:
+        ev['out_base'] = dict(wildcards).get('out_base')
+    return ev
 
 def log_handler(msg):
     # print(msg) # for development
+    if events is not None:
+        if msg['level'] in ['job_info', 'job_error', 'job_finished', \
+            'progress', 'info', 'warning', 'error', 'run_info']:
+            events.write(json.dumps(event(msg), default=str) + '\n')
+        return
     if msg['level'] == "job_error" and msg['name'] in \
     ['sk_exe_rmd','sk_exe_r','sk_exe_ipynb']:
         logfile=msg['log'][0]
@@ -15,4 +43,3 @@ def log_handler(msg):
                 sys.stderr.write('sk:    ' + line)
             f.close()
             sys.stderr.write("sk: Error while generating " + msg['output'][0] + '\n')
-
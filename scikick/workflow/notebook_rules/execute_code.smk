@@ -4,54 +4,96 @@
 # Notes:
 # log files take stdout and stderr. 2>&1 redirects stderr to stdout
 
+# R/Rmd pages are submitted to the R workers of sk run if they are running
+# (see scikick/rworkers.py), otherwise each page starts Rscript
+if os.environ.get("SK_R_POOL"):
+    exe_r_shell = "'%s' -m scikick.rworkers knit '{input.exe}' '{output.md}' '{log}' >> '{log}' 2>&1" \
+        % sys.executable
+else:
+    exe_r_shell = "Rscript %s '{input.exe}' '{output.md}' > '{log}' 2>&1" \
+        % os.path.join(workflow_dir,"notebook_rules", "execute_code.R")
+
+# ipynb pages are submitted to the Jupyter kernels of sk run if they are
+# running (see scikick/kernels.py)
+if os.environ.get("SK_KERNEL_POOL"):
+    exe_ipynb_shell = "'%s' -m scikick.kernels '{input.exe}' '{params.outdir}' '{log}' >> '{log}' 2>&1" \
+        % sys.executable
+else:
+    exe_ipynb_shell = "jupyter nbconvert --to markdown --ExecutePreprocessor.timeout -1 --execute --output-dir='{params.outdir}' '{input.exe}' > '{log}' 2>&1"
+
+# Outputs are restored from the build cache if the page is unchanged,
+# otherwise stored after execution (see scikick/buildcache.py)
+def cached_shell(shell):
+    if skconfig.snakefile_arg("build_cache") == "":
+        return shell
+    buildcache = "'%s' -m scikick.buildcache" % sys.executable
+    return "%s restore '{wildcards.out_base}' '{log}' || ( %s && %s store '{wildcards.out_base}' )" \
+        % (buildcache, shell, buildcache)
+
+# With early cutoff, pages with unchanged inputs keep their md and the
+# previous md is put back if the outputs did not change (see scikick/cutoff.py)
+def cutoff_shell(shell):
+    if not int(skconfig.snakefile_arg("early_cutoff")):
+        return shell
+    cutoff = "'%s' -m scikick.cutoff" % sys.executable
+    return "%s skip_exe '{wildcards.out_base}' || ( %s before_exe '{wildcards.out_base}' && ( %s ) && %s after_exe '{wildcards.out_base}' )" \
+        % (cutoff, cutoff, shell, cutoff)
+
 rule sk_exe_rmd:
     input:
         deps = lambda wildcards: rmd_inputs[wildcards.out_base],
         exe = lambda wildcards: skconfig.get_info(wildcards.out_base,"exe")
+    wildcard_constraints: out_base = exe_out_base_pattern
     output:
         md = skconfig.md_pattern    
     message: "Executing code in {input.exe}, outputting to {output.md}"
     log: '%s/logs/{out_base}_logs.txt' % skconfig.report_dir
     conda: skconfig.snakefile_arg("conda")
     singularity: skconfig.snakefile_arg("singularity")
-    threads: skconfig.snakefile_arg("threads")
+    threads: lambda wildcards: skconfig.page_resource(wildcards.out_base, "threads")
+    resources:
+        mem_mb = lambda wildcards: skconfig.page_resource(wildcards.out_base, "mem_mb")
     benchmark: skconfig.snakefile_arg("benchmark") + "{out_base}" if skconfig.snakefile_arg("benchmark") != "" else os.path.join(skconfig.report_dir,'benchmark','{out_base}')
     # 'script:' section causes directories to not get found when using singularity, so 'shell:' is used
-    shell: "Rscript %s '{input.exe}' '{output.md}' > '{log}' 2>&1" \
-        % os.path.join(workflow_dir,"notebook_rules", "execute_code.R")
+    shell: cutoff_shell(cached_shell(exe_r_shell))
 
 rule sk_exe_r:
     input:
         deps = lambda wildcards: r_inputs[wildcards.out_base],
         exe = lambda wildcards: skconfig.get_info(wildcards.out_base,"exe")
+    wildcard_constraints: out_base = exe_out_base_pattern
     output:
         md = skconfig.md_pattern
     message: "Executing code in {input.exe}, outputting to {output.md}"
     log: '%s/logs/{out_base}_logs.txt' % skconfig.report_dir
     conda: skconfig.snakefile_arg("conda")
     singularity: skconfig.snakefile_arg("singularity")
-    threads: skconfig.snakefile_arg("threads")
+    threads: lambda wildcards: skconfig.page_resource(wildcards.out_base, "threads")
+    resources:
+        mem_mb = lambda wildcards: skconfig.page_resource(wildcards.out_base, "mem_mb")
     benchmark: skconfig.snakefile_arg("benchmark") + "{out_base}" if skconfig.snakefile_arg("benchmark") != "" else os.path.join(skconfig.report_dir,'benchmark','{out_base}')
     # 'script:' section causes directories to not get found when using singularity, so 'shell:' is used
-    shell: "Rscript %s '{input.exe}' '{output.md}' > '{log}' 2>&1" \
-        % os.path.join(workflow_dir,"notebook_rules", "execute_code.R")
+    shell: cutoff_shell(cached_shell(exe_r_shell))
 
 rule sk_exe_ipynb:
     input:
         deps = lambda wildcards: ipynb_inputs[wildcards.out_base],
         exe = lambda wildcards: skconfig.get_info(wildcards.out_base,"exe")
+    wildcard_constraints: out_base = exe_out_base_pattern
     output:
         md = skconfig.md_pattern 
     message: "Executing code in {input.exe}, outputting to {output.md}"
     conda: skconfig.snakefile_arg("conda")
     singularity: skconfig.snakefile_arg("singularity")
-    threads: skconfig.snakefile_arg("threads")
+    threads: lambda wildcards: skconfig.page_resource(wildcards.out_base, "threads")
+    resources:
+        mem_mb = lambda wildcards: skconfig.page_resource(wildcards.out_base, "mem_mb")
     benchmark: skconfig.snakefile_arg("benchmark") + "{out_base}" if skconfig.snakefile_arg("benchmark") != "" else os.path.join(skconfig.report_dir,'benchmark','{out_base}')
     params:
         outdir=lambda wildcards, output: os.path.dirname(output[0])
     log: '%s/logs/{out_base}_logs.txt' % skconfig.report_dir
     # 'script:' section causes directories to not get found when using singularity, so 'shell:' is used
-    shell: "jupyter nbconvert --to markdown --ExecutePreprocessor.timeout -1 --execute --output-dir='{params.outdir}' '{input.exe}' > '{log}' 2>&1" 
+    shell: cutoff_shell(cached_shell(exe_ipynb_shell))
 
 # WIP for py script execution as ipynb
 # Currently is not compatible with projects also containing ipynb
@@ -73,6 +115,7 @@ rule sk_exe_md:
     input: 
         deps = lambda wildcards: md_inputs[wildcards.out_base],
         exe = lambda wildcards: skconfig.get_info(wildcards.out_base,"exe")
+    wildcard_constraints: out_base = exe_out_base_pattern
     output:
         md = skconfig.md_pattern
     message: "Executing code in {input.exe}, outputting to {output}"
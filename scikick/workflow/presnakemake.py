@@ -2,9 +2,12 @@
 # Imports
 ###########################################
 
+import scikick.config
 from scikick.config import ScikickConfig
 from scikick.utils import warn, get_sk_exe_dir, get_sk_snakefile
 import tempfile
+import json
+import re
 # For debugging outside snakemake context
 import os
 import sys
@@ -15,7 +18,12 @@ import glob
 ###########################################
 
 # import the scikick.yml config file
-skconfig = ScikickConfig(need_pages=False) # no pages means empty site
+# (or reuse the one already loaded by sk run/status in this process)
+sk_inprocess = scikick.config.workflow_config is not None
+if sk_inprocess:
+    skconfig = scikick.config.workflow_config
+else:
+    skconfig = ScikickConfig(need_pages=False, readonly=True) # no pages means empty site
 
 # Getting properties
 report_dir = skconfig.report_dir # directories
@@ -37,6 +45,14 @@ snake_includes = glob.glob(os.path.join(workflow_dir,"experimental_rules") + "/*
 
 # Depending on upstream exes' resulting 'md'
 exe_inputs = skconfig.inferred_inputs
+# Pages the exe rules apply to (wildcard constraint of out_base)
+# sk run --no-upstream: only the listed pages, the mds of the other pages
+# are used as they are
+exe_out_base_pattern = ".+"
+if os.environ.get("SK_RUN_PAGES"):
+    with open(os.environ["SK_RUN_PAGES"]) as run_pages_file:
+        exe_out_base_pattern = "|".join(re.escape(out_base) \
+            for out_base in json.load(run_pages_file))
 
 # Create dictionaries for each file extension
 def get_inputs(exe_inputs,ext):
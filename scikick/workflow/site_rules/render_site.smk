@@ -1,5 +1,7 @@
 from shutil import copyfile
 import scikick
+from scikick.workflow.site_rules.render_site_yamlgen import postprocess_inputs, \
+    navbar_loader_html
 
 # Currently depends on variables from main Snakefile
 
@@ -7,19 +9,34 @@ yaml_gen_script = os.path.join(workflow_dir, 'site_rules','render_site_yamlgen.p
 
 localrules: generate_html, generate_site_files, md_postprocess
 
+# Pages are rendered by the R workers of sk run if they are running
+# (see scikick/rworkers.py), otherwise each page starts Rscript
+if os.environ.get("SK_R_POOL"):
+    generate_html_shell = "'%s' -m scikick.rworkers render '{input.md}' '{output}' '{params.index_html}'" \
+        % sys.executable
+else:
+    generate_html_shell = "Rscript {generate_html_exe} '{input.md}' '{output}' '{params.index_html}'"
+
+# With early cutoff, htmls of pages kept by their sk_exe_* job are not
+# rendered again if the other inputs are unchanged (see scikick/cutoff.py)
+if int(skconfig.snakefile_arg("early_cutoff")):
+    generate_html_shell = "'%s' -m scikick.cutoff skip_html '{wildcards.out_base}' || %s" \
+        % (sys.executable, generate_html_shell)
+
 # Generate all _site.yml files
+# (sk run rewrites them before snakemake runs if their content changed,
+# see write_site_files(), so that scikick.yml edits not affecting the
+# navbar or project map do not render all pages again)
 rule generate_site_files:
-    input: 
-        "scikick.yml",
-        yaml_gen_script
-    output: skconfig.get_site_yaml_files()
+    output: skconfig.get_site_yaml_files(), skconfig.project_map_file,
+        [skconfig.navbar_file] if skconfig.external_navbar else []
     message: " Creating site layout from scikick.yml"
     script: yaml_gen_script
 
 rule md_postprocess:
    input: 
        md = skconfig.md_pattern,
-       yml = 'scikick.yml'
+       project_map = postprocess_inputs(skconfig)
    output: temp("report/out_md/{out_base}_tmp.md")
    message: " Adding project map to {input.md} as {output}"
    run:
@@ -27,18 +44,17 @@ rule md_postprocess:
       with open(input.md,"r") as orig:
           with open(output[0],"w") as out:
               out.write(orig.read())
-      # Append svg - allow for failures in this step as it is non-essential
+              # menus of the navbar are loaded from out_html/site_navbar.js
+              if skconfig.external_navbar:
+                  out.write(navbar_loader_html(skconfig, wildcards.out_base))
+      # Append the project map - allow for failures in this step as it is non-essential
       try:
           # Import here so that loaded graphviz library is not required 
-          from scikick.graph import make_dag 
-          outdir = os.path.dirname(wildcards.out_base)
-          md_root = os.path.join(skconfig.report_dir,"out_md")
-          path_to_root = os.path.relpath(md_root, os.path.join(md_root,outdir))
-          dg = make_dag(skconfig,"dot",path_from_root=path_to_root,subject=wildcards.out_base)
+          from scikick.graph import project_map_html
+          # shared out_html/project_map.svg (written before the run by
+          # write_site_files, pages only link to it)
           proj_map = '<br><br><details><summary> Next (Project Map) </summary>\n'
-          svg = dg.pipe(format="svg").decode('utf-8')
-          # Remove doctype string
-          proj_map = proj_map + '\n'.join(svg.split('\n')[3:])
+          proj_map = proj_map + project_map_html(skconfig, wildcards.out_base)
           proj_map = proj_map + '</details><hr></hr>'
       except Exception as e:
           warn(f"sk:  Warning: error during project map addition: {e}")
@@ -50,8 +66,8 @@ rule md_postprocess:
 # md => HTML via rmarkdown::render
 rule generate_html:
 	input:
-        # Should be just the _site.yml in the same directory (would need to split out_base into dir/file)
-		yaml = skconfig.get_site_yaml_files(),
+        # only the _site.yml in the same directory is used by rmarkdown::render
+		yaml = lambda w: skconfig.site_yaml_file(w.out_base),
 		md = "report/out_md/{out_base}_tmp.md"
 	output:
 		html = skconfig.html_pattern 
@@ -67,5 +83,5 @@ rule generate_html:
 	conda: skconfig.snakefile_arg("conda") # 'env/rmarkdown.yml'
 	singularity: skconfig.snakefile_arg("singularity") # 'docker://rocker/tidyverse'
 	# using 'shell:' instead of 'script:' for compatibility with renv
-	shell: "Rscript {generate_html_exe} '{input.md}' '{output}' '{params.index_html}'"
+	shell: generate_html_shell
 
@@ -1,11 +1,14 @@
 """Generate _site.yml files in out_md/"""
+import os
 import re
+import json
+from io import StringIO
 from os import getcwd
 from os.path import basename, dirname, join, relpath, sep
 from ruamel.yaml import YAML
 from scikick.config import ScikickConfig
-from scikick.layout import get_tabs
-from scikick.utils import git_repo_url, get_sk_exe_dir
+from scikick.utils import get_sk_exe_dir, warn
+from scikick.githistory import git_repo_url
 
 #https://stackoverflow.com/questions/29916065/how-to-do-camelcase-split-in-python
 def camel_case_split(identifier):
@@ -20,15 +23,67 @@ def clean_name(name):
     # TODO - camel case splitting
     return ret
 
-def main():
+def navbar_left(tabs, path_to_root):
+    """Menus of the navbar in _site.yml format
+    tabs -- layout.get_tabs() output
+    path_to_root -- path from the page to out_md/ (or out_html/)
+    """
+    nav_left = list()
+    for tab, items in tabs.items():
+        human_text = clean_name(tab)
+        # if first value is the key, this is a file
+        tabisfile = basename(items[0]) == tab
+        if tabisfile:
+            path_from_site_to_html = join(path_to_root,items[0])
+            this_item = {"text": human_text, "href": "%s.html" % path_from_site_to_html}
+        else:
+            this_item = {"text": human_text, "menu":[]} 
+            for item in items:
+                path_from_site_to_html = join(path_to_root,item)
+                sub_item = {"text": clean_name(basename(item)), "href": "%s.html" % path_from_site_to_html}
+                this_item['menu'].append(sub_item)
+        nav_left.append(this_item) 
+    return nav_left
+
+def navbar_script(skconfig):
+    """Content of skconfig.navbar_file (external navbar)"""
+    navbar = {"left": navbar_left(skconfig.tabs, "")}
+    with open(join(get_sk_exe_dir(), "workflow/site_rules/site_navbar.js"), "r") as js:
+        return "var skNavbar = %s;\n" % json.dumps(navbar) + js.read()
+
+def navbar_loader_html(skconfig, out_base):
+    """HTML of the page of out_base loading skconfig.navbar_file
+    (added with a script so that self contained pages do not inline it)
+    """
+    html_dir = dirname(skconfig.get_info(out_base, "html"))
+    src = relpath(skconfig.navbar_file, html_dir)
+    return '\n<script>(function() { var s = document.createElement("script");' + \
+        f' s.src = {json.dumps(src)}; document.body.appendChild(s); }})();</script>\n'
+
+def postprocess_inputs(skconfig):
+    """Site files the md_postprocess output of every page depends on
+    Pages of projects with a full project map only link to the map (sized
+    when it is viewed) and do not depend on it, pages of large projects
+    also show their neighbourhood in the map
+    """
+    # Import here so that loaded graphviz library is not required
+    from scikick.graph import large_project
+    if large_project(skconfig.project_graph):
+        return [skconfig.project_map_file]
+    return []
+
+def site_files(skconfig):
+    """Content of the _site.yml files and of the project map file
+    Returns {path: text}
+    """
     yaml = YAML(typ="rt")
-    skconfig = ScikickConfig()
+    yaml.indent(sequence=4, mapping=4, offset=0)
 
     # get tab strucutre
-    tabs = get_tabs(skconfig)
+    tabs = skconfig.tabs
     site_yaml_files = skconfig.get_site_yaml_files()
 
-    giturl = git_repo_url()
+    giturl = git_repo_url(skconfig)
     if giturl != '.':
         # get git repo url
         nav_more = {"text": "More", \
@@ -36,25 +91,16 @@ def main():
     else:
         nav_more = {}
 
+    files = dict()
     # translating the desired layout (get_tabs) to _site.yml format
     for site_yaml_file in site_yaml_files:
-        nav_left = list()
         # path from the site yaml to the output root
         path_to_root = relpath(join(skconfig.report_dir,'out_md'),start=dirname(site_yaml_file))
-        for tab, items in tabs.items():
-            human_text = clean_name(tab)
-            # if first value is the key, this is a file
-            tabisfile = basename(items[0]) == tab
-            if tabisfile:
-                path_from_site_to_html = join(path_to_root,items[0])
-                this_item = {"text": human_text, "href": "%s.html" % path_from_site_to_html}
-            else:
-                this_item = {"text": human_text, "menu":[]} 
-                for item in items:
-                    path_from_site_to_html = join(path_to_root,item)
-                    sub_item = {"text": clean_name(basename(item)), "href": "%s.html" % path_from_site_to_html}
-                    this_item['menu'].append(sub_item)
-            nav_left.append(this_item) 
+        if skconfig.external_navbar:
+            # menus are added by the navbar script when the page is viewed
+            nav_left = list()
+        else:
+            nav_left = navbar_left(tabs, path_to_root)
 
         site_yaml= { "navbar": {"title": clean_name(basename(getcwd())), \
                 "left": nav_left}} 
@@ -63,15 +109,64 @@ def main():
             site_yaml["navbar"]["right"] = [nav_more]
 
         if 'output' in skconfig.config.keys():
-            output_yaml = skconfig.config
+            # as plain data (as in the cached project model), so that the
+            # content does not depend on how scikick.yml was loaded
+            output_yaml = json.loads(json.dumps(skconfig.config))
         else:
             # TODO merge with scikick.yml
             output_yaml = yaml.load(open(join(get_sk_exe_dir(),"workflow/site_rules/default_output.yml"),"r")) 
             output_yaml['output']['rmarkdown::html_document']['pandoc_args'] = '--resource-path=.:' + path_to_root + '/../../'
         site_yaml.update(output_yaml)
 
-        yaml.indent(sequence=4, mapping=4, offset=0)
-        yaml.dump(site_yaml, open(site_yaml_file, "w"))
+        text = StringIO()
+        yaml.dump(site_yaml, text)
+        files[site_yaml_file] = text.getvalue()
+
+    # pages and dependencies drawn by md_postprocess
+    analysis = [[exe, list(skconfig.analysis[exe] or [])] for exe in skconfig.exes]
+    files[skconfig.project_map_file] = json.dumps(analysis, indent=1) + "\n"
+    if skconfig.external_navbar:
+        files[skconfig.navbar_file] = navbar_script(skconfig)
+    return files
+
+def outdated_site_files(skconfig):
+    """Site files that are missing or differ from what would be written
+    Returns {path: text}
+    """
+    outdated = dict()
+    for path, text in site_files(skconfig).items():
+        try:
+            with open(path, "r") as site_file:
+                if site_file.read() == text:
+                    continue
+        except OSError:
+            pass
+        outdated[path] = text
+    return outdated
+
+def write_site_files(skconfig):
+    """Write the site files whose content changed
+    Unchanged files are not written and keep their mtime, so pages are only
+    rendered again if the navbar (or the project map) changed
+    (with an external navbar, only the navbar script changes)
+    Returns the list of written files
+    """
+    outdated = outdated_site_files(skconfig)
+    for path, text in outdated.items():
+        os.makedirs(dirname(path), exist_ok=True)
+        with open(path, "w") as site_file:
+            site_file.write(text)
+    # The shared project map, pages only read it (see md_postprocess)
+    try:
+        # Import here so that loaded graphviz library is not required
+        from scikick.graph import write_project_map
+        write_project_map(skconfig)
+    except Exception as e:
+        warn(f"sk: Warning: error during project map layout: {e}")
+    return list(outdated.keys())
+
+def main():
+    write_site_files(ScikickConfig(readonly=True))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,67 @@
+// Navbar menus shared by all pages of the site (sk config --navbar external)
+// render_site_yamlgen.py prepends 'var skNavbar = {...};' with the menus
+// (links relative to this file)
+(function() {
+    var base = document.currentScript ? document.currentScript.src : document.baseURI;
+
+    function link(item) {
+        var a = document.createElement("a");
+        a.href = new URL(item.href, base).href;
+        a.textContent = item.text;
+        return a;
+    }
+
+    function tab_item(tab) {
+        var li = document.createElement("li");
+        if (tab.menu === undefined) {
+            li.appendChild(link(tab));
+            return li;
+        }
+        li.className = "dropdown";
+        var toggle = document.createElement("a");
+        toggle.href = "#";
+        toggle.className = "dropdown-toggle";
+        toggle.setAttribute("data-toggle", "dropdown");
+        toggle.setAttribute("data-bs-toggle", "dropdown");
+        toggle.setAttribute("role", "button");
+        toggle.setAttribute("aria-expanded", "false");
+        toggle.textContent = tab.text + " ";
+        var caret = document.createElement("span");
+        caret.className = "caret";
+        toggle.appendChild(caret);
+        var menu = document.createElement("ul");
+        menu.className = "dropdown-menu";
+        menu.setAttribute("role", "menu");
+        tab.menu.forEach(function(item) {
+            var sub = document.createElement("li");
+            sub.appendChild(link(item));
+            menu.appendChild(sub);
+        });
+        li.appendChild(toggle);
+        li.appendChild(menu);
+        return li;
+    }
+
+    function build() {
+        var left = document.querySelector(".navbar ul.navbar-nav:not(.navbar-right)");
+        if (left === null) {
+            var collapse = document.querySelector(".navbar .navbar-collapse");
+            if (collapse === null) {
+                return;
+            }
+            left = document.createElement("ul");
+            left.className = "nav navbar-nav";
+            collapse.insertBefore(left, collapse.firstChild);
+        }
+        left.innerHTML = "";
+        skNavbar.left.forEach(function(tab) {
+            left.appendChild(tab_item(tab));
+        });
+    }
+
+    if (document.readyState === "loading") {
+        document.addEventListener("DOMContentLoaded", build);
+    } else {
+        build();
+    }
+})();
@@ -1,9 +1,11 @@
 """basic functions used to read, modify, obtain config properties, and write scikick.yml"""
 import os
 import re
+import shutil
+import tempfile
 import ruamel.yaml as yaml
 from ruamel.yaml.compat import ordereddict
-from scikick.utils import reterr, warn, get_sk_exe_dir
+from scikick.utils import reterr, warn, get_sk_exe_dir, process_umask
 from scikick.init import add_version_info
 import scikick
 
@@ -26,7 +28,7 @@ def yaml_check(config):
     """Checks to be run 
     Check for unsupported fields in scikick.yml
     Check for project version vs scikick install version
-    config -- dict of scikick.yml
+    config -- dict of scikick.yml (may be read-only)
     """
     for k in config.keys():
         if k not in supported_yaml_fields:
@@ -44,7 +46,9 @@ def yaml_check(config):
 
     if write_fixes:
         warn("sk: Writing fixes to scikick.yml")
-        yaml_dump(config)
+        # config may have been read without round-trip support
+        ymli = yaml_in()
+        yaml_dump(add_version_info(ymli))
 
 
 # Add to ScikickConfig
@@ -69,23 +73,47 @@ def rm_commdir(text, commpath):
 
 def yaml_dump(ymli,skconf_path="scikick.yml"):
     """(Over)write a dictionary to scikick.yml.
+    The file is replaced atomically so it is never seen partially written.
     ymli -- dict
     """
     ymlo = yaml.YAML()
-    ymlo.dump(ymli, open(skconf_path, "w"))
+    skconf_dir = os.path.dirname(os.path.abspath(skconf_path))
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=skconf_dir, prefix=".scikick.yml.")
+    try:
+        with os.fdopen(tmp_fd, "w") as tmp_file:
+            ymlo.dump(ymli, tmp_file)
+        # mkstemp files are private, keep the usual permissions
+        if os.path.exists(skconf_path):
+            shutil.copymode(skconf_path, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o666 & ~process_umask)
+        os.replace(tmp_path, skconf_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def reterr_no_pages():
+    """Exit with an error for commands requiring pages in scikick.yml"""
+    reterr("sk: Error: no pages have been added to scikick.yml, " + \
+        "this can be done with\nsk: sk add my.rmd")
 
-def yaml_in(ymlpath='scikick.yml',need_pages=False):
+def yaml_in(ymlpath='scikick.yml',need_pages=False,readonly=False):
     """Read scikick.yml.
     Returns an ordereddict.
     need_pages -- logical, whether to error if analysis is empty
+    readonly -- logical, use the fastest available safe loader (C based
+        if present). The result can not be written back with yaml_dump
+        without losing comments and formatting.
     """
     #Exit with an error message if scikick.yml is not found
     if not os.path.isfile(ymlpath):
         reterr(f"sk: Error: {ymlpath} not found," + \
                "to get a template, run\nsk: sk init")
 
-    ymli = yaml.YAML()
-    ymli = ymli.load(open(ymlpath, "r"))
+    ymli = yaml.YAML(typ="safe") if readonly else yaml.YAML()
+    with open(ymlpath, "r") as ymlfile:
+        ymli = ymli.load(ymlfile)
 
     if ymli is None:
         warn("sk: Warning: scikick.yml is empty")
@@ -95,8 +123,7 @@ def yaml_in(ymlpath='scikick.yml',need_pages=False):
     # make sure that mandatory fields are present
     if "analysis" not in ymli.keys():
         if need_pages:
-            reterr("sk: Error: no pages have been added to scikick.yml, " + \
-                "this can be done with\nsk: sk add my.rmd")
+            reterr_no_pages()
         else:
             warn("sk: Warning: scikick.yml is missing analysis field") 
             ymli["analysis"] = ordereddict()
@@ -105,8 +132,7 @@ def yaml_in(ymlpath='scikick.yml',need_pages=False):
             ymli["analysis"] = ordereddict()
         if len(ymli["analysis"]) == 0:
             if need_pages:
-                reterr("sk: Error: no pages have been added to scikick.yml, " + \
-                    "this can be done with\nsk: sk add my.rmd")
+                reterr_no_pages()
             else:
                 ymli["analysis"] = ordereddict()
 
@@ -118,26 +144,14 @@ def yaml_in(ymlpath='scikick.yml',need_pages=False):
 
 def rename(name_a, name_b):
     """Rename file 'a' in scikick.yml to 'b'
+    For many files use ConfigTransaction.rename() to write once
     a -- string (filename)
     b -- string (filename)
     """
-    found = 0
-    ymli = yaml_in(need_pages=True)
-    ## rename keys (ana)
-    if name_a in ymli["analysis"].keys():
-        index_a = list(ymli["analysis"].keys()).index(name_a)
-        ymli["analysis"].insert(index_a, name_b, ymli["analysis"].pop(name_a))
-        found = 1
-    ## rename values (deps)
-    if ymli["analysis"] is not None:
-        for k in ymli["analysis"].keys():
-            if ymli["analysis"][k] is not None and \
-                name_a in ymli["analysis"][k]:
-                ymli["analysis"][k][ymli["analysis"][k].index(name_a)] = \
-                    name_b
-                found = 1
-    yaml_dump(ymli)
-    return found
+    from scikick.config import ConfigTransaction
+    with ConfigTransaction(need_pages=True) as txn:
+        found = txn.rename({name_a: name_b})
+    return 1 if name_a in found else 0
 
 ### Check functions for add()
 wildcard_symbols = ["*", "?", "[", "{", "]", "}", "\\"]
@@ -223,9 +237,11 @@ def add(files, deps=list(), force=False, copy_deps=None):
     force -- bool whether to add additional index files
     copy_deps -- file to copy dependencies from
     """
+    from scikick.config import ConfigTransaction
     if deps is None:
         deps = list()
-    ymli = yaml_in()
+    txn = ConfigTransaction()
+    ymli = txn.config
     if copy_deps is not None:
         # copy_deps(src,dest)
         copy_deps = copy_deps[0]
@@ -244,44 +260,31 @@ def add(files, deps=list(), force=False, copy_deps=None):
         add_fname = add_check(fname, ymli, force, deps) 
         if add_fname: 
             # add near scripts in the same directory
-            if len(ymli["analysis"].keys()) > 0:
-                commpath = os.path.commonpath(list(ymli["analysis"].keys()))
-            else:
-                commpath = ""
-            tab_name = os.path.dirname(rm_commdir(fname, commpath))
-            all_tabs = list(map(lambda f:
-                os.path.dirname(rm_commdir(f, commpath)),
-                ymli["analysis"].keys()))
-            tab_matches = list(filter(lambda i:
-                all_tabs[i] == tab_name, range(len(all_tabs))))
-            if (tab_name != "") and (len(tab_matches) != 0):
-                ymli["analysis"].insert(tab_matches[-1] + 1, fname, [])
-            else:
-                ymli['analysis'][fname] = None
+            txn.add_page(fname)
             warn(f"sk: Added {fname}")
         # Add dependencies
         for dep in deps:
             # Should the dep be added?
             add_dep = add_dep_checks(fname, ymli, force, dep) 
             if add_dep:
-                if ymli['analysis'][fname] is None:
-                    ymli['analysis'][fname] = []
-                ymli['analysis'][fname].append(dep)
+                txn.add_dep(fname, dep)
                 warn(f"sk: Added dependency {dep} to {fname}")
                 if dep in ymli["analysis"].keys():
                     warn(f"sk:   {fname} will be executed after any executions of {dep}")
                 else:
                     warn(f"sk:   {fname} will be executed after any modifications to {dep}")
-    yaml_dump(ymli)
+    txn.commit()
 
 def rm(files, deps):
     """ Delete files and dependencies from them
     files - page file list
     deps - dependency file list
     """
+    from scikick.config import ConfigTransaction
     if deps is None:
         deps = list()
-    ymli = yaml_in(need_pages=True)
+    txn = ConfigTransaction(need_pages=True)
+    ymli = txn.config
     for fname in files:
         # check if rmd included
         if fname not in ymli['analysis'].keys():
@@ -289,27 +292,22 @@ def rm(files, deps):
             continue
         # delete script entry if no dependencies specified
         if len(deps) == 0:
-            del ymli['analysis'][fname]
+            txn.rm_page(fname)
             warn(f"sk: {fname} removed")
             # Check if fname was a dependency for other scripts
-            for val in ymli['analysis'].values():
-                if val is not None:
-                    if fname in val:
-                        warn(f"sk: Warning: {fname} is still a dependency of other scripts")
-                        warn(f"sk:   Use sk del -d {fname} <script> to change this")  
+            for _ in txn.dependents.get(fname, []):
+                warn(f"sk: Warning: {fname} is still a dependency of other scripts")
+                warn(f"sk:   Use sk del -d {fname} <script> to change this")  
         # delete only deps if deps specified
         else:
             if ymli['analysis'][fname] is None:
                 warn(f"sk: Warning: File {fname} has no dependencies")
                 continue
             for dep in deps:
-                if dep in ymli['analysis'][fname]:
-                    ymli['analysis'][fname].remove(dep)
+                if txn.rm_dep(fname, dep):
                     warn(f"sk: dependency {dep} removed from {fname}")
                 else:
                     warn(f"sk: no dependency {dep} found for {fname}")
-                if len((ymli['analysis'][fname])) == 0:
-                    ymli['analysis'][fname] = None
         if os.path.splitext(os.path.basename(fname))[0] == "index":
             index_list = get_indexes(ymli)
             if len(index_list) == 0:
@@ -318,7 +316,7 @@ def rm(files, deps):
                 "workflow","notebook_rules", "index.Rmd"), None)
             elif len(index_list) == 1:
                 os.utime(index_list[0], None)
-    yaml_dump(ymli)
+    txn.commit()
 
 # Unused
 def site(args):
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import shutil
+import unittest
+from scikick.config import ScikickConfig, ConfigTransaction
+from scikick.config import write_snakefile_arg, write_page_resource
+from scikick.layout import get_tabs, rearrange_tabs
+
+exe_dir = os.path.dirname(os.path.realpath(__file__))
+test_datadir = os.path.join(exe_dir, "data", "test_layout")
+project_dir = tempfile.TemporaryDirectory()
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        if os.path.isdir(project_dir.name):
+            shutil.rmtree(project_dir.name)
+        shutil.copytree(test_datadir, project_dir.name)
+        os.chdir(project_dir.name)
+    def tearDown(self):
+        project_dir.cleanup()
+
+    def test_get_info(self):
+        skconf = ScikickConfig()
+        row = skconf.get_info("subdir/a.Rmd")
+        for lab in skconf.core_output_keys:
+            value = row[skconf.core_output_labels.index(lab)]
+            assert skconf.get_info(value) == row
+        assert skconf.get_info("report/out_md/subdir/a.md", "exe") == "subdir/a.Rmd"
+        assert skconf.get_info("subdir/a", "figdir") == "report/out_md/subdir/figure/a"
+        assert skconf.get_info("report/out_md/./subdir/b_tmp.md", "html") == \
+            "report/out_html/subdir/b.html"
+        assert skconf.get_info("index", "md") == "report/out_md/index.md"
+        assert skconf.get_info("not/a/page.Rmd") is None
+
+    def test_invalidate(self):
+        skconf = ScikickConfig()
+        exes = skconf.exes
+        # returned lists must not alias the cache
+        exes.remove("f.r")
+        assert "f.r" in skconf.exes
+        skconf = rearrange_tabs([3, 2, 1], skconf, get_tabs(skconf))
+        assert skconf.exes[0] == "subdir/subsub/inside.Rmd"
+        assert skconf.out_bases[0] == "subdir/subsub/inside"
+
+    def test_readonly(self):
+        skconf = ScikickConfig()
+        readonly = ScikickConfig(readonly=True)
+        assert readonly.analysis == skconf.analysis
+        assert readonly.exe_core_outputs == skconf.exe_core_outputs
+
+    def test_model_cache(self):
+        skconf = ScikickConfig(readonly=True)
+        model_file = ScikickConfig.model_path(skconf.report_dir)
+        # read-only usage writes nothing
+        assert not os.path.exists(model_file)
+        skconf.save_model()
+        assert os.path.isfile(model_file)
+        cached = ScikickConfig(readonly=True)
+        # loaded from JSON
+        assert cached.model_loaded
+        assert type(cached.config) is dict
+        assert cached.exe_core_outputs == skconf.exe_core_outputs
+        assert cached.tabs == skconf.tabs
+        assert cached.inferred_inputs == skconf.inferred_inputs
+        # any change to scikick.yml is a cache miss
+        with open("scikick.yml", "a") as ymlfile:
+            ymlfile.write("# modified\n")
+        assert not ScikickConfig(readonly=True).model_loaded
+
+    def test_transaction(self):
+        with ConfigTransaction() as txn:
+            txn.add_dep("subdir/b.Rmd", "subdir/a.Rmd")
+            txn.add_dep("subdir/subsub/inside.Rmd", "subdir/a.Rmd")
+            found = txn.rename({"subdir/a.Rmd": "subdir/c.Rmd",
+                "not/in/config.txt": "x.txt"})
+            assert found == {"subdir/a.Rmd"}
+            assert txn.rm_dep("subdir/b.Rmd", "subdir/c.Rmd")
+            assert not txn.rm_dep("subdir/b.Rmd", "subdir/c.Rmd")
+        analysis = ScikickConfig().analysis
+        assert list(analysis.keys()) == ["f.r", "subdir/c.Rmd",
+            "subdir/b.Rmd", "subdir/subsub/inside.Rmd"]
+        assert analysis["subdir/b.Rmd"] is None
+        assert analysis["subdir/subsub/inside.Rmd"] == ["subdir/c.Rmd"]
+        assert not any(f.startswith(".scikick.yml") for f in os.listdir("."))
+
+    def test_page_resources(self):
+        write_snakefile_arg("threads", 2)
+        write_page_resource("subdir/a.Rmd", "threads", 8)
+        write_page_resource("subdir/a.Rmd", "mem_mb", 4000)
+        skconf = ScikickConfig()
+        assert skconf.page_resource("subdir/a", "threads") == 8
+        assert skconf.page_resource("subdir/a", "mem_mb") == 4000
+        assert skconf.page_resource("subdir/b", "threads") == 2
+        assert skconf.page_resource("subdir/b", "mem_mb") == 0
+        # resources follow their page
+        with ConfigTransaction() as txn:
+            txn.rename({"subdir/a.Rmd": "subdir/c.Rmd"})
+        assert ScikickConfig().page_resource("subdir/c", "threads") == 8
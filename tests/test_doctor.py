@@ -0,0 +1,79 @@
+import os
+import json
+import tempfile
+import subprocess
+import unittest
+
+# Stand-ins for Rscript and pandoc, Rscript logs each call
+fake_rscript = """#!/bin/sh
+echo call >> "$SK_TEST_RSCRIPT_LOG"
+shift 2
+for p in "$@"; do echo "$p 1.0.0"; done
+echo "R 4.3.0"
+"""
+fake_pandoc = """#!/bin/sh
+echo "pandoc 3.1.2"
+"""
+
+class TestDoctor(unittest.TestCase):
+    def setUp(self):
+        self.project_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.project_dir.name)
+        os.mkdir("bin")
+        for name, script in [("Rscript", fake_rscript), ("pandoc", fake_pandoc)]:
+            with open(os.path.join("bin", name), "w") as f:
+                f.write(script)
+            os.chmod(os.path.join("bin", name), 0o755)
+        self.env = dict(os.environ,
+            PATH=os.path.abspath("bin") + os.pathsep + os.environ["PATH"],
+            XDG_CACHE_HOME=os.path.abspath("cache"),
+            SK_TEST_RSCRIPT_LOG=os.path.abspath("rscript.log"))
+    def tearDown(self):
+        self.project_dir.cleanup()
+
+    def sk(self, args):
+        return subprocess.run(f"sk {args}", shell=True, env=self.env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def rscript_calls(self):
+        with open("rscript.log") as f:
+            return len(f.readlines())
+
+    def test_doctor(self):
+        out = self.sk("doctor")
+        assert out.returncode == 0
+        assert "knitr 1.0.0" in out.stdout.decode()
+        assert "pandoc: pandoc 3.1.2" in out.stdout.decode()
+        # all R packages are checked by a single Rscript
+        assert self.rscript_calls() == 1
+        with open(os.path.join("cache", "scikick", "requirements.json")) as f:
+            cache = json.load(f)
+        assert cache["tools"]["pandoc"]["line"] == "pandoc 3.1.2"
+        # sk init uses the cached results
+        assert self.sk("init -y").returncode == 0
+        assert os.path.isfile("scikick.yml")
+        assert self.rscript_calls() == 1
+        # sk doctor checks again
+        assert self.sk("doctor").returncode == 0
+        assert self.rscript_calls() == 2
+
+    def test_doctor_changed_tool(self):
+        assert self.sk("doctor").returncode == 0
+        # a new version of Rscript (mtime changed) is checked again
+        st = os.stat(os.path.join("bin", "Rscript"))
+        os.utime(os.path.join("bin", "Rscript"), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert self.sk("init -y").returncode == 0
+        assert self.rscript_calls() == 2
+
+    def test_doctor_missing_package(self):
+        with open(os.path.join("bin", "Rscript"), "w") as f:
+            f.write(fake_rscript.replace('echo "$p 1.0.0"', 'echo "$p NA"'))
+        out = self.sk("doctor")
+        assert out.returncode != 0
+        assert "required R library 'knitr' is not installed" in out.stdout.decode()
+        # missing packages are not cached
+        self.sk("init -y")
+        assert self.rscript_calls() == 2
+
+if __name__ == '__main__':
+    unittest.main()
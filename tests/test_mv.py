@@ -81,6 +81,62 @@ class TestMv(unittest.TestCase):
         assert "code/subdir/page1.Rmd" in yaml_in()["analysis"].keys()
         assert "code/subdir/page2.Rmd" in yaml_in()["analysis"].keys()
 
+    def test_mv_dryrun(self):
+        assert os.system("sk run") == 0
+        out = subprocess.run("sk mv code/subdf code/subdf2 --dry-run", \
+            shell=True, stdout=subprocess.PIPE)
+        assert out.returncode == 0
+        plan = out.stdout.decode()
+        assert "sk: mv code/subdf code/subdf2" in plan
+        assert "sk: code/subdf/pagesd.Rmd -> code/subdf2/pagesd.Rmd in ./scikick.yml" in plan
+        # nothing was moved
+        assert os.path.isfile("code/subdf/pagesd.Rmd")
+        assert os.path.isfile("report/out_md/code/subdf/pagesd.md")
+        assert "code/subdf/pagesd.Rmd" in yaml_in()["analysis"].keys()
+
+    def test_mv_figure_refs(self):
+        assert os.system("sk run") == 0
+        os.makedirs("report/out_md/code/figure/page1")
+        open("report/out_md/code/figure/page1/plot.png", "w").close()
+        with open("report/out_md/code/page1.md", "a") as md:
+            md.write('<img src="figure/page1/plot.png">\n')
+        mtime = os.stat("report/out_md/code/page1.md").st_mtime_ns
+        # a shorter name leaves no trailing content in the md
+        assert os.system("sk mv code/page1.Rmd code/p.Rmd") == 0
+        assert os.path.isfile("report/out_md/code/figure/p/plot.png")
+        with open("report/out_md/code/p.md") as md:
+            assert md.read().endswith('<img src="figure/p/plot.png">\n')
+        assert os.stat("report/out_md/code/p.md").st_mtime_ns == mtime
+        # the html (at the same depth) is moved too
+        assert os.path.isfile("report/out_html/code/p.html")
+        assert not os.path.exists("report/out_html/code/page1.html")
+
+    def test_mv_comments(self):
+        with open("scikick.yml") as ymlfile:
+            yml = ymlfile.read()
+        yml = yml.replace("- code/page1.Rmd:\n", "- code/page1.Rmd: # first page\n")
+        yml = yml.replace("- code/page2.Rmd:\n", "- code/page2.Rmd: # second page\n")
+        with open("scikick.yml", "w") as ymlfile:
+            ymlfile.write(yml)
+        assert os.system("sk mv code/page1.Rmd code/page3.Rmd") == 0
+        # comments stay with their (renamed) entries, in order
+        with open("scikick.yml") as ymlfile:
+            yml = ymlfile.read()
+        assert yml.startswith("# WARNING: Do not edit this file by hand\n")
+        assert "- code/page3.Rmd: # first page\n- code/page2.Rmd: # second page\n" in yml
+
+    def test_mv_map_node(self):
+        assert os.system("sk run") == 0
+        node = lambda out_base: "sk_" + out_base.encode().hex()
+        with open("report/out_html/code/page1.html", "a") as html:
+            html.write(f'<iframe src="../project_map.svg#{node("code/page1")}"></iframe>\n')
+        mtime = os.stat("report/out_html/code/page1.html").st_mtime_ns
+        # the moved html highlights the node of its new name
+        assert os.system("sk mv code/page1.Rmd code/p.Rmd") == 0
+        with open("report/out_html/code/p.html") as html:
+            assert html.read().endswith(f'<iframe src="../project_map.svg#{node("code/p")}"></iframe>\n')
+        assert os.stat("report/out_html/code/p.html").st_mtime_ns == mtime
+
     def test_mv_mul2onef(self):
         assert os.system("sk mv code/*.Rmd code/subdf/pagesd.Rmd") != 0
 
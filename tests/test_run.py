@@ -1,4 +1,6 @@
 import os
+import json
+import subprocess
 import tempfile
 import shutil
 import unittest
@@ -35,6 +37,123 @@ class TestRun(unittest.TestCase):
         for curr_file in all_htmls:
            self.assertTrue(os.path.isfile(os.path.join(html_dir, curr_file)))
 
+    def test_run_snakeargs(self):
+        # snakemake command with loghandler.py events
+        assert os.system("sk run -s '--cores 1'") == 0
+        html_dir = os.path.join("report", "out_html")
+        for curr_file in htmls:
+            self.assertTrue(os.path.isfile(os.path.join(html_dir, curr_file)))
+
+    def test_run_build_cache(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        assert os.system(f"sk config --build_cache {cache_dir.name}") == 0
+        assert os.system("sk run") == 0
+        shutil.rmtree("report")
+        # outputs of unchanged scripts are restored
+        rerun = subprocess.run("sk run", shell=True, stdout=subprocess.PIPE, \
+            stderr=subprocess.STDOUT)
+        assert rerun.returncode == 0
+        self.assertIn("Restored report/out_md/code/page1.md", rerun.stdout.decode())
+        html_dir = os.path.join("report", "out_html")
+        for curr_file in htmls:
+            self.assertTrue(os.path.isfile(os.path.join(html_dir, curr_file)))
+        cache_dir.cleanup()
+
+    def test_run_git_history(self):
+        git = "git -c user.name=sk -c user.email=sk@example.com"
+        assert os.system(f"git init -q && {git} remote add origin " + \
+            "git@github.com:user/project.git && git add code && " + \
+            f"{git} commit -q -m first && {git} commit -q --allow-empty -m second") == 0
+        assert os.system("sk run") == 0
+        history_dir = os.path.join("report", "sk_cache", "git_history")
+        with open(os.path.join(history_dir, "project.json")) as history_file:
+            self.assertEqual([commit[3] for commit in json.load(history_file)], \
+                ["second", "first"])
+        # each page has its own file with the commits of its script
+        with open(os.path.join(history_dir, "paths", "code", "page1.Rmd.json")) \
+            as history_file:
+            self.assertEqual([commit[3] for commit in json.load(history_file)], \
+                ["first"])
+        with open(os.path.join("report", "out_md", "_site.yml")) as site_yml:
+            self.assertIn("https://github.com/user/project", site_yml.read())
+
+    def test_run_git_history_latest(self):
+        from scikick.githistory import path_max_commits
+        git = "git -c user.name=sk -c user.email=sk@example.com"
+        assert os.system(f"git init -q && git add code && {git} commit -q -m c0") == 0
+        for i in range(1, path_max_commits + 2):
+            with open("code/page1.Rmd", "a") as rmd:
+                rmd.write("\n")
+            assert os.system(f"git add code && {git} commit -q -m c{i}") == 0
+        assert os.system("sk run") == 0
+        history_dir = os.path.join("report", "sk_cache", "git_history")
+        # only the latest commits of a script are kept for its footer
+        with open(os.path.join(history_dir, "paths", "code", "page1.Rmd.json")) \
+            as history_file:
+            self.assertEqual([commit[3] for commit in json.load(history_file)], \
+                [f"c{i}" for i in range(path_max_commits + 1, 1, -1)])
+        with open(os.path.join(history_dir, "paths", "code", "page2.Rmd.json")) \
+            as history_file:
+            self.assertEqual([commit[3] for commit in json.load(history_file)], \
+                ["c0"])
+        with open(os.path.join(history_dir, "project.json")) as history_file:
+            self.assertEqual(len(json.load(history_file)), path_max_commits + 2)
+
+    def test_run_early_cutoff(self):
+        assert os.system("sk config --early_cutoff 1") == 0
+        assert os.system("sk run") == 0
+        with open("report/out_md/code/page1.md", "rb") as md:
+            previous_md = md.read()
+        # only the volatile footer content of page1.md changes
+        with open("code/page1.Rmd", "a") as rmd:
+            rmd.write("Computation Started: `now`\n")
+        rerun = subprocess.run("sk run", shell=True, stdout=subprocess.PIPE, \
+            stderr=subprocess.STDOUT)
+        assert rerun.returncode == 0
+        output = rerun.stdout.decode()
+        self.assertIn("report/out_md/code/page1.md is unchanged (early cutoff)", output)
+        self.assertIn("report/out_md/code/page2.md is up to date (early cutoff)", output)
+        self.assertIn("report/out_html/code/page2.html is up to date (early cutoff)", output)
+        # the previous md is kept
+        with open("report/out_md/code/page1.md", "rb") as md:
+            self.assertEqual(md.read(), previous_md)
+
+    def run_output(self, args):
+        out = subprocess.run(f"sk run {args}", shell=True, stdout=subprocess.PIPE, \
+            stderr=subprocess.STDOUT)
+        assert out.returncode == 0
+        return out.stdout.decode()
+
+    def test_run_downstream(self):
+        os.mkdir("data")
+        with open("data/x.csv", "w") as csv:
+            csv.write("1\n")
+        shutil.copy("code/page1.Rmd", "code/page3.Rmd")
+        assert os.system("sk add code/page3.Rmd && sk add code/page1.Rmd -d data/x.csv") == 0
+        assert os.system("sk run") == 0
+        with open("data/x.csv", "a") as csv:
+            csv.write("2\n")
+        with open("code/page3.Rmd", "a") as rmd:
+            rmd.write("\n")
+        # page1 and page2 (depending on page1) are built, not page3
+        output = self.run_output("--downstream data/x.csv")
+        self.assertIn("Executing code in code/page1.Rmd", output)
+        self.assertIn("Executing code in code/page2.Rmd", output)
+        self.assertNotIn("page3", output)
+        self.assertIn("Executing code in code/page3.Rmd", self.run_output("-d"))
+
+    def test_run_no_upstream(self):
+        assert os.system("sk run") == 0
+        for rmd_path in ["code/page1.Rmd", "code/page2.Rmd"]:
+            with open(rmd_path, "a") as rmd:
+                rmd.write("\n")
+        # the current page1.md is used
+        output = self.run_output("--only code/page2.Rmd --no-upstream")
+        self.assertIn("Executing code in code/page2.Rmd", output)
+        self.assertNotIn("Executing code in code/page1.Rmd", output)
+        self.assertIn("Executing code in code/page1.Rmd", \
+            self.run_output("--only code/page2.Rmd -d"))
+        assert os.system("sk run --only code/missing.Rmd") != 0
+
 if __name__ == '__main__':
     unittest.main()
-
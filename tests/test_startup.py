@@ -0,0 +1,50 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+# Modules that no subcommand other than run and status imports
+heavy_modules = ["snakemake", "graphviz", "scikick.snakemake", "scikick.status"]
+# Modules sk --help and sk --version do not import either
+startup_modules = heavy_modules + ["ruamel", "scikick.config", "scikick.yaml"]
+
+def sk_imports(modules):
+    """Run the sk entry point and print the modules it imported"""
+    return "import sys, atexit\n" + \
+        f"atexit.register(lambda: print([m for m in {modules} if m in sys.modules]))\n" + \
+        "from scikick.scikick import main\n" + \
+        "sys.argv[0] = 'sk'\n" + \
+        "main()\n"
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        self.project_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.project_dir.name)
+        shutil.copy(os.path.join(os.path.dirname(__file__), "..", "scikick",
+            "usr", "scikick.yml"), "scikick.yml")
+        open("a.Rmd", "w").close()
+        # add version info to scikick.yml
+        subprocess.run(["sk", "add", "a.Rmd"], stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+    def tearDown(self):
+        self.project_dir.cleanup()
+
+    def imported(self, modules, *args):
+        out = subprocess.run([sys.executable, "-c", sk_imports(modules)] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return out.stdout.decode().strip().split("\n")[-1]
+
+    def test_help_imports(self):
+        assert self.imported(startup_modules, "--help") == "[]"
+
+    def test_version_imports(self):
+        assert self.imported(startup_modules, "--version") == "[]"
+
+    def test_add_imports(self):
+        open("b.Rmd", "w").close()
+        assert self.imported(heavy_modules, "add", "b.Rmd", "-d", "a.Rmd") == "[]"
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,10 +20,12 @@ class TestStatus(unittest.TestCase):
     def tearDown(self):
         project_dir.cleanup()
 
-    def output_check(self,out_fname, verbose=False):
+    def output_check(self,out_fname, verbose=False, snakemake=False):
         skstat_cmd = "sk status"
         if verbose:
             skstat_cmd += " -v"
+        if snakemake:
+            skstat_cmd += " --snakemake"
         status = subprocess.Popen(skstat_cmd, shell=True, stdout=subprocess.PIPE)
         current_output = status.stdout.read().decode()
         with open(os.path.join(output_dir, out_fname)) as out_file:
@@ -53,11 +55,73 @@ class TestStatus(unittest.TestCase):
         os.system("rm code/page2.Rmd")
         self.output_check("output4.txt", True)
 
+    def test_status_touch_snakemake(self):
+        # status from a snakemake dry-run
+        os.system("sk run")
+        os.system("echo 'trigger rerun' >> code/page1.Rmd")
+        self.output_check("output3_v.txt", True, True)
+
+    def test_status_touch_unchanged(self):
+        # e.g. after git checkout, only content changes trigger execution
+        os.system("sk run")
+        shutil.rmtree(".snakemake")
+        os.system("sleep 1; touch code/page1.Rmd code/page2.Rmd scikick.yml")
+        fingerprints = os.path.join("report", "sk_cache", "fingerprints.json")
+        recorded = os.stat(fingerprints).st_mtime_ns
+        self.output_check("output2.txt")
+        # sk status does not write the fingerprints
+        self.assertEqual(os.stat(fingerprints).st_mtime_ns, recorded)
+
+    def test_status_touch_metadata(self):
+        # the native status agrees with snakemake (and its own metadata)
+        os.system("sk run")
+        os.system("sleep 1; touch code/page1.Rmd code/page2.Rmd")
+        self.output_check("output2.txt")
+        self.output_check("output2.txt", snakemake=True)
+        shutil.rmtree(os.path.join(".snakemake", "metadata"))
+        self.output_check("output2.txt")
+
     def test_status_touch_config(self):
+        # scikick.yml changes not affecting the site do not render pages
         os.system("sk run")
-        os.system("echo '# trigger rerun' >> scikick.yml")
+        os.system("echo '# no rerun' >> scikick.yml")
+        self.output_check("output2.txt")
+
+    def test_status_site_output(self):
+        # site-wide output options render all pages
+        os.system("sk run")
+        os.system("printf 'output:\\n  BiocStyle::html_document:\\n" + \
+            "    code_folding: hide\\n' >> scikick.yml")
         self.output_check("output5.txt")
 
+    def test_status_layout(self):
+        # navbar changes render all pages
+        os.system("sk run")
+        os.system("sk layout 2 1")
+        self.output_check("output11.txt")
+
+    def test_status_add_dependency(self):
+        # only the page with the new dependency is rendered, the others
+        # show the project map without depending on it
+        os.system("sk run")
+        os.system("echo 1 > data.csv; sk add code/page2.Rmd -d data.csv")
+        self.output_check("output12.txt", True)
+
+    def test_status_external_navbar(self):
+        # only the added page is rendered, its menu is in site_navbar.js
+        os.system("sk config --navbar external")
+        os.system("sk run")
+        os.system("mkdir other; cp code/page1.Rmd other/page3.Rmd")
+        os.system("sk add other/page3.Rmd")
+        # sk status only compares files, it does not lay out the project map
+        shutil.rmtree(os.path.join("report", "sk_cache", "project_map"), \
+            ignore_errors=True)
+        self.output_check("output10.txt")
+        assert not os.path.exists(os.path.join("report", "sk_cache", "project_map"))
+        os.system("sk run")
+        with open("report/out_html/site_navbar.js") as navbar:
+            assert "other/page3.html" in navbar.read()
+
     def test_status_nohtml(self):
         os.system("sk run")
         os.system("rm report/out_html/code/*.html")